@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Measure the throughput, cpu overhead and timing accuracy of the check pipeline, against a local stand-in server.
+
+The stand-in server runs in a separate process (so its cpu time is not measured), every url check has a known
+latency, which is compared to the response time measured by the check.
+
+Usage:
+
+    python benchmarks/bench_checks.py [--checks N] [--urls N] [--latency MS] [--latency-jitter MS] [--body-size BYTES]
+                                      [--error-rate RATE] [--regex REGEX] [--seed N] [--output FILE]
+
+Prints the result as a json object, and appends it to the output file (one json object per line), if specified.
+"""
+
+import argparse
+import json
+import logging
+
+import anyio
+from upcheck.utils.bench import (
+    create_url_checks,
+    environment_details,
+    run_check_benchmark,
+    start_server_process,
+)
+
+
+def main(
+    checks: int = 1000,
+    urls: int = 10,
+    latency: float = 0,
+    latency_jitter: float = 0,
+    body_size: int = 1024,
+    error_rate: float = 0,
+    regex: str = None,
+    seed: int = 0,
+    output: str = None,
+):
+
+    # check errors are logged by the pipeline, which would distort the measurements
+    logging.getLogger("upcheck").setLevel(logging.CRITICAL)
+
+    process, base_url = start_server_process(
+        body_size=body_size, error_rate=error_rate, seed=seed
+    )
+    try:
+        url_checks = create_url_checks(
+            base_url,
+            urls=urls,
+            latency=latency,
+            latency_jitter=latency_jitter,
+            regex=regex,
+            seed=seed,
+        )
+        measurements = anyio.run(run_check_benchmark, url_checks, checks)
+    finally:
+        process.terminate()
+        process.join()
+
+    result = {
+        "benchmark": "checks",
+        "parameters": {
+            "checks": checks,
+            "urls": urls,
+            "latency": latency,
+            "latency_jitter": latency_jitter,
+            "body_size": body_size,
+            "error_rate": error_rate,
+            "regex": regex,
+            "seed": seed,
+        },
+        "results": measurements,
+        "environment": environment_details(),
+    }
+    print(json.dumps(result))
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--checks", type=int, default=1000)
+    parser.add_argument("--urls", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--latency-jitter", type=float, default=0)
+    parser.add_argument("--body-size", type=int, default=1024)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--regex", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Measure the throughput of consuming check results from Kafka, and writing them to Kafka and Postgres targets.
+
+Kafka and Postgres are replaced by in-process stand-ins (check 'upcheck.utils.standins'), with a configurable latency
+per operation, and failure rate of the targets, so the results only depend on the batching, backpressure and
+encoding code paths of 'upcheck'.
+
+The failure rate applies to every single operation (send or insert). A failed write is retried for the whole batch,
+so messages of a batch that were already written are written again ('duplicates'), and large batches combined with
+high failure rates might never make progress.
+
+Usage:
+
+    python benchmarks/bench_kafka.py [--messages N] [--batch-size N] [--latency MS] [--failure-rate RATE]
+                                     [--passthrough] [--postgres] [--output FILE]
+
+Prints the result as a json object, and appends it to the output file (one json object per line), if specified.
+"""
+
+import argparse
+import json
+import logging
+import time
+
+import anyio
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.sources.kafka import KafkaSource
+from upcheck.targets import postgres as postgres_targets
+from upcheck.targets.kafka import KafkaTarget
+from upcheck.targets.postgres import PostgresTarget
+from upcheck.upcheck import Upcheck
+from upcheck.utils import kafka as kafka_utils
+from upcheck.utils.bench import environment_details
+from upcheck.utils.kafka import (
+    create_message_headers,
+    create_message_key,
+    encode_check_metric,
+)
+from upcheck.utils.standins import FakeKafkaBroker, FakePostgresDatabase
+
+
+TOPIC = "check_metrics"
+SOURCE_PORT = 9092
+TARGET_PORT = 9093
+
+
+def create_source_broker(messages: int, urls: int = 100) -> FakeKafkaBroker:
+
+    broker = FakeKafkaBroker()
+    url_checks = [UrlCheck(url=f"https://frkl.io/{i}") for i in range(urls)]
+    for i in range(messages):
+        metric = CheckMetric(
+            url_check=url_checks[i % urls],
+            check_time=1594000000000000 + i * 1000,
+            response_time=100 + i % 500,
+            response_code=200 if i % 20 else 503,
+            regex_matched=None,
+        )
+        broker.append(
+            TOPIC,
+            encode_check_metric(metric),
+            key=create_message_key(metric),
+            headers=create_message_headers(metric),
+        )
+    return broker
+
+
+async def run(
+    messages: int,
+    batch_size: int,
+    latency: float,
+    failure_rate: float,
+    passthrough: bool,
+    postgres: bool,
+):
+
+    source_broker = create_source_broker(messages)
+    target_broker = FakeKafkaBroker(latency=latency, failure_rate=failure_rate, seed=0)
+    database = FakePostgresDatabase(latency=latency, failure_rate=failure_rate, seed=0)
+
+    # source and target are told apart by their ports
+    brokers = {SOURCE_PORT: source_broker, TARGET_PORT: target_broker}
+    kafka_utils.broker_factory = lambda host, port: brokers[port]
+    postgres_targets.connection_factory = database.connect
+
+    source = KafkaSource(
+        host="localhost",
+        port=SOURCE_PORT,
+        topic=TOPIC,
+        batch_max_records=batch_size,
+        batch_timeout_ms=10,
+        retry_interval=0,
+        passthrough=passthrough,
+    )
+    targets = [KafkaTarget(host="localhost", port=TARGET_PORT, topic="mirror")]
+    if postgres:
+        targets.append(
+            PostgresTarget(username="upcheck", password="upcheck", dbname="upcheck")
+        )
+    upcheck = Upcheck(source=source, targets=targets)
+    await upcheck.connect()
+
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+
+    async def consume():
+        await upcheck.start(wait_for_keypress=False)
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(consume)
+        while source_broker.committed("upcheck", TOPIC) != messages:
+            await anyio.sleep(0.001)
+        await tg.cancel_scope.cancel()
+
+    duration = time.perf_counter() - started
+    cpu_time = time.process_time() - cpu_before
+    await upcheck.disconnect()
+
+    return {
+        "messages": messages,
+        "duration": round(duration, 3),
+        "messages_per_second": round(messages / duration, 1),
+        "cpu_per_message_us": round(cpu_time * 1000000 / messages, 2),
+        "written": upcheck.stats.get("written", 0),
+        "failed_writes": upcheck.stats.get("failed", 0),
+        "mirrored": len(target_broker.messages("mirror")),
+        "duplicates": len(target_broker.messages("mirror")) - messages,
+        "inserted": len(database.rows("check_results")),
+    }
+
+
+def main(
+    messages: int = 10000,
+    batch_size: int = 500,
+    latency: float = 0,
+    failure_rate: float = 0,
+    passthrough: bool = False,
+    postgres: bool = False,
+    output: str = None,
+):
+
+    # failed writes are logged by the pipeline, which would distort the measurements
+    logging.getLogger("upcheck").setLevel(logging.CRITICAL)
+
+    measurements = anyio.run(
+        run, messages, batch_size, latency, failure_rate, passthrough, postgres
+    )
+    result = {
+        "benchmark": "kafka",
+        "parameters": {
+            "messages": messages,
+            "batch_size": batch_size,
+            "latency": latency,
+            "failure_rate": failure_rate,
+            "passthrough": passthrough,
+            "postgres": postgres,
+        },
+        "results": measurements,
+        "environment": environment_details(),
+    }
+    print(json.dumps(result))
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--passthrough", action="store_true")
+    parser.add_argument("--postgres", action="store_true")
+    parser.add_argument("--output", default=None)
+    main(**vars(parser.parse_args()))
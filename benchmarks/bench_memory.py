@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Measure how much memory check metrics take up when held in memory (e.g. in a collector target).
+
+Usage:
+
+    python benchmarks/bench_memory.py [NUMBER_OF_METRICS] [NUMBER_OF_URLS]
+
+Prints the result as a json object.
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+
+from upcheck.models import CheckMetric
+
+
+def create_metrics(amount: int, urls: int):
+
+    data = {
+        "url": "",
+        "regex": None,
+        "check_time": 1594000000000000,
+        "response_code": 200,
+        "response_time": 120,
+        "regex_matched": None,
+    }
+    metrics = []
+    for i in range(amount):
+        data["url"] = f"https://frkl.io/{i % urls}"
+        data["check_time"] = 1594000000000000 + i * 1000000
+        data["response_time"] = 100 + i % 500
+        metrics.append(CheckMetric.from_dict(data))
+    return metrics
+
+
+def main(amount: int = 100000, urls: int = 1000):
+
+    # create the url checks up front, we only want to measure the metrics themselves
+    create_metrics(urls, urls)
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    metrics = create_metrics(amount, urls)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "benchmark": "memory",
+        "metrics": amount,
+        "urls": urls,
+        "bytes_per_metric": round((after - before) / amount, 1),
+        "object_size": sys.getsizeof(metrics[0]),
+        "has_dict": hasattr(metrics[0], "__dict__"),
+    }
+    print(json.dumps(result))
+    return result
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,22 @@
+-- migrate:up
+
+create table check_summaries (
+    id SERIAL PRIMARY KEY,
+    url TEXT NOT NULL,
+    regex TEXT,
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ NOT NULL,
+    check_count INTEGER NOT NULL,
+    failure_count INTEGER NOT NULL,
+    response_time_min_ms INTEGER NOT NULL,
+    response_time_max_ms INTEGER NOT NULL,
+    response_time_mean_ms DOUBLE PRECISION NOT NULL,
+    response_time_percentiles JSONB,
+    histogram_bounds_ms INTEGER[] NOT NULL,
+    histogram_counts INTEGER[] NOT NULL
+);
+
+create index check_summaries_url_start_time_idx on check_summaries (url, start_time);
+
+-- migrate:down
+drop table check_summaries;
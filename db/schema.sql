@@ -58,6 +58,47 @@ CREATE SEQUENCE public.check_results_id_seq
 ALTER SEQUENCE public.check_results_id_seq OWNED BY public.check_results.id;
 
 
+--
+-- Name: check_summaries; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.check_summaries (
+    id integer NOT NULL,
+    url text NOT NULL,
+    regex text,
+    start_time timestamp with time zone NOT NULL,
+    end_time timestamp with time zone NOT NULL,
+    check_count integer NOT NULL,
+    failure_count integer NOT NULL,
+    response_time_min_ms integer NOT NULL,
+    response_time_max_ms integer NOT NULL,
+    response_time_mean_ms double precision NOT NULL,
+    response_time_percentiles jsonb,
+    histogram_bounds_ms integer[] NOT NULL,
+    histogram_counts integer[] NOT NULL
+);
+
+
+--
+-- Name: check_summaries_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.check_summaries_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: check_summaries_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.check_summaries_id_seq OWNED BY public.check_summaries.id;
+
+
 --
 -- Name: schema_migrations; Type: TABLE; Schema: public; Owner: -
 --
@@ -74,6 +115,13 @@ CREATE TABLE public.schema_migrations (
 ALTER TABLE ONLY public.check_results ALTER COLUMN id SET DEFAULT nextval('public.check_results_id_seq'::regclass);
 
 
+--
+-- Name: check_summaries id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.check_summaries ALTER COLUMN id SET DEFAULT nextval('public.check_summaries_id_seq'::regclass);
+
+
 --
 -- Name: check_results check_results_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -82,6 +130,14 @@ ALTER TABLE ONLY public.check_results
     ADD CONSTRAINT check_results_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: check_summaries check_summaries_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.check_summaries
+    ADD CONSTRAINT check_summaries_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: schema_migrations schema_migrations_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -90,6 +146,13 @@ ALTER TABLE ONLY public.schema_migrations
     ADD CONSTRAINT schema_migrations_pkey PRIMARY KEY (version);
 
 
+--
+-- Name: check_summaries_url_start_time_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX check_summaries_url_start_time_idx ON public.check_summaries USING btree (url, start_time);
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -100,4 +163,5 @@ ALTER TABLE ONLY public.schema_migrations
 --
 
 INSERT INTO public.schema_migrations (version) VALUES
-    ('20200705193405');
+    ('20200705193405'),
+    ('20201019120000');
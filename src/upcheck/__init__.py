@@ -3,7 +3,15 @@
 import io
 import os
 
-from pkg_resources import DistributionNotFound, get_distribution
+try:
+    from importlib.metadata import PackageNotFoundError as DistributionNotFound
+    from importlib.metadata import version as get_version
+except ImportError:
+    # Python < 3.8, 'pkg_resources' is a lot slower to import, so only use it if necessary
+    from pkg_resources import DistributionNotFound, get_distribution
+
+    def get_version(distribution_name: str) -> str:  # type: ignore
+        return get_distribution(distribution_name).version
 
 
 """Top-level package for upcheck."""
@@ -14,7 +22,7 @@ __email__ = "markus@frkl.io"
 try:
     # Change here if project is renamed and does not equal the package name
     dist_name = __name__
-    __version__ = get_distribution(dist_name).version
+    __version__ = get_version(dist_name)
 except DistributionNotFound:
 
     try:
@@ -33,4 +41,4 @@ except DistributionNotFound:
         __version__ = "unknown"
 
 finally:
-    del get_distribution, DistributionNotFound
+    del get_version, DistributionNotFound
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import anyio
+from upcheck.models import CheckMetric, CheckSummary, UrlCheck
+from upcheck.utils.sketch import DEFAULT_RELATIVE_ACCURACY, LatencySketch
+
+
+log = logging.getLogger("upcheck")
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+"""The response time percentiles that are computed for summaries by default."""
+DEFAULT_HISTOGRAM_BOUNDS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+"""The default (inclusive) upper bounds of response time histogram buckets, in milliseconds."""
+MAX_TRACKED_CHECK_TIMES = 1024
+"""The maximum number of check times that are kept per url check and interval, to recognize duplicate metrics."""
+
+
+class _IntervalStats(object):
+    """Aggregated metrics for a single url check within a single interval."""
+
+    __slots__ = ("failures", "sketch", "histogram", "check_times")
+
+    def __init__(self, relative_accuracy: float, histogram_size: int):
+
+        self.failures: int = 0
+        # to recognize metrics that are delivered more than once (up to 'MAX_TRACKED_CHECK_TIMES')
+        self.check_times: Set[int] = set()
+        self.sketch: LatencySketch = LatencySketch(relative_accuracy=relative_accuracy)
+        self.histogram: List[int] = [0] * histogram_size
+
+    def merge(self, other: "_IntervalStats") -> None:
+
+        self.failures += other.failures
+        self.sketch.merge(other.sketch)
+        for i, count in enumerate(other.histogram):
+            self.histogram[i] += count
+
+
+class CheckAggregator(object):
+    """Aggregate check metrics per url, over (sliding) time windows.
+
+    Metrics are assigned to intervals by their check time. Once an interval is closed (a metric is received with a
+    check time of at least 'grace' seconds after the end of the interval), a summary for the window that ends with that
+    interval is created for every url check that has metrics in it. If 'window' is the same as 'interval' (the default),
+    every metric is part of exactly one summary, otherwise windows overlap.
+
+    Per url check, only the metrics of the intervals in the current window are kept, in fixed-size sketches. To
+    recognize metrics that are added more than once (check 'duplicates'), up to 'MAX_TRACKED_CHECK_TIMES' check times
+    are kept per url check and interval as well. Metrics that arrive after all windows they belong to were summarized
+    are dropped (check 'late'), whether they were added before or not.
+
+    Without new metrics, intervals are closed by 'close_expired': the check time of the newest metric is assumed to
+    advance with the (wall clock) time since it was added. So if no metrics arrive (e.g. because all checks fail to
+    report), the last window is still summarized after 'interval' plus 'grace' seconds, but replaying old metrics
+    (which arrive in quick succession) doesn't close windows prematurely.
+
+    Args:
+        interval (float): the time (in seconds) between summaries
+        window (float): the time (in seconds) each summary covers, must be a multiple of 'interval' (defaults to 'interval')
+        grace (float): how long (in seconds) to wait for late metrics before an interval is closed
+        percentiles (Iterable[float]): the response time percentiles to compute
+        histogram_bounds (Iterable[int]): the upper bounds of the response time histogram buckets, in milliseconds
+        relative_accuracy (float): the maximum relative error of the computed percentiles
+    """
+
+    def __init__(
+        self,
+        interval: float = 60,
+        window: Optional[float] = None,
+        grace: float = 0,
+        percentiles: Optional[Iterable[float]] = None,
+        histogram_bounds: Optional[Iterable[int]] = None,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    ):
+
+        if interval <= 0:
+            raise ValueError(f"Invalid interval '{interval}', must be positive.")
+        if window is None:
+            window = interval
+        if window < interval or (window / interval) != int(window / interval):
+            raise ValueError(
+                f"Invalid window '{window}', must be a multiple of the interval ('{interval}')."
+            )
+        if grace < 0:
+            raise ValueError(f"Invalid grace period '{grace}', must not be negative.")
+
+        self._interval: int = int(interval * 1000000)
+        self._window_intervals: int = int(window / interval)
+        self._grace: int = int(grace * 1000000)
+
+        if percentiles is None:
+            percentiles = DEFAULT_PERCENTILES
+        self._percentiles: List[float] = list(percentiles)
+        if histogram_bounds is None:
+            histogram_bounds = DEFAULT_HISTOGRAM_BOUNDS
+        self._histogram_bounds: List[int] = sorted(histogram_bounds)
+        self._relative_accuracy: float = relative_accuracy
+
+        self._intervals: Dict[int, Dict[UrlCheck, _IntervalStats]] = {}
+        self._next_interval: Optional[int] = None
+        self._max_check_time: Optional[int] = None
+        self._last_added: Optional[float] = None
+        self._late: int = 0
+        self._duplicates: int = 0
+
+    @property
+    def interval(self) -> float:
+        """The time (in seconds) between summaries."""
+        return self._interval / 1000000
+
+    @property
+    def late(self) -> int:
+        """The number of metrics that were dropped because they arrived too late (including re-delivered ones)."""
+        return self._late
+
+    @property
+    def duplicates(self) -> int:
+        """The number of metrics that were dropped because they were already added before."""
+        return self._duplicates
+
+    def _create_stats(self) -> _IntervalStats:
+
+        return _IntervalStats(
+            relative_accuracy=self._relative_accuracy,
+            histogram_size=len(self._histogram_bounds) + 1,
+        )
+
+    def add(self, *metrics: CheckMetric) -> List[CheckSummary]:
+        """Add metrics, and return summaries for all windows that were closed in the process."""
+
+        for metric in metrics:
+
+            check_time = metric.check_time_micros
+            index = check_time // self._interval
+
+            if self._next_interval is None:
+                self._next_interval = index
+            elif index <= self._next_interval - self._window_intervals:
+                self._late += 1
+                log.debug(
+                    f"Dropping late metric for '{metric.url_check.url}' (check time: {metric.check_time})."
+                )
+                continue
+
+            interval = self._intervals.setdefault(index, {})
+            stats = interval.get(metric.url_check, None)
+            if stats is None:
+                stats = self._create_stats()
+                interval[metric.url_check] = stats
+            elif check_time in stats.check_times:
+                self._duplicates += 1
+                continue
+
+            if len(stats.check_times) < MAX_TRACKED_CHECK_TIMES:
+                stats.check_times.add(check_time)
+            stats.sketch.add(metric.response_time)
+            stats.histogram[
+                bisect.bisect_left(self._histogram_bounds, metric.response_time)
+            ] += 1
+            if not metric.is_up:
+                stats.failures += 1
+
+            if self._max_check_time is None or check_time > self._max_check_time:
+                self._max_check_time = check_time
+
+        if self._max_check_time is None:
+            return []
+
+        self._last_added = time.monotonic()
+        return self._close_until((self._max_check_time - self._grace) // self._interval)
+
+    def close_expired(self, now: Optional[float] = None) -> List[CheckSummary]:
+        """Close all intervals that would have been closed by now, and return the summaries for them.
+
+        Args:
+            now (Optional[float]): the current time, as returned by 'time.monotonic'
+
+        Returns:
+            List[CheckSummary]: the summaries of the closed windows
+        """
+
+        if self._max_check_time is None or self._last_added is None:
+            return []
+
+        if now is None:
+            now = time.monotonic()
+        watermark = self._max_check_time + int((now - self._last_added) * 1000000)
+        return self._close_until((watermark - self._grace) // self._interval)
+
+    def flush(self) -> List[CheckSummary]:
+        """Close all intervals that contain metrics, and return the summaries for them."""
+
+        if self._max_check_time is None:
+            return []
+
+        summaries = self._close_until(self._max_check_time // self._interval + 1)
+        self._intervals.clear()
+        return summaries
+
+    def _close_until(self, end: int) -> List[CheckSummary]:
+        """Close all intervals before the one with index 'end'."""
+
+        summaries: List[CheckSummary] = []
+
+        current: int = self._next_interval  # type: ignore
+        while current < end:
+
+            if not self._intervals:
+                current = end
+                break
+
+            first = min(self._intervals.keys())
+            if first > current:
+                # no metrics in the window that ends with the current interval
+                current = min(first, end)
+                continue
+
+            summaries.extend(self._summarize(current))
+
+            # remove intervals that are not part of any future windows
+            oldest = current - self._window_intervals + 1
+            for index in [i for i in self._intervals.keys() if i <= oldest]:
+                self._intervals.pop(index)
+
+            current += 1
+
+        self._next_interval = current
+        return summaries
+
+    def _summarize(self, last_interval: int) -> List[CheckSummary]:
+        """Create summaries for the window that ends with the interval with index 'last_interval'."""
+
+        first_interval = last_interval - self._window_intervals + 1
+
+        merged: Dict[UrlCheck, _IntervalStats] = {}
+        for index in range(first_interval, last_interval + 1):
+            interval = self._intervals.get(index, None)
+            if not interval:
+                continue
+            for url_check, stats in interval.items():
+                if self._window_intervals == 1:
+                    merged[url_check] = stats
+                    continue
+                _merged = merged.get(url_check, None)
+                if _merged is None:
+                    _merged = self._create_stats()
+                    merged[url_check] = _merged
+                _merged.merge(stats)
+
+        summaries = []
+        for url_check in sorted(merged.keys()):
+            stats = merged[url_check]
+            sketch = stats.sketch
+            summary = CheckSummary(
+                url_check=url_check,
+                start_time=first_interval * self._interval,
+                end_time=(last_interval + 1) * self._interval,
+                count=sketch.count,
+                failures=stats.failures,
+                response_time_min=sketch.min,  # type: ignore
+                response_time_max=sketch.max,  # type: ignore
+                response_time_mean=sketch.mean,  # type: ignore
+                percentiles={q: sketch.percentile(q) for q in self._percentiles},  # type: ignore
+                histogram_bounds=self._histogram_bounds,
+                histogram_counts=stats.histogram,
+            )
+            summaries.append(summary)
+
+        return summaries
+
+
+class RollupWriter(object):
+    """Aggregates the metrics written to a target, and persists the summaries of closed windows.
+
+    Summaries that can't be written are kept, and written (before any new ones) on the next call to 'add', 'flush' or
+    'close_expired'. 'run' calls 'close_expired' periodically, so windows are summarized even if no metrics arrive.
+    Metrics of a batch that is re-delivered after the failed write are not counted twice: they are dropped as late
+    if their window was already summarized, or as duplicates otherwise (check 'CheckAggregator').
+
+    Args:
+        write_summaries (Callable[..., Awaitable[None]]): the function that persists summaries
+        **config: the configuration of the 'CheckAggregator'
+    """
+
+    def __init__(self, write_summaries: Callable[..., Awaitable[None]], **config: Any):
+
+        self._write_summaries: Callable[..., Awaitable[None]] = write_summaries
+        self._aggregator: CheckAggregator = CheckAggregator(**config)
+        self._pending: List[CheckSummary] = []
+        self._lock: Optional[anyio.Lock] = None
+
+        # check for windows to close a few times per interval, but at least once per second
+        self._close_interval: float = min(1.0, self._aggregator.interval / 4)
+
+    @property
+    def aggregator(self) -> CheckAggregator:
+        return self._aggregator
+
+    @property
+    def pending(self) -> List[CheckSummary]:
+        """Summaries of closed windows that were not written yet."""
+        return self._pending
+
+    def _get_lock(self) -> anyio.Lock:
+
+        # locks can only be created within an event loop
+        if self._lock is None:
+            self._lock = anyio.create_lock()
+        return self._lock
+
+    async def add(self, *metrics: CheckMetric) -> None:
+
+        async with self._get_lock():
+            self._pending.extend(self._aggregator.add(*metrics))
+            await self._write_pending()
+
+    async def flush(self) -> None:
+
+        async with self._get_lock():
+            self._pending.extend(self._aggregator.flush())
+            await self._write_pending()
+
+    async def close_expired(self) -> None:
+
+        async with self._get_lock():
+            self._pending.extend(self._aggregator.close_expired())
+            await self._write_pending()
+
+    async def run(self) -> None:
+        """Close expired windows periodically, until cancelled."""
+
+        while True:
+            await anyio.sleep(self._close_interval)
+            try:
+                await self.close_expired()
+            except Exception as e:
+                log.warning(f"Can't write summaries, retrying with the next write: {e}")
+
+    async def write_pending(self) -> None:
+
+        async with self._get_lock():
+            await self._write_pending()
+
+    async def _write_pending(self) -> None:
+
+        if not self._pending:
+            return
+
+        summaries = list(self._pending)
+        await self._write_summaries(*summaries)
+        del self._pending[: len(summaries)]
@@ -18,4 +18,27 @@ else:
 
 UPCHECK_RESOURCES_FOLDER = os.path.join(UPCHECK_MODULE_BASE_FOLDER, "resources")
 
+UPCHECK_SPOOL_FOLDER = os.path.join(upcheck_app_dirs.user_data_dir, "spool")
+"""Default parent folder for spools (check 'SpoolingTarget')."""
+
+UPCHECK_SQLITE_DB_FILE = os.path.join(upcheck_app_dirs.user_data_dir, "upcheck.db")
+"""Default database file for the 'sqlite' target."""
+
+UPCHECK_AIVEN_CACHE_FILE = os.path.join(
+    upcheck_app_dirs.user_cache_dir, "aiven_services.json"
+)
+"""Default file to cache Aiven service details and auth tokens in (check 'AivenServiceDiscovery')."""
+
+DEFAULT_AIVEN_CACHE_TTL = 3600
+"""Default time (in seconds) cached Aiven service details are used for."""
+
 DEFAULT_KAFKA_GROUP_ID = "upcheck"
+
+DEFAULT_CONNECT_TIMEOUT = 60
+"""Default maximum time (in seconds) to connect to (or disconnect from) a source or target."""
+
+URL_CHECK_CACHE_SIZE = 8192
+"""Maximum number of shared UrlCheck objects to keep (check 'UrlCheck.intern')."""
+
+URL_FILTER_CACHE_SIZE = 8192
+"""Maximum number of urls a filter remembers the url pattern match result for (check 'CheckResultFilter')."""
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import fnmatch
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+from upcheck.defaults import URL_FILTER_CACHE_SIZE
+from upcheck.models import CheckMetric, UrlCheck
+
+
+LATENCY_RATIO_MIN_BASELINE = 10
+"""The smallest response time (in milliseconds) 'latency_ratio' is applied to, so very fast (or 0 ms) responses don't let every following metric pass."""
+
+
+class CheckResultFilter(object):
+    """Filter to decide whether a check result should be processed or skipped, based on its url and response code.
+
+    Filter rules are checked against plain values (as found in Kafka record keys or headers), so results can be
+    skipped without having to decode them first.
+
+    Args:
+        urls (Iterable[str]): url patterns (using shell-style wildcards, e.g. 'https://frkl.io/*'), if specified, one of them needs to match
+        response_codes (Iterable[Union[int, str]]): response codes, or ranges of response codes (e.g. '200-299'), if specified, one of them needs to match
+    """
+
+    def __init__(
+        self,
+        urls: Optional[Iterable[str]] = None,
+        response_codes: Optional[Iterable[Union[int, str]]] = None,
+    ):
+
+        self._url_pattern: Optional[Pattern] = None
+        if urls:
+            self._url_pattern = re.compile(
+                "|".join(f"(?:{fnmatch.translate(u)})" for u in urls)
+            )
+
+        self._response_codes: Optional[List[Tuple[int, int]]] = None
+        if response_codes:
+            self._response_codes = [
+                self._parse_response_codes(rc) for rc in response_codes
+            ]
+
+        # the number of distinct urls is usually small, so we remember the result for the most recently seen ones
+        self._match_url_pattern: Callable[[str], bool] = lru_cache(
+            maxsize=URL_FILTER_CACHE_SIZE
+        )(self._match_url_pattern_uncached)
+
+    def _parse_response_codes(self, response_codes: Union[int, str]) -> Tuple[int, int]:
+
+        if isinstance(response_codes, int):
+            return (response_codes, response_codes)
+
+        try:
+            if "-" in response_codes:
+                start, end = response_codes.split("-", maxsplit=1)
+                return (int(start), int(end))
+            return (int(response_codes), int(response_codes))
+        except ValueError:
+            raise ValueError(
+                f"Invalid response code filter '{response_codes}', must be a number or a range (e.g. '200-299')."
+            )
+
+    def match_url(self, url: str) -> bool:
+
+        if self._url_pattern is None:
+            return True
+
+        return self._match_url_pattern(url)
+
+    def _match_url_pattern_uncached(self, url: str) -> bool:
+
+        return self._url_pattern.match(url) is not None  # type: ignore
+
+    def match_response_code(self, response_code: int) -> bool:
+
+        if self._response_codes is None:
+            return True
+
+        for start, end in self._response_codes:
+            if start <= response_code <= end:
+                return True
+        return False
+
+    def match(self, url: str, response_code: int) -> bool:
+        """Check whether a result with the provided url and response code passes this filter."""
+
+        return self.match_url(url) and self.match_response_code(response_code)
+
+    def match_metric(self, metric: CheckMetric) -> bool:
+        """Check whether a metric passes this filter."""
+
+        return self.match(metric.url_check.url, metric.response_code)
+
+
+class ChangeFilter(object):
+    """Filter that only lets check metrics pass if they differ significantly from the last one that passed for the same url check.
+
+    A metric passes if:
+
+    - it is the first one for its url check
+    - the response code or regex match differs from the last metric that passed
+    - the response time differs from the one of the last metric that passed by at least 'latency_threshold'
+      milliseconds, or by at least 'latency_ratio' (relative to the last response time, but at least
+      'LATENCY_RATIO_MIN_BASELINE' milliseconds)
+    - 'heartbeat_interval' seconds have passed (according to the check times) since the last metric passed
+
+    Only the values of the last metric that passed are kept per url check.
+
+    Args:
+        latency_threshold (int): the (absolute) response time difference, in milliseconds, that lets a metric pass
+        latency_ratio (float): the (relative) response time difference that lets a metric pass (e.g. 0.5 for 50%)
+        heartbeat_interval (float): the maximum time, in seconds, between two metrics that pass, set to 'None' to disable heartbeats
+    """
+
+    def __init__(
+        self,
+        latency_threshold: Optional[int] = 100,
+        latency_ratio: Optional[float] = None,
+        heartbeat_interval: Optional[float] = 300,
+    ):
+
+        self._latency_threshold: Optional[int] = latency_threshold
+        self._latency_ratio: Optional[float] = latency_ratio
+        self._heartbeat_interval: Optional[int] = None
+        if heartbeat_interval is not None:
+            self._heartbeat_interval = int(heartbeat_interval * 1000000)
+
+        # response code, regex match, response time and check time of the last metric that passed
+        self._last: Dict[UrlCheck, Tuple[int, Optional[bool], int, int]] = {}
+        self._suppressed: int = 0
+
+    @property
+    def suppressed(self) -> int:
+        """The number of metrics that did not pass this filter."""
+        return self._suppressed
+
+    def _changed(
+        self, metric: CheckMetric, last: Tuple[int, Optional[bool], int, int]
+    ) -> bool:
+
+        response_code, regex_matched, response_time, check_time = last
+
+        if (
+            metric.response_code != response_code
+            or metric.regex_matched != regex_matched
+        ):
+            return True
+
+        if (
+            self._heartbeat_interval is not None
+            and metric.check_time_micros - check_time >= self._heartbeat_interval
+        ):
+            return True
+
+        diff = abs(metric.response_time - response_time)
+        if self._latency_threshold is not None and diff >= self._latency_threshold:
+            return True
+        if (
+            self._latency_ratio is not None
+            and diff
+            >= max(response_time, LATENCY_RATIO_MIN_BASELINE) * self._latency_ratio
+        ):
+            return True
+
+        return False
+
+    def match_metric(self, metric: CheckMetric) -> bool:
+        """Check whether a metric passes this filter, and remember its values if it does."""
+
+        passed, commit = self.select([metric])
+        commit()
+        return bool(passed)
+
+    def select(
+        self, metrics: Iterable[CheckMetric]
+    ) -> Tuple[List[CheckMetric], Callable[[], None]]:
+        """Return all metrics that pass this filter, without remembering their values yet.
+
+        The values are only remembered once the returned function is called, which should be done once the metrics
+        were processed successfully. Otherwise, if the same metrics are selected again (e.g. because they are
+        re-delivered after a failed write), they are compared to the same values, and still pass.
+
+        Returns:
+            Tuple[List[CheckMetric], Callable[[], None]]: the metrics that pass, and the function to remember their values
+        """
+
+        candidates: Dict[UrlCheck, Tuple[int, Optional[bool], int, int]] = {}
+        passed: List[CheckMetric] = []
+        suppressed = 0
+
+        for metric in metrics:
+            last = candidates.get(metric.url_check, None)
+            if last is None:
+                last = self._last.get(metric.url_check, None)
+            if last is not None and not self._changed(metric, last):
+                suppressed += 1
+                continue
+
+            candidates[metric.url_check] = (
+                metric.response_code,
+                metric.regex_matched,
+                metric.response_time,
+                metric.check_time_micros,
+            )
+            passed.append(metric)
+
+        def commit() -> None:
+            self._last.update(candidates)
+            self._suppressed += suppressed
+
+        return passed, commit
+
+    def filter(self, metrics: Iterable[CheckMetric]) -> List[CheckMetric]:
+        """Return all metrics that pass this filter, and remember their values."""
+
+        passed, commit = self.select(metrics)
+        commit()
+        return passed
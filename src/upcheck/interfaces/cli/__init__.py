@@ -1,23 +1,12 @@
 # -*- coding: utf-8 -*-
-import os
+import multiprocessing
 
 import asyncclick as click
 
-import upcheck.interfaces.cli.check
-import upcheck.interfaces.cli.kafka_listen
+# sub-command modules (and their dependencies) are imported on demand, check 'LAZY_COMMANDS'
 from upcheck.interfaces.cli.main import command as cli
 
 
-if os.environ.get("DEVELOP", "false").lower() == "true":
-    import upcheck.interfaces.cli.dev
-
-try:
-    import frtls
-    import upcheck.interfaces.cli.self
-except:
-    pass
-
-
 # flake8: noqa
 
 # try:
@@ -31,4 +20,6 @@ click.anyio_backend = "asyncio"
 
 
 if __name__ == "__main__":
+    # needed for worker processes ('kafka-listen --workers') in the pyinstaller binary
+    multiprocessing.freeze_support()
     cli()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""'bench' sub-command for upcheck."""
+
+import json
+import logging
+from typing import Any, List, Mapping, Optional, Tuple
+
+import asyncclick as click
+from rich import box
+from rich.table import Table
+from upcheck.interfaces.cli.main import (
+    command,
+    console,
+    handle_exc,
+    redirect_console,
+)
+from upcheck.targets import CheckTarget
+from upcheck.utils.bench import (
+    LATENCY_DISTRIBUTIONS,
+    create_url_checks,
+    environment_details,
+    run_check_benchmark,
+    start_server_process,
+)
+
+
+log = logging.getLogger("upcheck")
+
+
+def _format_summary(summary: Mapping[str, Optional[float]]) -> str:
+
+    if summary["mean"] is None:
+        return "n/a"
+    return "  ".join(f"{k}: {v}" for k, v in summary.items())
+
+
+def create_results_table(results: Mapping[str, Any]) -> Table:
+    """Create a table of the results of 'run_check_benchmark', to print to the terminal."""
+
+    table = Table(show_header=False, box=box.SIMPLE)
+    table.add_column("Property", style="bold")
+    table.add_column("Value")
+
+    table.add_row("checks", str(results["checks"]))
+    table.add_row("duration (s)", str(results["duration"]))
+    table.add_row("checks per second", str(results["checks_per_second"]))
+    table.add_row("cpu per check (ms)", str(results["cpu_per_check_ms"]))
+    table.add_row("cpu utilization", str(results["cpu_utilization"]))
+    table.add_row("check errors", str(results["check_errors"]))
+    table.add_row("failed writes", str(results["failed_writes"]))
+    table.add_row(
+        "response codes",
+        ", ".join(f"{k}: {v}" for k, v in results["response_codes"].items()),
+    )
+    table.add_row(
+        "latency measurement error (ms)", _format_summary(results["timing_error_ms"])
+    )
+    table.add_row("event loop lag (ms)", _format_summary(results["loop_lag_ms"]))
+    table.add_row(
+        "max memory (mb)",
+        f"{results['max_rss_mb']} (growth: {results['max_rss_growth_mb']})",
+    )
+    return table
+
+
+@command.command(short_help="benchmark checks against a local stand-in server")
+@click.option(
+    "--checks", "-n", type=int, default=1000, help="the number of checks to run"
+)
+@click.option(
+    "--urls", "-u", type=int, default=10, help="the number of different urls to check"
+)
+@click.option(
+    "--latency",
+    "-l",
+    type=float,
+    default=0,
+    help="the minimum latency of responses, in milliseconds",
+)
+@click.option(
+    "--latency-jitter",
+    type=float,
+    default=0,
+    help="the maximum (or mean, for the 'exponential' distribution) additional latency of responses, in milliseconds",
+)
+@click.option(
+    "--latency-distribution",
+    type=click.Choice(LATENCY_DISTRIBUTIONS),
+    default="uniform",
+    help="how additional latencies are spread across urls",
+)
+@click.option(
+    "--slow-rate",
+    type=float,
+    default=0,
+    help="the share of urls that respond slowly (between 0 and 1)",
+)
+@click.option(
+    "--slow-latency",
+    type=float,
+    default=1000,
+    help="the latency of slow urls, in milliseconds",
+)
+@click.option(
+    "--hang-rate",
+    type=float,
+    default=0,
+    help="the share of urls that never respond (between 0 and 1)",
+)
+@click.option(
+    "--body-size",
+    type=int,
+    default=1024,
+    help="the minimum size of response bodies, in bytes",
+)
+@click.option(
+    "--body-size-jitter",
+    type=int,
+    default=0,
+    help="the maximum additional size of response bodies, in bytes",
+)
+@click.option(
+    "--error-rate",
+    type=float,
+    default=0,
+    help="the probability of a response to have the status '500' (between 0 and 1)",
+)
+@click.option(
+    "--regex", type=str, default=None, help="a regex to check response bodies with"
+)
+@click.option(
+    "--seed", type=int, default=0, help="the seed for random latencies and errors"
+)
+@click.option(
+    "--target",
+    "-t",
+    help="path to a target config file (multiple targets allowed)",
+    multiple=True,
+    type=click.Path(
+        exists=True, dir_okay=False, file_okay=True, readable=True, resolve_path=True
+    ),
+)
+@click.option(
+    "--json",
+    "output_json",
+    is_flag=True,
+    help="print the results (and parameters) as json, instead of a table",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, file_okay=True, writable=True, resolve_path=True),
+    default=None,
+    help="append the results (and parameters) as json line to this file",
+)
+@click.pass_context
+@handle_exc
+async def bench(
+    ctx,
+    checks: int,
+    urls: int,
+    latency: float,
+    latency_jitter: float,
+    latency_distribution: str,
+    slow_rate: float,
+    slow_latency: float,
+    hang_rate: float,
+    body_size: int,
+    body_size_jitter: int,
+    error_rate: float,
+    regex: Optional[str],
+    seed: int,
+    target: Tuple[str],
+    output_json: bool,
+    output: Optional[str],
+):
+    """Benchmark checks against a local stand-in server.
+
+    Starts a local http server (in a separate process) that responds with configurable latencies, body sizes and errors, then runs synthetic checks against it, using the same check engine as the 'check' command. Check results are sent to the targets specified with the '--target' option (if any), so their overhead is included.
+
+    Reports the achieved checks per second, the cpu time per check, the lag of the event loop, and how much the measured response times differ from the latency of the server.
+
+    Hung urls ('--hang-rate') are only given up on when the http client times out (after 5 seconds), so only use them with a few checks.
+    """
+
+    server_process, base_url = start_server_process(
+        body_size=body_size, error_rate=error_rate, seed=seed
+    )
+    try:
+        url_checks = create_url_checks(
+            base_url,
+            urls=urls,
+            latency=latency,
+            latency_jitter=latency_jitter,
+            latency_distribution=latency_distribution,
+            slow_rate=slow_rate,
+            slow_latency=slow_latency,
+            hang_rate=hang_rate,
+            body_size=body_size,
+            body_size_jitter=body_size_jitter,
+            regex=regex,
+            seed=seed,
+        )
+        _targets: List[CheckTarget] = [CheckTarget.create_from_file(t) for t in target]
+        redirect_console(_targets)
+
+        if not output_json:
+            console.line()
+            console.print(
+                f"- running {checks} checks against {urls} urls on: {base_url}"
+            )
+
+        # failed checks and writes are counted, logging every one of them would distort the measurements
+        level = log.level
+        log.setLevel(logging.CRITICAL)
+        try:
+            results = await run_check_benchmark(
+                url_checks, checks=checks, targets=_targets
+            )
+        finally:
+            log.setLevel(level)
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    report = {
+        "benchmark": "checks",
+        "parameters": {
+            "checks": checks,
+            "urls": urls,
+            "latency": latency,
+            "latency_jitter": latency_jitter,
+            "latency_distribution": latency_distribution,
+            "slow_rate": slow_rate,
+            "slow_latency": slow_latency,
+            "hang_rate": hang_rate,
+            "body_size": body_size,
+            "body_size_jitter": body_size_jitter,
+            "error_rate": error_rate,
+            "regex": regex,
+            "seed": seed,
+            "targets": [t.get_id() for t in _targets],
+        },
+        "results": results,
+        "environment": environment_details(),
+    }
+
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+    if output_json:
+        click.echo(json.dumps(report))
+    else:
+        console.print(" -> done")
+        console.print(create_results_table(results))
@@ -5,7 +5,12 @@ import logging
 from typing import Iterable, List, Optional, Tuple
 
 import asyncclick as click
-from upcheck.interfaces.cli.main import command, console, handle_exc
+from upcheck.interfaces.cli.main import (
+    command,
+    console,
+    handle_exc,
+    redirect_console,
+)
 from upcheck.models import UrlCheck
 from upcheck.sources.check import ActualCheckCheckSource
 from upcheck.targets import CheckTarget
@@ -26,6 +31,12 @@ log = logging.getLogger("upcheck")
     help="display check results in terminal (always on if no other targets specified)",
     is_flag=True,
 )
+@click.option(
+    "--dashboard",
+    "-d",
+    help="display a live table with the latest status of each url in the terminal, instead of every check result",
+    is_flag=True,
+)
 @click.option(
     "--target",
     "-t",
@@ -45,7 +56,12 @@ log = logging.getLogger("upcheck")
 @click.pass_context
 @handle_exc
 async def check(
-    ctx, check_urls: Tuple[str], target: Tuple[str], terminal: bool, repeat: None
+    ctx,
+    check_urls: Tuple[str],
+    target: Tuple[str],
+    terminal: bool,
+    dashboard: bool,
+    repeat: None,
 ):
     """Run checks against websites.
 
@@ -60,14 +76,15 @@ async def check(
 
     _targets: List[CheckTarget] = []
 
-    if not target:
+    if not target or dashboard:
         terminal = True
     if terminal:
-        _t = TerminalTarget()
+        _t = TerminalTarget(dashboard=dashboard)
         _targets.append(_t)
     for t in target:
         _t = CheckTarget.create_from_file(t)
         _targets.append(_t)
+    redirect_console(_targets)
 
     upcheck: Optional[Upcheck] = None
     try:
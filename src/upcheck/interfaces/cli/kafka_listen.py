@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 import logging
+import sys
 from typing import List, Optional, Tuple
 
 import asyncclick as click
-from upcheck.interfaces.cli.main import command, console, handle_exc
+from upcheck.exceptions import UpcheckException
+from upcheck.interfaces.cli.main import (
+    command,
+    console,
+    handle_exc,
+    redirect_console,
+)
 from upcheck.sources import CheckSource
+from upcheck.supervisor import UpcheckSupervisor
 from upcheck.targets import CheckTarget
 from upcheck.targets.terminal import TerminalTarget
 from upcheck.upcheck import Upcheck
@@ -39,29 +47,75 @@ log = logging.getLogger("upcheck")
     help="display check results in terminal (always on if no other targets specified)",
     is_flag=True,
 )
+@click.option(
+    "--dashboard",
+    "-d",
+    help="display a live table with the latest status of each url in the terminal, instead of every check result",
+    is_flag=True,
+)
+@click.option(
+    "--workers",
+    "-w",
+    help="number of consumer processes to run (all of them join the same consumer group)",
+    type=int,
+    default=1,
+    show_default=True,
+)
 @click.pass_context
 @handle_exc
-async def kafka_listen(ctx, source: str, target: Tuple[str], terminal: bool):
+async def kafka_listen(
+    ctx, source: str, target: Tuple[str], terminal: bool, dashboard: bool, workers: int
+):
     """Listen to a Kafka topic that contains data about website checks, and forward that data to one or several targets.
 
     Both source and target parameters are paths to files that contain information about the respective item.
 
+    Use the '--workers' option to spread the consumption of a topic with several partitions over multiple processes. Each worker process connects to the source and all targets on its own, so '--dashboard' can't be used with more than one worker.
+
     For details about the Kafka source configuration, please visit https://makkus.gitlab.io/upcheck/docs/usage/#source-details. For information on how to specify the targets, visit https://makkus.gitlab.io/upcheck/docs/usage/#target-details
     """
 
+    if not target or dashboard:
+        terminal = True
+
+    if workers > 1 and dashboard:
+        raise UpcheckException(
+            msg="Can't display a dashboard with more than one worker.",
+            reason="Every worker only sees its own share of the check results.",
+            solution="Use '--terminal' to print every check result instead, or a single worker.",
+        )
+
+    if workers > 1:
+        supervisor = UpcheckSupervisor(
+            source_config=source,
+            target_configs=target,
+            workers=workers,
+            terminal=terminal,
+            console=console,
+        )
+        if supervisor.writes_to_stdout:
+            console.file = sys.stderr
+        console.print(f"- starting {workers} workers...")
+        console.print("   -> press 'q' to stop listening")
+        await supervisor.start()
+        stats = supervisor.stats
+        console.print(
+            f" -> all workers finished (received: {stats['received']}, written: {stats['written']}, failed: {stats['failed']})"
+        )
+        return
+
     _source = CheckSource.create_from_file(source)
 
     _targets: List[CheckTarget] = []
-    if not target:
-        terminal = True
 
     if terminal:
-        _t = TerminalTarget()
+        _t = TerminalTarget(dashboard=dashboard)
         _targets.append(_t)
 
     for t in target:
         _t = CheckTarget.create_from_file(t)
         _targets.append(_t)
+    redirect_console(_targets)
 
     upcheck: Optional[Upcheck] = None
     try:
@@ -77,9 +131,12 @@ async def kafka_listen(ctx, source: str, target: Tuple[str], terminal: bool):
         if target:
             msg += ", forwarding them to targets as they arrive"
         console.print(msg)
-        console.print("   -> press 'q' to stop listening")
+        # the stop key is read from stdin, which is not possible if it is not a terminal (e.g. a 'stream' source reads from it)
+        wait_for_keypress = sys.stdin.isatty()
+        if wait_for_keypress:
+            console.print("   -> press 'q' to stop listening")
 
-        await upcheck.start()
+        await upcheck.start(wait_for_keypress=wait_for_keypress)
         console.print(" -> all checks finished")
 
     finally:
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import importlib
+import importlib.util
 import logging
+import os
 import sys
 import textwrap
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Optional
 
 import asyncclick as click
 from rich import box
@@ -11,6 +14,10 @@ from upcheck.exceptions import UpcheckException, ensure_upcheck_exception
 from upcheck.interfaces.cli._utlis import logzero_option
 
 
+if TYPE_CHECKING:
+    from upcheck.targets import CheckTarget
+
+
 log = logging.getLogger("upcheck")
 console = Console()
 
@@ -27,6 +34,13 @@ console = Console()
 # Utility functions
 
 
+def redirect_console(targets: Iterable["CheckTarget"]) -> None:
+    """Print status output to stderr, if one of the targets writes its output to stdout."""
+
+    if any(t.writes_to_stdout for t in targets):
+        console.file = sys.stderr
+
+
 def pretty_print_exception(exc: Exception):
     """Pretty prints an exception to the terminal."""
 
@@ -38,7 +52,7 @@ def pretty_print_exception(exc: Exception):
     for m in msg.split("\n"):
         m = textwrap.fill(m, width=cols, subsequent_indent="       ")
         console.print(m)
-    click.echo()
+    console.line()
 
     output_dict: Dict[str, str] = {}
     if frkl_exc.reason:
@@ -127,8 +141,51 @@ def handle_exc(func, exit=True, exit_code=1):
 # ============================================================================
 # main
 
+LAZY_COMMANDS: Mapping[str, str] = {
+    "bench": "upcheck.interfaces.cli.bench",
+    "check": "upcheck.interfaces.cli.check",
+    "kafka-listen": "upcheck.interfaces.cli.kafka_listen",
+    "self": "upcheck.interfaces.cli.self",
+    "dev": "upcheck.interfaces.cli.dev",
+}
+"""Sub-commands, and the modules that register them. Modules are only imported if their command is used."""
+
+
+def _command_available(name: str) -> bool:
+
+    if name == "dev":
+        return os.environ.get("DEVELOP", "false").lower() == "true"
+    if name == "self":
+        return importlib.util.find_spec("frtls") is not None
+    return True
+
+
+class LazyGroup(click.Group):
+    """Command group that only imports the modules of sub-commands (and their dependencies) once they are needed."""
+
+    def list_commands(self, ctx) -> List[str]:
+
+        names = set(self.commands.keys())
+        names.update(n for n in LAZY_COMMANDS.keys() if _command_available(n))
+        return sorted(names)
+
+    def get_command(self, ctx, cmd_name: str) -> Optional[click.Command]:
+
+        if (
+            cmd_name not in self.commands.keys()
+            and cmd_name in LAZY_COMMANDS.keys()
+            and _command_available(cmd_name)
+        ):
+            try:
+                importlib.import_module(LAZY_COMMANDS[cmd_name])
+            except Exception as e:
+                # e.g. optional dependencies are missing
+                log.debug(f"Can't load command '{cmd_name}': {e}")
+                return None
+        return self.commands.get(cmd_name, None)
+
 
-@click.group()
+@click.group(cls=LazyGroup)
 @logzero_option(default_verbosity="INFO")
 @click.pass_context
 def command(ctx):
@@ -4,33 +4,38 @@ import os
 import re
 import urllib
 from datetime import datetime
-from functools import total_ordering
+from functools import lru_cache, total_ordering
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Union
 from urllib.parse import ParseResult
 
-import httpx
 from rich import box
 from rich.console import Console, ConsoleOptions, RenderResult
 from rich.table import Table
 from ruamel.yaml import YAML
-from tzlocal import get_localzone
+from upcheck.defaults import URL_CHECK_CACHE_SIZE
+from upcheck.utils.timestamps import micros_to_datetime, now_micros, to_micros
 
 
 class CheckResult(object):
-    def __init__(self, url_check: "UrlCheck", check_time: datetime):
+
+    # lots of those objects can be held in memory at any one time (e.g. when buffering or collecting results), so we
+    # don't want a per-instance '__dict__'
+    __slots__ = ("_url_check", "_check_time")
+
+    def __init__(self, url_check: "UrlCheck", check_time: Union[int, datetime]):
         """Base class to collect metrics and results for url checks.
 
+        Timestamps are stored as integer microseconds since the epoch (UTC), datetime objects are converted.
+
         Args:
 
         - *url_check*: the check that was performed
-        - *start_time*: the time the check was kicked off
+        - *check_time*: the time the check was kicked off
         """
 
         self._url_check: UrlCheck = url_check
-        self._check_time: datetime = check_time
-
-        self._report_data: Optional[Mapping[str, Any]] = None
+        self._check_time: int = to_micros(check_time)
 
     @property
     def url_check(self) -> "UrlCheck":
@@ -38,6 +43,12 @@ class CheckResult(object):
 
     @property
     def check_time(self) -> datetime:
+        """The time the check was kicked off, as (UTC) datetime object."""
+        return micros_to_datetime(self._check_time)
+
+    @property
+    def check_time_micros(self) -> int:
+        """The time the check was kicked off, in microseconds since the epoch (UTC)."""
         return self._check_time
 
     def __repr__(self):
@@ -56,16 +67,23 @@ class CheckMetric(CheckResult):
     Args:
 
     - *url_check*: the check that was performed
-    - *start_time*: the time the check was kicked off
-    - *end_time*: the time the check finished
+    - *check_time*: the time the check was kicked off
+    - *response_time*: the response time, in milliseconds
     - *response_code*: the response code from the remote server
-    - *content*: if successful, the text content of the server response
+    - *regex_matched*: whether the content matched the regex of the check (if applicable)
     """
 
+    __slots__ = ("_response_time", "_response_code", "_regex_matched")
+
     @classmethod
     def from_dict(cls, data: Mapping[str, Any]) -> "CheckMetric":
+        """Create a metric from a dict, as created by 'report_data'.
+
+        The 'check_time' value can be an integer (microseconds since the epoch), a datetime object, or a string
+        created via 'str(datetime)' (the legacy wire format).
+        """
 
-        url_check = UrlCheck(url=data["url"], regex=data.get("regex", None))
+        url_check = UrlCheck.intern(url=data["url"], regex=data.get("regex", None))
         metric = CheckMetric(
             url_check=url_check,
             check_time=data["check_time"],
@@ -80,14 +98,14 @@ class CheckMetric(CheckResult):
     def from_result(
         cls,
         url_check: "UrlCheck",
-        check_time: datetime,
-        end_time: datetime,
+        check_time: Union[int, datetime],
+        end_time: Union[int, datetime],
         response_code: int,
         content: Optional[str],
     ):
 
-        delta = end_time - check_time
-        response_time = int(delta.total_seconds() * 1000)
+        check_time = to_micros(check_time)
+        response_time = (to_micros(end_time) - check_time) // 1000
 
         if not url_check.regex:
             regex_matched = None
@@ -111,7 +129,7 @@ class CheckMetric(CheckResult):
     def __init__(
         self,
         url_check: "UrlCheck",
-        check_time: datetime,
+        check_time: Union[int, datetime],
         response_time: int,
         response_code: int,
         regex_matched: Optional[bool],
@@ -137,18 +155,24 @@ class CheckMetric(CheckResult):
         return self._regex_matched
 
     @property
-    def report_data(self) -> Mapping[str, Any]:
-
-        if self._report_data is None:
-            self._report_data = {
-                "url": self._url_check.url,
-                "check_time": self.check_time,
-                "response_code": self.response_code,
-                "response_time": self.response_time,
-                "regex": self.url_check.regex,
-                "regex_matched": self.regex_matched,
-            }
-        return self._report_data
+    def is_up(self) -> bool:
+        """Whether the remote server responded with a non-error response code, and the content matched the regex (if applicable)."""
+
+        # uses the properties, so subclasses that compute those values (e.g. 'EncodedCheckMetric') work too
+        return self.response_code < 400 and self.regex_matched is not False
+
+    @property
+    def report_data(self) -> Dict[str, Any]:
+        """The values of this metric, as a (newly created) dict."""
+
+        return {
+            "url": self.url_check.url,
+            "check_time": self.check_time_micros,
+            "response_code": self.response_code,
+            "response_time": self.response_time,
+            "regex": self.url_check.regex,
+            "regex_matched": self.regex_matched,
+        }
 
     def __rich_console__(
         self, console: Console, options: ConsoleOptions
@@ -160,7 +184,7 @@ class CheckMetric(CheckResult):
 
         table.add_row("url", self.url_check.url)
 
-        table.add_row("started", str(self.check_time))
+        table.add_row("started", str(self.check_time.astimezone()))
         table.add_row("response time", f"{self.response_time} ms")
         table.add_row("response code", str(self.response_code))
         if self.regex_matched is None:
@@ -180,7 +204,11 @@ class CheckError(CheckResult):
     be ignored, since the website that is checked is not responsible for the failure.
     """
 
-    def __init__(self, url_check: "UrlCheck", check_time: datetime, error: Exception):
+    __slots__ = ("_error",)
+
+    def __init__(
+        self, url_check: "UrlCheck", check_time: Union[int, datetime], error: Exception
+    ):
 
         self._error = error
         super().__init__(url_check=url_check, check_time=check_time)
@@ -198,12 +226,202 @@ class CheckError(CheckResult):
 
         table.add_row("url", self.url_check.url)
 
-        table.add_row("started", str(self.check_time))
+        table.add_row("started", str(self.check_time.astimezone()))
         table.add_row("error", str(self.error()))
 
         yield table
 
 
+class CheckSummary(object):
+    """Class to hold aggregated metrics for all checks of a url within a time window.
+
+    Failures are checks where the remote server responded with an error code (400 or higher), or where the content
+    didn't match the regex of the check.
+
+    Args:
+
+    - *url_check*: the check the metrics were aggregated for
+    - *start_time*: the start of the time window (inclusive), in microseconds since the epoch (UTC)
+    - *end_time*: the end of the time window (exclusive), in microseconds since the epoch (UTC)
+    - *count*: the number of checks
+    - *failures*: the number of failed checks
+    - *response_time_min*: the minimum response time, in milliseconds
+    - *response_time_max*: the maximum response time, in milliseconds
+    - *response_time_mean*: the mean response time, in milliseconds
+    - *percentiles*: (approximate) response time percentiles, in milliseconds
+    - *histogram_bounds*: the (inclusive) upper bounds of the response time histogram buckets, in milliseconds
+    - *histogram_counts*: the number of checks per histogram bucket, with one additional item for checks slower than the last bound
+    """
+
+    __slots__ = (
+        "_url_check",
+        "_start_time",
+        "_end_time",
+        "_count",
+        "_failures",
+        "_response_time_min",
+        "_response_time_max",
+        "_response_time_mean",
+        "_percentiles",
+        "_histogram_bounds",
+        "_histogram_counts",
+    )
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "CheckSummary":
+        """Create a summary from a dict, as created by 'report_data'."""
+
+        url_check = UrlCheck.intern(url=data["url"], regex=data.get("regex", None))
+        percentiles = {
+            float(k[1:]) if k.startswith("p") else float(k): v
+            for k, v in data.get("percentiles", {}).items()
+        }
+        summary = CheckSummary(
+            url_check=url_check,
+            start_time=data["start_time"],
+            end_time=data["end_time"],
+            count=data["count"],
+            failures=data["failures"],
+            response_time_min=data["response_time_min"],
+            response_time_max=data["response_time_max"],
+            response_time_mean=data["response_time_mean"],
+            percentiles=percentiles,
+            histogram_bounds=data.get("histogram_bounds", None),
+            histogram_counts=data.get("histogram_counts", None),
+        )
+        return summary
+
+    def __init__(
+        self,
+        url_check: "UrlCheck",
+        start_time: Union[int, datetime],
+        end_time: Union[int, datetime],
+        count: int,
+        failures: int,
+        response_time_min: int,
+        response_time_max: int,
+        response_time_mean: float,
+        percentiles: Optional[Mapping[float, float]] = None,
+        histogram_bounds: Optional[Sequence[int]] = None,
+        histogram_counts: Optional[Sequence[int]] = None,
+    ):
+
+        self._url_check: UrlCheck = url_check
+        self._start_time: int = to_micros(start_time)
+        self._end_time: int = to_micros(end_time)
+        self._count: int = count
+        self._failures: int = failures
+        self._response_time_min: int = response_time_min
+        self._response_time_max: int = response_time_max
+        self._response_time_mean: float = response_time_mean
+        if percentiles is None:
+            percentiles = {}
+        self._percentiles: Dict[float, float] = dict(percentiles)
+        if histogram_bounds is None:
+            histogram_bounds = []
+        if histogram_counts is None:
+            histogram_counts = []
+        self._histogram_bounds: List[int] = list(histogram_bounds)
+        self._histogram_counts: List[int] = list(histogram_counts)
+
+    @property
+    def url_check(self) -> "UrlCheck":
+        return self._url_check
+
+    @property
+    def start_time(self) -> datetime:
+        return micros_to_datetime(self._start_time)
+
+    @property
+    def start_time_micros(self) -> int:
+        return self._start_time
+
+    @property
+    def end_time(self) -> datetime:
+        return micros_to_datetime(self._end_time)
+
+    @property
+    def end_time_micros(self) -> int:
+        return self._end_time
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    @property
+    def response_time_min(self) -> int:
+        return self._response_time_min
+
+    @property
+    def response_time_max(self) -> int:
+        return self._response_time_max
+
+    @property
+    def response_time_mean(self) -> float:
+        return self._response_time_mean
+
+    @property
+    def percentiles(self) -> Dict[float, float]:
+        return self._percentiles
+
+    @property
+    def histogram_bounds(self) -> List[int]:
+        return self._histogram_bounds
+
+    @property
+    def histogram_counts(self) -> List[int]:
+        return self._histogram_counts
+
+    @property
+    def report_data(self) -> Dict[str, Any]:
+        """The values of this summary, as a (newly created) dict."""
+
+        return {
+            "url": self.url_check.url,
+            "regex": self.url_check.regex,
+            "start_time": self.start_time_micros,
+            "end_time": self.end_time_micros,
+            "count": self.count,
+            "failures": self.failures,
+            "response_time_min": self.response_time_min,
+            "response_time_max": self.response_time_max,
+            "response_time_mean": self.response_time_mean,
+            "percentiles": {f"p{q:g}": v for q, v in self.percentiles.items()},
+            "histogram_bounds": list(self.histogram_bounds),
+            "histogram_counts": list(self.histogram_counts),
+        }
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+
+        table = Table(show_header=False, box=box.SIMPLE)
+        table.add_column("Attribute")
+        table.add_column("Value", style="italic")
+
+        table.add_row("url", self.url_check.url)
+        table.add_row("from", str(self.start_time.astimezone()))
+        table.add_row("to", str(self.end_time.astimezone()))
+        table.add_row("checks", str(self.count))
+        table.add_row("failures", str(self.failures))
+        table.add_row(
+            "response time",
+            f"min: {self.response_time_min} ms, max: {self.response_time_max} ms, mean: {self.response_time_mean:.1f} ms",
+        )
+        for q, v in self.percentiles.items():
+            table.add_row(f"p{q:g}", f"{v:.1f} ms")
+
+        yield table
+
+    def __repr__(self):
+
+        return f"({self.__class__.__name__}: url={self.url_check.url} count={self.count} failures={self.failures}"
+
+
 @total_ordering
 class UrlCheck(object):
     """Class to represent a single website check job.
@@ -214,6 +432,8 @@ class UrlCheck(object):
     - regex (str): an optional regex
     """
 
+    __slots__ = ("_parsed_url", "_url", "_regex")
+
     @classmethod
     def create_checks(
         cls, *url_or_config_file_paths: Union[Path, str, Mapping[str, Any]]
@@ -306,6 +526,17 @@ class UrlCheck(object):
 
         return configs
 
+    @classmethod
+    def intern(cls, url: str, regex: Optional[str] = None) -> "UrlCheck":
+        """Return a shared UrlCheck object for the provided url and regex.
+
+        Used when creating lots of results for a small number of checks (e.g. when consuming metrics from Kafka), to
+        avoid parsing the same url over and over again. The most recently used objects are cached, the size of the
+        cache is set via 'URL_CHECK_CACHE_SIZE'.
+        """
+
+        return _intern_url_check(url, regex)
+
     def __init__(self, url: str, regex: Optional[str] = None):
 
         # parse url, raises error if invalid. save so we can potentially later group checks by the netloc attribute
@@ -354,9 +585,10 @@ class UrlCheck(object):
 
         error: Optional[Exception] = None
 
-        # using advice from: https://stackoverflow.com/questions/2720319/python-figure-out-local-timezone/17363006#17363006
-        tz = get_localzone()
-        started = tz.localize(datetime.now(), is_dst=None)
+        # imported here (before the timer starts) because it is slow to import, and not needed by most other commands
+        import httpx
+
+        started = now_micros()
 
         try:
             async with httpx.AsyncClient() as client:
@@ -367,7 +599,7 @@ class UrlCheck(object):
         except Exception as e:
             error = e
 
-        finished = tz.localize(datetime.now(), is_dst=None)
+        finished = now_micros()
 
         if error:
             result: CheckResult = CheckError(
@@ -405,3 +637,9 @@ class UrlCheck(object):
     def __repr__(self):
 
         return f"(UrlCheck: url={self.url} regex={self.regex})"
+
+
+@lru_cache(maxsize=URL_CHECK_CACHE_SIZE)
+def _intern_url_check(url: str, regex: Optional[str]) -> UrlCheck:
+
+    return UrlCheck(url=url, regex=regex)
@@ -4,7 +4,15 @@ import logging
 import os
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
-from typing import Any, AsyncIterator, Iterable, MutableMapping, Optional, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterable,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Union,
+)
 
 from ruamel.yaml import YAML
 from upcheck.exceptions import UpcheckException
@@ -13,7 +21,7 @@ from upcheck.models import CheckResult
 
 log = logging.getLogger("upcheck")
 
-AVAILABLE_SOURCE_TYPES = ["kafka", "kafka-aiven"]
+AVAILABLE_SOURCE_TYPES = ["kafka", "kafka-aiven", "file", "stream"]
 
 
 class CheckSource(metaclass=ABCMeta):
@@ -112,6 +120,18 @@ class CheckSource(metaclass=ABCMeta):
 
                 target = AivenKafkaSoure(**source_config)
 
+            elif source_type == "file":
+
+                from upcheck.sources.file import FileSource
+
+                target = FileSource(**source_config)
+
+            elif source_type == "stream":
+
+                from upcheck.sources.stream import StreamSource
+
+                target = StreamSource(**source_config)
+
             else:
                 raise UpcheckException(
                     msg="Can't create source from config.",
@@ -154,6 +174,38 @@ class CheckSource(metaclass=ABCMeta):
         """
         pass
 
+    async def start_batches(self) -> AsyncIterator[Sequence[CheckResult]]:
+        """Start the source, async-yielding batches of CheckResult items.
+
+        Once a batch was written to the targets, 'acknowledge' will be called with it. Batches are read ahead: the
+        next batch is requested while earlier ones are still waiting to be written, so several batches (up to the
+        'max_pending_batches' of 'Upcheck', plus the one being written) can be in flight at any one time. Batches are
+        written, and acknowledged, in the order they were yielded. 'acknowledge' is called from another task, while
+        this generator is running, so sources that need to limit the number of results in flight (e.g. to bound
+        memory usage) can count them, and pause reading until enough of them were acknowledged.
+
+        If a batch could not be written ('success' is False), it is not re-sent by the pipeline. Sources that need
+        at-least-once delivery have to yield it again themselves (e.g. by seeking back to its read position). In that
+        case, the batches that were read after it are still in flight, and will be acknowledged as well; those should
+        be ignored and re-read too, otherwise a read position after the failed batch might be committed (check
+        'KafkaSource.acknowledge').
+
+        By default, this wraps every item yielded by 'start' in a batch of its own. Sources that can retrieve results in
+        bulk (or need to know when results were written, e.g. to commit a read position) should override this.
+        """
+
+        async for result in self.start():
+            yield [result]
+
+    async def acknowledge(self, results: Sequence[CheckResult], success: bool) -> None:
+        """Called after a batch of results yielded by 'start_batches' was processed.
+
+        Args:
+            results: the batch of results
+            success: whether all targets wrote the results successfully
+        """
+        pass
+
     async def stop(self) -> Optional[Iterable[CheckResult]]:
         """Stop the source.
 
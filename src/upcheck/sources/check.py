@@ -5,14 +5,10 @@ from pathlib import Path
 from typing import Any, AsyncIterator, Iterable, Mapping, Optional, Union
 
 import anyio
-from avro.io import DatumReader
 from upcheck.models import CheckResult, UrlCheck
 from upcheck.sources import CheckSource
-from upcheck.utils.kafka import CHECK_METRIC_SCHEMA
 
 
-CHECK_METRIC_READER = DatumReader(CHECK_METRIC_SCHEMA)
-
 log = logging.getLogger("upcheck")
 
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import glob
+import gzip
+import logging
+import mmap
+import os
+from typing import AsyncIterator, Iterator, List, Sequence
+
+from anyio import run_in_thread
+from upcheck.models import CheckMetric, CheckResult
+from upcheck.sources import CheckSource
+from upcheck.targets.file import COMPRESSION_SUFFIXES, SEGMENT_FILE_SUFFIX
+from upcheck.utils.records import SEGMENT_HEADER, read_records
+
+
+log = logging.getLogger("upcheck")
+
+
+class FileSource(CheckSource):
+    """Source that reads check results from segment files, as written by a 'file' target.
+
+    Segment files are read in order of their names (which is the order they were written in). Uncompressed files are
+    memory-mapped, compressed ones are decompressed in memory. Reading and decoding happens in a worker thread, one
+    batch at a time, so the event loop is not blocked by large (or slow) files.
+
+    Args:
+        path (str): a folder that contains segment files, or the path to a single segment file
+        prefix (str): the prefix of the segment file names
+        batch_size (int): the maximum number of check results to emit at once
+    """
+
+    def __init__(self, path: str, prefix: str = "upcheck", batch_size: int = 1000):
+
+        self._path: str = os.path.realpath(os.path.expanduser(path))
+        self._prefix: str = prefix
+        self._batch_size: int = batch_size
+
+    def get_id(self) -> str:
+
+        return f"file::{self._path}"
+
+    @property
+    def segment_files(self) -> List[str]:
+        """The paths of all segment files to read, in order."""
+
+        if os.path.isfile(self._path):
+            return [self._path]
+
+        files: List[str] = []
+        for suffix in ["", *COMPRESSION_SUFFIXES.values()]:
+            pattern = f"{self._prefix}-*{SEGMENT_FILE_SUFFIX}{suffix}"
+            files.extend(glob.glob(os.path.join(self._path, pattern)))
+
+        return sorted(files, key=os.path.basename)
+
+    def _read_batches(self, buffer, path: str) -> Iterator[List[CheckMetric]]:
+
+        if buffer[: len(SEGMENT_HEADER)] != SEGMENT_HEADER:
+            log.warning(f"Invalid segment file '{path}', skipping it.")
+            return
+
+        offset = len(SEGMENT_HEADER)
+        while True:
+            metrics, offset, corrupted = read_records(
+                buffer, offset=offset, max_records=self._batch_size
+            )
+            if metrics:
+                yield metrics
+            if corrupted:
+                log.warning(f"Corrupted or truncated record in segment file '{path}'.")
+                return
+            if not metrics:
+                return
+
+    def read_file(self, path: str) -> Iterator[List[CheckMetric]]:
+        """Read all check results of a segment file, in batches."""
+
+        if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+            with gzip.open(path, "rb") as f:
+                yield from self._read_batches(f.read(), path)
+            return
+
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(SEGMENT_HEADER):
+                log.warning(f"Invalid segment file '{path}', skipping it.")
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+                yield from self._read_batches(buffer, path)
+
+    async def start_batches(self) -> AsyncIterator[Sequence[CheckResult]]:  # type: ignore
+
+        for path in self.segment_files:
+            log.debug(f"Reading segment file: {path}")
+            batches = self.read_file(path)
+            try:
+                while True:
+                    batch = await run_in_thread(next, batches, None)
+                    if batch is None:
+                        break
+                    yield batch
+            finally:
+                # closes the file (and memory map), if not all batches were read
+                batches.close()
+
+    async def start(self) -> AsyncIterator[CheckResult]:  # type: ignore
+
+        async for batch in self.start_batches():
+            for result in batch:
+                yield result
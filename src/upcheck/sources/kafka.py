@@ -1,20 +1,32 @@
 # -*- coding: utf-8 -*-
-import io
 import logging
-import os
-from typing import Any, AsyncIterator, Mapping, Optional
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
-import avro
-from avro.io import DatumReader
+import anyio
+from aiokafka import TopicPartition
+from upcheck.filters import CheckResultFilter
 from upcheck.models import CheckMetric, CheckResult
 from upcheck.sources import CheckSource
-from upcheck.utils import create_temp_dir_with_text_files
-from upcheck.utils.aiven import UpcheckAivenClient
-from upcheck.utils.kafka import CHECK_METRIC_SCHEMA, UpcheckKafkaClient
+from upcheck.utils.kafka import (
+    RESPONSE_CODE_HEADER,
+    EncodedCheckMetric,
+    UpcheckKafkaClient,
+    decode_check_metric,
+    get_message_header,
+)
 
 
-CHECK_METRIC_READER = DatumReader(CHECK_METRIC_SCHEMA)
-
 log = logging.getLogger("upcheck")
 
 
@@ -29,6 +41,13 @@ class KafkaSource(CheckSource):
         cafile (str): path to a ca file
         certfile (str): path to a cert file
         keyfile (str): path to a key file
+        batch_max_records (int): the maximum number of messages to consume in one batch
+        batch_timeout_ms (int): how long to wait for messages when fetching a batch, in milliseconds
+        retry_interval (float): seconds to wait before re-reading a batch that could not be written to all targets
+        pause_high_watermark (int): pause fetching once this many consumed results are not written to all targets yet
+        pause_low_watermark (int): resume fetching once the number of unwritten results dropped to this value
+        filters (Mapping): only forward results that match those filters (keys: 'urls', 'response_codes'), check 'CheckResultFilter' for details
+        passthrough (bool): keep the original messages, so Kafka targets can forward them unchanged (instead of re-encoding them)
     """
 
     def __init__(
@@ -40,9 +59,15 @@ class KafkaSource(CheckSource):
         cafile: Optional[str] = None,
         certfile: Optional[str] = None,
         keyfile: Optional[str] = None,
+        batch_max_records: int = 500,
+        batch_timeout_ms: int = 1000,
+        retry_interval: float = 5.0,
+        pause_high_watermark: int = 5000,
+        pause_low_watermark: int = 1000,
+        filters: Optional[Mapping[str, Any]] = None,
+        passthrough: bool = False,
     ):
 
-        # TODO: lazy initialization, on demand
         self._client: UpcheckKafkaClient = UpcheckKafkaClient(
             host=host,
             port=port,
@@ -51,8 +76,57 @@ class KafkaSource(CheckSource):
             cafile=cafile,
             certfile=certfile,
             keyfile=keyfile,
+            enable_auto_commit=False,
+        )
+        self._init_consumption(
+            batch_max_records=batch_max_records,
+            batch_timeout_ms=batch_timeout_ms,
+            retry_interval=retry_interval,
+            pause_high_watermark=pause_high_watermark,
+            pause_low_watermark=pause_low_watermark,
+            filters=filters,
+            passthrough=passthrough,
         )
 
+    def _init_consumption(
+        self,
+        batch_max_records: int,
+        batch_timeout_ms: int,
+        retry_interval: float,
+        pause_high_watermark: int,
+        pause_low_watermark: int,
+        filters: Optional[Mapping[str, Any]],
+        passthrough: bool,
+    ) -> None:
+
+        self._batch_max_records: int = batch_max_records
+        self._batch_timeout_ms: int = batch_timeout_ms
+        self._retry_interval: float = retry_interval
+
+        if pause_low_watermark > pause_high_watermark:
+            raise ValueError(
+                f"Low watermark ({pause_low_watermark}) must not be larger than high watermark ({pause_high_watermark})."
+            )
+        self._pause_high_watermark: int = pause_high_watermark
+        self._pause_low_watermark: int = pause_low_watermark
+        self._paused: bool = False
+
+        self._filter: Optional[CheckResultFilter] = None
+        if filters:
+            self._filter = CheckResultFilter(**filters)
+
+        self._passthrough: bool = passthrough
+
+        # batches that were yielded, but not acknowledged yet (in order), along with the first and last offset per
+        # partition of their messages
+        self._in_flight: Deque[
+            Tuple[Sequence[CheckResult], Dict[TopicPartition, Tuple[int, int]]]
+        ] = deque()
+        # number of results in all batches in flight
+        self._pending: int = 0
+        # number of acknowledgements to ignore, because the batches they belong to were re-wound after a failure
+        self._ignore_acks: int = 0
+
     def get_id(self) -> str:
 
         return f"kafka::{self._client.host}:{self._client.port}/{self._client.topic}"
@@ -67,34 +141,172 @@ class KafkaSource(CheckSource):
 
     async def start(self) -> AsyncIterator[CheckResult]:  # type: ignore
 
+        async for results in self.start_batches():
+            for result in results:
+                yield result
+            await self.acknowledge(results, success=True)
+
+    @property
+    def pending(self) -> int:
+        """The number of consumed results that were not yet written to all targets."""
+
+        return self._pending
+
+    def _apply_flow_control(self, consumer) -> None:
+        """Pause or resume fetching for all assigned partitions, depending on how many results are pending."""
+
+        if not self._paused and self._pending >= self._pause_high_watermark:
+            log.info(
+                f"{self._pending} results not written to targets yet, pausing consumption..."
+            )
+            self._paused = True
+        elif self._paused and self._pending <= self._pause_low_watermark:
+            log.info("Targets caught up, resuming consumption...")
+            self._paused = False
+            consumer.resume(*consumer.assignment())
+            return
+
+        if self._paused:
+            # the assignment might have changed since we paused, so we always apply this to the current one
+            consumer.pause(*consumer.assignment())
+
+    def _match_record(self, msg) -> Optional[bool]:
+        """Check a record against the filter, using only its key (the url) and headers.
+
+        Returns None if that is not possible (e.g. for messages written by older versions of 'upcheck').
+        """
+
+        url_match: Optional[bool] = None
+        if msg.key is not None:
+            # keys are written by other producers too, and might not be valid utf-8
+            url_match = self._filter.match_url(msg.key.decode(errors="replace"))  # type: ignore
+            if not url_match:
+                return False
+
+        response_code = get_message_header(msg.headers, RESPONSE_CODE_HEADER)
+        if url_match is None or response_code is None:
+            return None
+
+        return self._filter.match_response_code(int(response_code))  # type: ignore
+
+    async def start_batches(self) -> AsyncIterator[Sequence[CheckResult]]:  # type: ignore
+
         consumer = await self._client.get_consumer()
         try:
-            async for msg in consumer:
-                try:
-                    bytes_reader = io.BytesIO(msg.value)
-                    decoder = avro.io.BinaryDecoder(bytes_reader)
-                except Exception as e:
-                    log.error(f"Error decoding msg: {e}")
+            while True:
+                # we keep calling 'getmany' when paused, so we don't get kicked out of the consumer group
+                self._apply_flow_control(consumer)
+                records = await consumer.getmany(
+                    timeout_ms=self._batch_timeout_ms,
+                    max_records=self._batch_max_records,
+                )
+                if not records:
                     continue
 
-                try:
-                    data: Mapping[str, Any] = CHECK_METRIC_READER.read(decoder)
-                    metric: CheckResult = CheckMetric.from_dict(data)
-                    yield metric
-                except Exception as e:
-                    log.error(f"Error parsing message: {e}")
+                offsets: Dict[TopicPartition, Tuple[int, int]] = {}
+                results: List[CheckResult] = []
+                for tp, messages in records.items():
+                    if not messages:
+                        continue
+                    offsets[tp] = (messages[0].offset, messages[-1].offset)
+                    for msg in messages:
+                        match: Optional[bool] = None
+                        if self._filter is not None:
+                            match = self._match_record(msg)
+                            if match is False:
+                                continue
+
+                        # invalid messages are skipped here, otherwise every write of their batch would fail
+                        try:
+                            if self._passthrough:
+                                metric: CheckMetric = EncodedCheckMetric(
+                                    msg.value, msg.key, msg.headers
+                                )
+                            else:
+                                metric = decode_check_metric(msg.value, msg.headers)
+                        except Exception as e:
+                            log.error(
+                                f"Can't decode message (partition: {tp.partition}, offset: {msg.offset}), skipping it: {e}"
+                            )
+                            continue
+
+                        if match is None and self._filter is not None:
+                            if not self._filter.match_metric(metric):
+                                continue
+                        results.append(metric)
+
+                if not results:
+                    # nothing to write (or everything was filtered), but we don't want to read those messages again
+                    if not self._in_flight:
+                        await self._commit(consumer, offsets)
+                    else:
+                        _, last_offsets = self._in_flight[-1]
+                        for tp, (first, last) in offsets.items():
+                            last_offsets[tp] = (last_offsets.get(tp, (first,))[0], last)
                     continue
 
+                self._in_flight.append((results, offsets))
+                self._pending += len(results)
+                yield results
+
         finally:
             await consumer.stop()
 
         return
 
+    async def _commit(
+        self, consumer, offsets: Mapping[TopicPartition, Tuple[int, int]]
+    ) -> None:
+
+        try:
+            await consumer.commit({tp: last + 1 for tp, (_, last) in offsets.items()})
+        except Exception as e:
+            # most likely a rebalance happened, those messages will be consumed again
+            log.warning(f"Can't commit offsets: {e}")
+
+    async def acknowledge(self, results: Sequence[CheckResult], success: bool) -> None:
+
+        if self._ignore_acks:
+            self._ignore_acks -= 1
+            return
+
+        if not self._in_flight:
+            return
+
+        _results, offsets = self._in_flight.popleft()
+        if _results is not results:
+            log.warning("Acknowledged batch is not the oldest one in flight.")
+        self._pending -= len(_results)
+
+        consumer = await self._client.get_consumer()
+        if success:
+            await self._commit(consumer, offsets)
+            return
+
+        # we need to re-read the failed batch, as well as every batch after it that is still in flight
+        # (otherwise we might commit offsets past the failed batch)
+        seek_to: Dict[TopicPartition, int] = {}
+        for _offsets in [offsets] + [o for _, o in self._in_flight]:
+            for tp, (first, _) in _offsets.items():
+                seek_to.setdefault(tp, first)
+        self._ignore_acks = len(self._in_flight)
+        self._in_flight.clear()
+        self._pending = 0
+
+        log.warning(
+            f"Failed to write batch of {len(results)} results to all targets, re-reading in {self._retry_interval} seconds..."
+        )
+        for tp, offset in seek_to.items():
+            consumer.seek(tp, offset)
+        await anyio.sleep(self._retry_interval)
+
 
 class AivenKafkaSoure(KafkaSource):
     """Convenience source class to not have to provide most of the Kafka config values manually.
 
-    Only useful if using the Aiven service.
+    Only useful if using the Aiven service. The service details are looked up when the source connects (check
+    'AivenServiceDiscovery'), and cached for 'cache_ttl' seconds. If connecting with cached details fails, they are
+    looked up again.
 
     Args:
         topic (str): the topic to send check results to
@@ -103,6 +315,14 @@ class AivenKafkaSoure(KafkaSource):
         group_id (str): the group id of the Kafka consumer
         project_name (str): the name of the  aiven project to use
         service_name (str): the name of the Kafka service to use
+        batch_max_records (int): the maximum number of messages to consume in one batch
+        batch_timeout_ms (int): how long to wait for messages when fetching a batch, in milliseconds
+        retry_interval (float): seconds to wait before re-reading a batch that could not be written to all targets
+        pause_high_watermark (int): pause fetching once this many consumed results are not written to all targets yet
+        pause_low_watermark (int): resume fetching once the number of unwritten results dropped to this value
+        filters (Mapping): only forward results that match those filters (keys: 'urls', 'response_codes'), check 'CheckResultFilter' for details
+        passthrough (bool): keep the original messages, so Kafka targets can forward them unchanged (instead of re-encoding them)
+        cache_ttl (float): the time (in seconds) to use cached service details for, defaults to one hour
 
     """
 
@@ -114,34 +334,73 @@ class AivenKafkaSoure(KafkaSource):
         group_id: Optional[str] = None,
         project_name: Optional[str] = None,
         service_name: Optional[str] = None,
+        batch_max_records: int = 500,
+        batch_timeout_ms: int = 1000,
+        retry_interval: float = 5.0,
+        pause_high_watermark: int = 5000,
+        pause_low_watermark: int = 1000,
+        filters: Optional[Mapping[str, Any]] = None,
+        passthrough: bool = False,
+        cache_ttl: Optional[float] = None,
     ):
 
-        # TODO: lazy initialization, on demand
-        self._aiven_client: UpcheckAivenClient = UpcheckAivenClient(
-            token_or_account_password=password, email=email
-        )
-        self._kafka_service_details: Mapping[
-            str, Any
-        ] = self._aiven_client.get_kafka_service_details(
-            project_name=project_name, service_name=service_name
+        self._password: str = password
+        self._email: Optional[str] = email
+        self._project_name: Optional[str] = project_name
+        self._service_name: Optional[str] = service_name
+        self._topic: str = topic
+        self._group_id: Optional[str] = group_id
+        self._cache_ttl: Optional[float] = cache_ttl
+
+        self._client: Optional[UpcheckKafkaClient] = None  # type: ignore
+        self._init_consumption(
+            batch_max_records=batch_max_records,
+            batch_timeout_ms=batch_timeout_ms,
+            retry_interval=retry_interval,
+            pause_high_watermark=pause_high_watermark,
+            pause_low_watermark=pause_low_watermark,
+            filters=filters,
+            passthrough=passthrough,
         )
 
-        ca_cert = self._kafka_service_details["ca_cert"]
-        access_cert = self._kafka_service_details["access_cert"]
-        access_key = self._kafka_service_details["access_key"]
+    def get_id(self) -> str:
+
+        return f"kafka-aiven::{self._project_name or 'default'}/{self._service_name or 'default'}/{self._topic}"
+
+    async def _discover(self, refresh: bool = False) -> bool:
+        """Look up the service details, and create the Kafka client; returns whether cached details were used."""
+
+        # imported here, so the aiven client is only loaded for aiven services
+        from upcheck.utils.aiven import get_service_discovery
 
-        temp_dir = create_temp_dir_with_text_files(
-            {"ca.pem": ca_cert, "service.cert": access_cert, "service.key": access_key}
+        self._client, cached = await get_service_discovery().create_kafka_client(
+            topic=self._topic,
+            token_or_account_password=self._password,
+            email=self._email,
+            project_name=self._project_name,
+            service_name=self._service_name,
+            group_id=self._group_id,
+            enable_auto_commit=False,
+            refresh=refresh,
+            cache_ttl=self._cache_ttl,
         )
+        return cached
+
+    async def connect(self) -> None:
+
+        cached = await self._discover()
+        try:
+            await super().connect()
+        except Exception as e:
+            if not cached:
+                raise
+            log.debug(
+                f"Can't connect to '{self.get_id()}' with cached service details, looking them up again: {e}"
+            )
+            await self._discover(refresh=True)
+            await super().connect()
+
+    async def disconnect(self) -> None:
 
-        kafka_source_config = {
-            "host": self._kafka_service_details["host"],
-            "port": self._kafka_service_details["port"],
-            "topic": topic,
-            "group_id": group_id,
-            "cafile": os.path.join(temp_dir, "ca.pem"),
-            "certfile": os.path.join(temp_dir, "service.cert"),
-            "keyfile": os.path.join(temp_dir, "service.key"),
-        }
-
-        super().__init__(**kafka_source_config)
+        if self._client is not None:
+            await super().disconnect()
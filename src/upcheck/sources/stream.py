@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from anyio import run_in_thread
+from upcheck.models import CheckMetric, CheckResult
+from upcheck.sources import CheckSource
+from upcheck.utils.records import RECORD_HEADER, SEGMENT_HEADER, read_records
+
+
+log = logging.getLogger("upcheck")
+
+STREAM_FORMATS = ["auto", "ndjson", "binary"]
+
+
+class StreamSource(CheckSource):
+    """Source that reads check results from a stream (stdin, or a file), either as newline-delimited json, or binary records.
+
+    The json format is the one written by the 'ndjson' target (lines that don't contain a check result, like summaries,
+    are skipped). The binary format is the one of segment files written by the 'file' target. By default, the format
+    is detected from the start of the stream.
+
+    The stream is read and parsed incrementally, in chunks of 'chunk_size' bytes, so memory usage doesn't depend on the
+    size of the stream. Lines larger than 'max_record_size' are skipped (and a warning is logged), a binary stream is
+    only read up to the first record that is larger, or corrupted.
+
+    Args:
+        path (str): the path of the file to read, or '-' to read from stdin
+        format (str): the format of the stream: 'auto', 'ndjson', or 'binary'
+        chunk_size (int): the number of bytes to read at once
+        max_record_size (int): the maximum size of a single line or record, in bytes
+    """
+
+    def __init__(
+        self,
+        path: str = "-",
+        format: str = "auto",
+        chunk_size: int = 64 * 1024,
+        max_record_size: int = 1024 * 1024,
+    ):
+
+        if format not in STREAM_FORMATS:
+            raise ValueError(
+                f"Invalid format '{format}', must be one of: {', '.join(STREAM_FORMATS)}"
+            )
+
+        self._path: str = path
+        if path != "-":
+            self._path = os.path.realpath(os.path.expanduser(path))
+        self._format: str = format
+        self._chunk_size: int = chunk_size
+        self._max_record_size: int = max_record_size
+
+        self._skipped: int = 0
+
+    def get_id(self) -> str:
+
+        if self._path == "-":
+            return "stream::stdin"
+        return f"stream::{self._path}"
+
+    @property
+    def reads_stdin(self) -> bool:
+        return self._path == "-"
+
+    @property
+    def skipped(self) -> int:
+        """The number of lines or records that were skipped, because they were invalid or too large."""
+        return self._skipped
+
+    def _parse_lines(self, buffer: bytearray) -> Tuple[List[CheckMetric], int]:
+        """Parse all complete lines in the buffer, and return the metrics, and the offset after the last line."""
+
+        metrics: List[CheckMetric] = []
+        offset = 0
+        while True:
+            end = buffer.find(b"\n", offset)
+            if end < 0:
+                return metrics, offset
+
+            line = bytes(buffer[offset:end]).strip()
+            offset = end + 1
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+                if "check_time" not in data:
+                    # e.g. a summary
+                    self._skipped += 1
+                    continue
+                metrics.append(CheckMetric.from_dict(data))
+            except Exception as e:
+                self._skipped += 1
+                log.warning(f"Can't parse line, skipping it: {e}")
+
+    def _parse_records(self, buffer: bytearray) -> Tuple[List[CheckMetric], int, bool]:
+        """Parse all complete records in the buffer.
+
+        Returns the metrics, the offset after the last record, and whether the stream is corrupted at that offset.
+        """
+
+        metrics, offset, corrupted = read_records(buffer)
+        if corrupted and offset + RECORD_HEADER.size <= len(buffer):
+            length, _ = RECORD_HEADER.unpack_from(buffer, offset)
+            # if the record is complete, the checksum doesn't match, otherwise we need to wait for the rest of it
+            return metrics, offset, offset + RECORD_HEADER.size + length <= len(buffer)
+        return metrics, offset, False
+
+    async def start_batches(self) -> AsyncIterator[Sequence[CheckResult]]:  # type: ignore
+
+        fd = 0 if self._path == "-" else os.open(self._path, os.O_RDONLY)
+        try:
+            buffer = bytearray()
+            stream_format: Optional[str] = (
+                None if self._format == "auto" else self._format
+            )
+            discard = False
+
+            while True:
+                chunk = await run_in_thread(os.read, fd, self._chunk_size)
+                buffer.extend(chunk)
+
+                if stream_format is None:
+                    if len(buffer) < len(SEGMENT_HEADER) and chunk:
+                        continue
+                    if buffer.startswith(SEGMENT_HEADER):
+                        stream_format = "binary"
+                    else:
+                        stream_format = "ndjson"
+                    log.debug(f"Detected stream format: {stream_format}")
+
+                if stream_format == "binary" and buffer.startswith(SEGMENT_HEADER):
+                    # streams can be concatenated segment files
+                    del buffer[: len(SEGMENT_HEADER)]
+
+                if discard:
+                    # skip the rest of a line that was too large
+                    end = buffer.find(b"\n")
+                    if end < 0:
+                        buffer.clear()
+                    else:
+                        del buffer[: end + 1]
+                        discard = False
+
+                corrupted = False
+                if stream_format == "binary":
+                    metrics, offset, corrupted = self._parse_records(buffer)
+                else:
+                    metrics, offset = self._parse_lines(buffer)
+                del buffer[:offset]
+
+                if metrics:
+                    yield metrics
+                if corrupted:
+                    log.error(
+                        f"Corrupted record in stream '{self.get_id()}', stopping to read it."
+                    )
+                    return
+
+                if not chunk:
+                    if buffer.strip():
+                        if stream_format == "ndjson":
+                            buffer.extend(b"\n")
+                            metrics, _ = self._parse_lines(buffer)
+                            if metrics:
+                                yield metrics
+                        else:
+                            log.warning(
+                                f"Stream '{self.get_id()}' ends with an incomplete record."
+                            )
+                    return
+
+                if len(buffer) > self._max_record_size:
+                    if stream_format == "binary":
+                        # records can't be skipped without reading them
+                        log.error(
+                            f"Record in stream '{self.get_id()}' larger than {self._max_record_size} bytes, stopping to read it."
+                        )
+                        return
+                    self._skipped += 1
+                    log.warning(
+                        f"Line larger than {self._max_record_size} bytes, skipping it."
+                    )
+                    buffer.clear()
+                    discard = True
+        finally:
+            if fd != 0:
+                os.close(fd)
+
+    async def start(self) -> AsyncIterator[CheckResult]:  # type: ignore
+
+        async for batch in self.start_batches():
+            for result in batch:
+                yield result
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+import logging
+import mmap
+import os
+import time
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from upcheck.models import CheckMetric
+from upcheck.utils.records import SEGMENT_HEADER, encode_record, read_records
+
+
+log = logging.getLogger("upcheck")
+
+SEGMENT_SUFFIX = ".spool"
+CURSOR_FILE_NAME = "cursor"
+
+FSYNC_POLICIES = ["always", "interval", "never"]
+
+
+class Spool(object):
+    """An append-only, on-disk log of check metrics.
+
+    Metrics are written to segment files of (roughly) 'segment_size' bytes. Reading happens in batches, and the read
+    position only moves forward once a batch is committed (after it was processed successfully), so metrics are
+    delivered at least once, also across restarts. Segments that were read completely are deleted.
+
+    If the spool grows larger than 'max_size', the oldest segments are deleted, even if they were not read yet.
+
+    When data is synced to disk depends on the 'fsync' policy: 'always' (after every append), 'interval' (at most every
+    'fsync_interval' seconds), or 'never' (leave it to the operating system).
+
+    Args:
+        path (str): the folder to store the segments in
+        segment_size (int): the size of a segment, in bytes
+        max_size (int): the maximum size of all segments, in bytes
+        fsync (str): the fsync policy
+        fsync_interval (float): the minimum time (in seconds) between syncs, if using the 'interval' policy
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_size: int = 16 * 1024 * 1024,
+        max_size: int = 1024 * 1024 * 1024,
+        fsync: str = "interval",
+        fsync_interval: float = 1.0,
+    ):
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(
+                f"Invalid fsync policy '{fsync}', must be one of: {', '.join(FSYNC_POLICIES)}"
+            )
+        if max_size < segment_size:
+            raise ValueError(
+                f"Invalid max size '{max_size}', must not be smaller than the segment size ('{segment_size}')."
+            )
+
+        self._path: str = os.path.realpath(os.path.expanduser(path))
+        self._segment_size: int = segment_size
+        self._max_size: int = max_size
+        self._fsync: str = fsync
+        self._fsync_interval: float = fsync_interval
+
+        os.makedirs(self._path, exist_ok=True)
+
+        # segment number -> size
+        self._segments: Dict[int, int] = {}
+        for f in os.listdir(self._path):
+            if not f.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                number = int(f[: -len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            self._segments[number] = os.path.getsize(os.path.join(self._path, f))
+
+        self._writer: Optional[BinaryIO] = None
+        self._write_segment: Optional[int] = None
+        self._last_sync: float = 0.0
+
+        self._read_segment: int = -1
+        self._read_offset: int = 0
+        self._load_cursor()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def size(self) -> int:
+        """The size of all segments, in bytes."""
+        return sum(self._segments.values())
+
+    @property
+    def pending(self) -> bool:
+        """Whether there are metrics that were not read (and committed) yet."""
+
+        for number, size in self._segments.items():
+            if number > self._read_segment and size > len(SEGMENT_HEADER):
+                return True
+        return self._segments.get(self._read_segment, 0) > self._read_offset
+
+    def _segment_file(self, number: int) -> str:
+
+        return os.path.join(self._path, f"{number:012d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self) -> None:
+
+        cursor_file = os.path.join(self._path, CURSOR_FILE_NAME)
+        if not os.path.exists(cursor_file):
+            return
+
+        try:
+            with open(cursor_file, "r") as f:
+                segment, offset = f.read().split()
+            self._read_segment = int(segment)
+            self._read_offset = int(offset)
+        except Exception as e:
+            log.warning(
+                f"Can't read spool cursor '{cursor_file}', replaying all segments: {e}"
+            )
+
+    def _save_cursor(self) -> None:
+
+        cursor_file = os.path.join(self._path, CURSOR_FILE_NAME)
+        temp_file = f"{cursor_file}.tmp"
+        with open(temp_file, "w") as f:
+            f.write(f"{self._read_segment} {self._read_offset}")
+            if self._fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_file, cursor_file)
+
+    def _sync(self, force: bool = False) -> None:
+
+        if self._writer is None:
+            return
+
+        self._writer.flush()
+        if self._fsync == "never":
+            return
+        if (
+            force
+            or self._fsync == "always"
+            or time.monotonic() - self._last_sync >= self._fsync_interval
+        ):
+            os.fsync(self._writer.fileno())
+            self._last_sync = time.monotonic()
+
+    def _roll(self) -> None:
+        """Close the current segment (if any), and start a new one."""
+
+        if self._writer is not None:
+            self._sync(force=True)
+            self._writer.close()
+
+        number = max(self._segments.keys(), default=-1) + 1
+        self._writer = open(self._segment_file(number), "wb")
+        self._writer.write(SEGMENT_HEADER)
+        self._write_segment = number
+        self._segments[number] = len(SEGMENT_HEADER)
+
+    def _enforce_max_size(self) -> None:
+
+        while self.size > self._max_size and len(self._segments) > 1:
+            oldest = min(self._segments.keys())
+            if oldest == self._write_segment:
+                return
+            log.warning(
+                f"Spool '{self._path}' exceeds max size, dropping segment {oldest} ({self._segments[oldest]} bytes)."
+            )
+            self._delete_segment(oldest)
+
+    def _delete_segment(self, number: int) -> None:
+
+        self._segments.pop(number)
+        try:
+            os.remove(self._segment_file(number))
+        except FileNotFoundError:
+            pass
+
+    def append(self, metrics: Iterable[CheckMetric]) -> None:
+        """Append metrics to the spool."""
+
+        for metric in metrics:
+            record = encode_record(metric)
+
+            if (
+                self._writer is None
+                or self._segments[self._write_segment] + len(record)  # type: ignore
+                > self._segment_size
+            ):
+                self._roll()
+
+            self._writer.write(record)  # type: ignore
+            self._segments[self._write_segment] += len(record)  # type: ignore
+
+        self._sync()
+        self._enforce_max_size()
+
+    def _read_records(
+        self, number: int, offset: int, max_records: int
+    ) -> Tuple[List[CheckMetric], int]:
+        """Read records from a segment, starting at 'offset'.
+
+        Returns the metrics, and the offset after the last record that was read. If a segment is corrupted (e.g. a
+        record was only written partially because of a crash), the offset points to the end of the segment.
+        """
+
+        size = self._segments[number]
+
+        with open(self._segment_file(number), "rb") as f:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+
+                if offset < len(SEGMENT_HEADER):
+                    if buffer[: len(SEGMENT_HEADER)] != SEGMENT_HEADER:
+                        log.warning(f"Invalid spool segment {number}, skipping it.")
+                        return [], size
+                    offset = len(SEGMENT_HEADER)
+
+                metrics, offset, corrupted = read_records(
+                    buffer, offset=offset, max_records=max_records
+                )
+
+        if corrupted:
+            log.warning(f"Corrupted or truncated record in spool segment {number}.")
+            return metrics, size
+
+        return metrics, offset
+
+    def read(self, max_records: int = 500) -> Tuple[List[CheckMetric], Tuple[int, int]]:
+        """Read the next batch of metrics, starting at the last committed position.
+
+        Returns:
+            Tuple[List[CheckMetric], Tuple[int, int]]: the metrics, and the position to commit once they are processed
+        """
+
+        if self._writer is not None:
+            self._writer.flush()
+
+        metrics: List[CheckMetric] = []
+        number, offset = self._read_segment, self._read_offset
+
+        while len(metrics) < max_records:
+
+            size = self._segments.get(number, None)
+            if size is None or offset >= size:
+                later = [n for n in self._segments.keys() if n > number]
+                if not later:
+                    break
+                number, offset = min(later), 0
+                continue
+
+            _metrics, offset = self._read_records(
+                number, offset, max_records - len(metrics)
+            )
+            metrics.extend(_metrics)
+
+        return metrics, (number, offset)
+
+    def commit(self, position: Tuple[int, int]) -> None:
+        """Mark everything up to 'position' (as returned by 'read') as processed."""
+
+        self._read_segment, self._read_offset = position
+
+        for number in sorted(self._segments.keys()):
+            if number > self._read_segment or number == self._write_segment:
+                break
+            if (
+                number == self._read_segment
+                and self._read_offset < self._segments[number]
+            ):
+                break
+            self._delete_segment(number)
+
+        self._save_cursor()
+
+    def close(self) -> None:
+
+        if self._writer is not None:
+            self._sync(force=True)
+            self._writer.close()
+            self._writer = None
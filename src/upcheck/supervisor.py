@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import logging
+import multiprocessing
+import queue
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import anyio
+from anyio import create_task_group, run_in_thread
+from rich.console import Console
+from upcheck.exceptions import UpcheckException
+from upcheck.utils.callables import wait_for_tasks, wait_for_tasks_or_user_keypress
+
+
+log = logging.getLogger("upcheck")
+
+STATS_INTERVAL = 2.0
+"""How often (in seconds) workers report their stats to the supervisor."""
+MIN_WORKER_UPTIME = 10.0
+"""Workers that fail faster than this (in seconds) are not restarted, since that usually means a configuration error."""
+STOP_TIMEOUT = 30.0
+"""How long (in seconds) to wait for workers to stop after a stop was requested, before they are terminated."""
+DRAIN_TIMEOUT = 20.0
+"""How long (in seconds) workers keep writing batches that were already read after a stop was requested, before those are cancelled (less than 'STOP_TIMEOUT', to leave time to disconnect)."""
+SINGLE_PROCESS_TARGET_TYPES = ("file", "prometheus", "spool", "sqlite")
+"""Target types that can't be used by several workers at once, since they listen on a port, or write to (and rotate) files that can't be shared between processes."""
+
+
+def _get_target_types(target_config: Any) -> Set[str]:
+    """Return the types of a target configuration, and of all the targets it wraps."""
+
+    types: Set[str] = set()
+    if isinstance(target_config, Mapping):
+        if "type" in target_config.keys():
+            types.add(target_config["type"])
+        types.update(_get_target_types(target_config.get("target", None)))
+        types.update(_get_target_types(target_config.get("targets", None)))
+    elif isinstance(target_config, (list, tuple)):
+        for c in target_config:
+            types.update(_get_target_types(c))
+    return types
+
+
+def _writes_to_stdout(target_config: Any) -> bool:
+    """Return whether a target configuration (or one of the targets it wraps) writes to stdout (check 'NdjsonTarget')."""
+
+    if isinstance(target_config, Mapping):
+        if target_config.get("type", None) == "ndjson":
+            from upcheck.targets.ndjson import STDOUT_FD
+
+            path = target_config.get("path", None)
+            return not path and target_config.get("fd", STDOUT_FD) == STDOUT_FD
+        wrapped = [
+            target_config.get("target", None),
+            target_config.get("targets", None),
+        ]
+        return any(_writes_to_stdout(c) for c in wrapped)
+    elif isinstance(target_config, (list, tuple)):
+        return any(_writes_to_stdout(c) for c in target_config)
+    return False
+
+
+def _run_worker(
+    worker_id: int,
+    source_config: str,
+    target_configs: List[str],
+    terminal: bool,
+    stats_queue: multiprocessing.Queue,
+    stop_event,
+) -> None:
+    """Entry point for a worker process: run a pipeline from the source config to the target configs until stopped."""
+
+    from upcheck.sources import CheckSource
+    from upcheck.targets import CheckTarget
+    from upcheck.upcheck import Upcheck
+
+    async def run():
+
+        _source = CheckSource.create_from_file(source_config)
+        _targets: List = [CheckTarget.create_from_file(t) for t in target_configs]
+        if terminal:
+            from upcheck.targets.terminal import TerminalTarget
+
+            # keep results printed to the terminal apart from those written to stdout
+            console = None
+            if any(t.writes_to_stdout for t in _targets):
+                console = Console(file=sys.stderr)
+            _targets.insert(0, TerminalTarget(console=console))
+
+        upcheck = Upcheck(source=_source, targets=_targets)
+
+        def report():
+            stats_queue.put((worker_id, dict(upcheck.stats)))
+
+        try:
+            await upcheck.connect()
+
+            async with create_task_group() as tg:
+
+                async def watch_stop_event():
+
+                    last_report = time.monotonic()
+                    while not stop_event.is_set():
+                        await anyio.sleep(0.5)
+                        if time.monotonic() - last_report >= STATS_INTERVAL:
+                            report()
+                            last_report = time.monotonic()
+
+                    # the pipeline finishes (and cancels this task) once the batches that were read are written
+                    await upcheck.stop_reading()
+                    await anyio.sleep(DRAIN_TIMEOUT)
+                    log.warning(
+                        f"Worker {worker_id} could not write pending batches within {DRAIN_TIMEOUT} seconds, cancelling..."
+                    )
+                    await tg.cancel_scope.cancel()
+
+                async def run_pipeline():
+
+                    await upcheck.start(wait_for_keypress=False)
+                    await tg.cancel_scope.cancel()
+
+                await tg.spawn(watch_stop_event)
+                await tg.spawn(run_pipeline)
+
+        finally:
+            await upcheck.disconnect()
+            report()
+
+    anyio.run(run)
+
+
+class UpcheckSupervisor(object):
+    """Run several 'Upcheck' pipelines in separate processes, and supervise them.
+
+    Every worker process creates its own source and targets from the same config files. This is only useful for
+    sources that can be split up between processes, like a 'kafka' source (all workers join the same consumer group,
+    and Kafka assigns each of them a share of the partitions of the topic).
+
+    Workers that crash are restarted, unless they fail right after they were started.
+
+    Targets that can't be shared between processes (check 'SINGLE_PROCESS_TARGET_TYPES') can't be used with more than
+    one worker.
+
+    Args:
+        source_config (str): path to the source config file
+        target_configs (Iterable[str]): paths to target config files
+        workers (int): the number of worker processes
+        terminal (bool): whether to add a terminal target to each worker
+        console (Optional[Console]): optional rich.console.Console object, for terminal output. A new one will be created if not provided.
+    """
+
+    def __init__(
+        self,
+        source_config: str,
+        target_configs: Iterable[str],
+        workers: int,
+        terminal: bool = False,
+        console: Optional[Console] = None,
+    ):
+
+        if workers < 1:
+            raise UpcheckException(
+                msg=f"Can't create supervisor for {workers} workers.",
+                reason="Number of workers must be at least 1.",
+            )
+
+        from upcheck.targets import CheckTarget
+
+        target_configs = list(target_configs)
+        self._writes_to_stdout: bool = False
+        for target_config in target_configs:
+            config = CheckTarget.load_config(target_config)
+            if _writes_to_stdout(config):
+                self._writes_to_stdout = True
+            if workers > 1:
+                types = _get_target_types(config)
+                invalid = sorted(types.intersection(SINGLE_PROCESS_TARGET_TYPES))
+                if invalid:
+                    raise UpcheckException(
+                        msg=f"Can't use target config '{target_config}' with {workers} workers.",
+                        reason=f"Target type(s) can't be shared between worker processes: {', '.join(invalid)}",
+                        solution="Use a single worker, or a different target type (e.g. 'postgres' instead of 'sqlite').",
+                    )
+
+        self._source_config: str = source_config
+        self._target_configs: List[str] = target_configs
+        self._workers: int = workers
+        self._terminal: bool = terminal
+
+        if console is None:
+            console = Console()
+        self._console = console
+
+        self._context = multiprocessing.get_context("spawn")
+        self._stats_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+
+        self._processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._started: Dict[int, float] = {}
+        self._worker_stats: Dict[Tuple[int, int], Mapping[str, int]] = {}
+        self._incarnations: Counter = Counter()
+
+    @property
+    def writes_to_stdout(self) -> bool:
+        """Whether one of the targets writes its output to stdout (check 'CheckTarget.writes_to_stdout')."""
+        return self._writes_to_stdout
+
+    @property
+    def stats(self) -> Mapping[str, int]:
+        """The stats of all workers (including restarted ones), added up."""
+
+        total: Counter = Counter()
+        for stats in self._worker_stats.values():
+            total.update(stats)
+        return total
+
+    def _start_worker(self, worker_id: int) -> None:
+
+        self._incarnations[worker_id] += 1
+        process = self._context.Process(
+            target=_run_worker,
+            args=(
+                worker_id,
+                self._source_config,
+                self._target_configs,
+                self._terminal,
+                self._stats_queue,
+                self._stop_event,
+            ),
+            name=f"upcheck-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+        self._started[worker_id] = time.monotonic()
+        log.debug(f"Started worker {worker_id} (pid: {process.pid}).")
+
+    def _collect_stats(self) -> None:
+
+        while True:
+            try:
+                worker_id, stats = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._worker_stats[(worker_id, self._incarnations[worker_id])] = stats
+
+    async def _supervise(self) -> None:
+
+        while not self._stop_event.is_set():
+
+            await anyio.sleep(0.5)
+            self._collect_stats()
+
+            for worker_id, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+
+                uptime = time.monotonic() - self._started[worker_id]
+                if process.exitcode == 0:
+                    log.debug(f"Worker {worker_id} finished.")
+                    self._processes.pop(worker_id)
+                    continue
+
+                if uptime < MIN_WORKER_UPTIME:
+                    raise UpcheckException(
+                        msg=f"Worker {worker_id} failed after {uptime:.1f} seconds.",
+                        reason=f"Exit code: {process.exitcode}",
+                        solution="Check the source and target configurations, and the log output of the worker.",
+                    )
+
+                log.warning(
+                    f"Worker {worker_id} exited with code {process.exitcode}, restarting..."
+                )
+                self._start_worker(worker_id)
+
+            if not self._processes:
+                return
+
+    async def start(self, wait_for_keypress: bool = True) -> None:
+        """Start all workers, and supervise them until they are finished, or the user presses 'q'."""
+
+        for worker_id in range(self._workers):
+            self._start_worker(worker_id)
+
+        try:
+            if wait_for_keypress:
+                await wait_for_tasks_or_user_keypress(
+                    {"func": self._supervise}, console=self._console
+                )
+            else:
+                await wait_for_tasks({"func": self._supervise})
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        """Signal all workers to stop, and wait for them to finish.
+
+        Workers stop reading from their source, write the batches they already read (for at most 'DRAIN_TIMEOUT'
+        seconds), and disconnect. Workers that didn't stop after 'STOP_TIMEOUT' seconds are terminated.
+        """
+
+        self._stop_event.set()
+
+        def join():
+            deadline = time.monotonic() + STOP_TIMEOUT
+            for process in self._processes.values():
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    log.warning(f"Worker '{process.name}' did not stop, terminating...")
+                    process.terminate()
+                    process.join()
+
+        await run_in_thread(join)
+        self._processes.clear()
+        self._collect_stats()
@@ -5,16 +5,33 @@ import os
 import uuid
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
-from typing import Any, List, MutableMapping, Optional, Union
+from typing import Any, Iterable, List, Mapping, MutableMapping, Optional, Union
 
+from anyio import create_task_group
 from ruamel.yaml import YAML
+from upcheck.aggregation import RollupWriter
 from upcheck.exceptions import UpcheckException
-from upcheck.models import CheckMetric
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.utils.callables import run_concurrently
+from upcheck.utils.columns import ColumnarCheckMetrics
 
 
 log = logging.getLogger("upcheck")
 
-AVAILABLE_TARGET_TYPES = ["kafka", "postgres", "kafka-aiven", "postgres-aiven"]
+AVAILABLE_TARGET_TYPES = [
+    "kafka",
+    "postgres",
+    "kafka-aiven",
+    "postgres-aiven",
+    "terminal",
+    "aggregate",
+    "changes",
+    "spool",
+    "file",
+    "sqlite",
+    "prometheus",
+    "ndjson",
+]
 
 
 class CheckTarget(metaclass=ABCMeta):
@@ -34,6 +51,20 @@ class CheckTarget(metaclass=ABCMeta):
         Returns:
             CheckTarget: the target object
         """
+
+        return cls.create_from_dict(target_config=cls.load_config(path))
+
+    @classmethod
+    def load_config(cls, path: Union[str, Path]) -> MutableMapping[str, Any]:
+        """Load a target configuration from a (yaml) file.
+
+        Args:
+            path: the path to the target config
+
+        Returns:
+            MutableMapping[str, Any]: the target configuration
+        """
+
         if isinstance(path, str):
             path = Path(os.path.expanduser(path))
 
@@ -58,7 +89,7 @@ class CheckTarget(metaclass=ABCMeta):
                 reason="File content must be dictionary.",
             )
 
-        return cls.create_from_dict(target_config=content)
+        return content
 
     @classmethod
     def create_from_dict(cls, target_config: MutableMapping[str, Any]):
@@ -103,6 +134,54 @@ class CheckTarget(metaclass=ABCMeta):
 
                 target = AivenKafkaTarget(**target_config)
 
+            elif target_type == "terminal":
+
+                from upcheck.targets.terminal import TerminalTarget
+
+                target = TerminalTarget(**target_config)
+
+            elif target_type == "aggregate":
+
+                from upcheck.targets.aggregate import AggregatingTarget
+
+                target = AggregatingTarget(**target_config)
+
+            elif target_type == "changes":
+
+                from upcheck.targets.changes import ChangesTarget
+
+                target = ChangesTarget(**target_config)
+
+            elif target_type == "spool":
+
+                from upcheck.targets.spool import SpoolingTarget
+
+                target = SpoolingTarget(**target_config)
+
+            elif target_type == "file":
+
+                from upcheck.targets.file import FileTarget
+
+                target = FileTarget(**target_config)
+
+            elif target_type == "sqlite":
+
+                from upcheck.targets.sqlite import SqliteTarget
+
+                target = SqliteTarget(**target_config)
+
+            elif target_type == "prometheus":
+
+                from upcheck.targets.prometheus import PrometheusTarget
+
+                target = PrometheusTarget(**target_config)
+
+            elif target_type == "ndjson":
+
+                from upcheck.targets.ndjson import NdjsonTarget
+
+                target = NdjsonTarget(**target_config)
+
             else:
                 raise UpcheckException(
                     msg="Can't create target.",
@@ -127,6 +206,19 @@ class CheckTarget(metaclass=ABCMeta):
         """Disconnect the target."""
         pass
 
+    @property
+    def writes_to_stdout(self) -> bool:
+        """Whether the target writes its output to stdout (in which case status output should go somewhere else)."""
+        return False
+
+    async def run(self) -> None:
+        """Do background work (e.g. periodic flushes) while the pipeline is running.
+
+        Started (after connecting) when the pipeline starts, and cancelled when it stops, before the target is
+        disconnected. Returns immediately by default.
+        """
+        pass
+
     @abstractmethod
     def get_id(self) -> str:
         """The internal id of the target.
@@ -140,30 +232,219 @@ class CheckTarget(metaclass=ABCMeta):
         """Write a result to this target."""
         pass
 
+    @property
+    def supports_summaries(self) -> bool:
+        """Whether this target can write 'CheckSummary' objects (as created by an 'aggregate' target)."""
+        return False
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+        """Write summaries of aggregated metrics to this target."""
+
+        raise UpcheckException(
+            msg=f"Can't write summaries to target '{self.get_id()}'.",
+            reason=f"Target type '{self.__class__.__name__}' does not support summaries.",
+        )
+
     def __repr__(self):
         return f"({self.__class__.__name__}: id={self.get_id()}"
 
 
+class WrappingTarget(CheckTarget):
+    """Base class for targets that process check results, and forward them to other targets.
+
+    Args:
+        targets (Iterable[Union[CheckTarget, Mapping]]): the targets to forward to (target objects, or target configurations)
+        id (str): the id of this target
+    """
+
+    def __init__(
+        self,
+        targets: Iterable[Union[CheckTarget, Mapping[str, Any]]],
+        id: Optional[str] = None,
+    ):
+
+        self._targets: List[CheckTarget] = []
+        for target in targets:
+            if isinstance(target, collections.abc.Mapping):
+                target = CheckTarget.create_from_dict(dict(target))
+            self._targets.append(target)
+
+        if not self._targets:
+            raise UpcheckException(
+                msg=f"Can't create target '{self.__class__.__name__}'.",
+                reason="No targets specified.",
+            )
+
+        if id is None:
+            id = str(uuid.uuid4())
+        self._id: str = id
+
+    @property
+    def targets(self) -> List[CheckTarget]:
+        return self._targets
+
+    async def connect(self) -> None:
+
+        failed = await run_concurrently(
+            {index: target.connect for index, target in enumerate(self._targets)}
+        )
+        if not failed:
+            return
+        if len(failed) == 1:
+            raise list(failed.values())[0]
+
+        _reason = []
+        for index, target in enumerate(self._targets):
+            if index in failed:
+                _reason.append(f"  [bold]{target.get_id()}[/bold]:")
+                _reason.append(f"       {failed[index]}")
+        raise UpcheckException(
+            msg=f"Can't connect to {len(failed)} wrapped targets.",
+            reason="\n".join(_reason),
+        )
+
+    @property
+    def writes_to_stdout(self) -> bool:
+        return any(t.writes_to_stdout for t in self._targets)
+
+    async def run(self) -> None:
+
+        async with create_task_group() as tg:
+            for target in self._targets:
+                await tg.spawn(target.run)
+
+    async def disconnect(self) -> None:
+
+        failed = await run_concurrently(
+            {index: target.disconnect for index, target in enumerate(self._targets)}
+        )
+        for index, e in failed.items():
+            log.warning(
+                f"Failed to disconnect target '{self._targets[index].get_id()}': {e}"  # type: ignore
+            )
+
+    async def _forward(self, results: Iterable[CheckMetric]) -> None:
+
+        for target in self._targets:
+            await target.write(*results)
+
+    async def _forward_summaries(self, summaries: Iterable[CheckSummary]) -> None:
+
+        for target in self._targets:
+            await target.write_summaries(*summaries)
+
+
+class RollupTarget(CheckTarget):
+    """Base class for targets that can write per-url summaries of the check results they receive.
+
+    If 'rollup_interval' is set, check results are aggregated (check 'CheckAggregator'), and the summary of each
+    interval is written with 'write_summaries' once the interval is closed. Summaries that can't be written are
+    retried with the next write (check 'RollupWriter').
+
+    Sub-classes call '_init_rollup' in their constructor, write individual check results in '_write_metrics', and
+    call '_flush_rollup' when disconnecting.
+    """
+
+    def _init_rollup(
+        self, rollup_interval: Optional[float], rollup_grace: float, write_raw: bool
+    ) -> None:
+
+        self._rollup: Optional[RollupWriter] = None
+        if rollup_interval:
+            self._rollup = RollupWriter(
+                self.write_summaries, interval=rollup_interval, grace=rollup_grace
+            )
+        elif not write_raw:
+            raise UpcheckException(
+                msg=f"Can't create target '{self.get_id()}'.",
+                reason="'write_raw' can only be disabled if 'rollup_interval' is set.",
+            )
+        self._write_raw: bool = write_raw
+
+    @property
+    def supports_summaries(self) -> bool:
+        return True
+
+    async def run(self) -> None:
+
+        if self._rollup is not None:
+            await self._rollup.run()
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if self._write_raw:
+            await self._write_metrics(*results)
+
+        if self._rollup is not None:
+            await self._rollup.add(*results)
+
+    async def _flush_rollup(self) -> None:
+        """Summarize and write all intervals that are still open."""
+
+        if self._rollup is not None:
+            await self._rollup.flush()
+
+    @abstractmethod
+    async def _write_metrics(self, *results: CheckMetric) -> None:
+        """Write individual check results."""
+        pass
+
+
 class CollectorCheckTarget(CheckTarget):
     """Target to collect results.
 
     This is mainly used in testing, but can also be used to hold test results in memory for other reasons.
+
+    If 'columnar' is set, results are stored in typed arrays (check 'ColumnarCheckMetrics'), which takes up a lot less
+    memory, and offers aggregated values per url check. In that case, the items of 'results' are re-created on each
+    access.
+
+    Args:
+        id (str): the id of the target
+        columnar (bool): whether to store results in columns, instead of a list of 'CheckMetric' objects
     """
 
-    def __init__(self, id: Optional[str] = None):
+    def __init__(self, id: Optional[str] = None, columnar: bool = False):
 
         if id is None:
             id = str(uuid.uuid4())
         self._id = id
         self._results: List[CheckMetric] = []
+        self._summaries: List[CheckSummary] = []
+        self._columns: Optional[ColumnarCheckMetrics] = None
+        if columnar:
+            self._columns = ColumnarCheckMetrics()
 
     def get_id(self) -> str:
         return self._id
 
     async def write(self, *results: CheckMetric) -> None:
 
-        self._results.extend(results)
+        if self._columns is not None:
+            self._columns.extend(results)
+        else:
+            self._results.extend(results)
+
+    @property
+    def supports_summaries(self) -> bool:
+        return True
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        self._summaries.extend(summaries)
 
     @property
     def results(self) -> List[CheckMetric]:
+
+        if self._columns is not None:
+            return list(self._columns)
         return self._results
+
+    @property
+    def columns(self) -> Optional[ColumnarCheckMetrics]:
+        """The collected results, if this target was created with 'columnar' enabled."""
+        return self._columns
+
+    @property
+    def summaries(self) -> List[CheckSummary]:
+        return self._summaries
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Iterable, Mapping, Optional, Union
+
+from anyio import create_task_group
+from upcheck.aggregation import CheckAggregator, RollupWriter
+from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import CheckTarget, WrappingTarget
+from upcheck.utils.sketch import DEFAULT_RELATIVE_ACCURACY
+
+
+class AggregatingTarget(WrappingTarget):
+    """Target that aggregates check metrics per url, and writes periodic summaries to other targets.
+
+    Summaries contain the number of checks and failures, minimum, maximum and mean response times, response time
+    percentiles (computed from mergeable sketches, so memory usage per url is fixed) and a response time histogram for
+    a time window. Check 'CheckAggregator' for details on how windows are handled. Summaries that can't be written are
+    retried with the next write (check 'RollupWriter'). If no metrics arrive, the last window is summarized once
+    'interval' plus 'grace' seconds have passed (check 'CheckAggregator.close_expired').
+
+    Args:
+        targets (Iterable[Union[CheckTarget, Mapping]]): the targets to write summaries to (target objects, or target configurations)
+        interval (float): the time (in seconds) between summaries
+        window (float): the time (in seconds) each summary covers, must be a multiple of 'interval' (defaults to 'interval')
+        grace (float): how long (in seconds) to wait for late metrics before an interval is closed
+        percentiles (Iterable[float]): the response time percentiles to compute
+        histogram_bounds (Iterable[int]): the upper bounds of the response time histogram buckets, in milliseconds
+        relative_accuracy (float): the maximum relative error of the computed percentiles
+        forward_metrics (bool): whether to also write the individual metrics to the targets
+        id (str): the id of this target
+    """
+
+    def __init__(
+        self,
+        targets: Iterable[Union[CheckTarget, Mapping[str, Any]]],
+        interval: float = 60,
+        window: Optional[float] = None,
+        grace: float = 0,
+        percentiles: Optional[Iterable[float]] = None,
+        histogram_bounds: Optional[Iterable[int]] = None,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        forward_metrics: bool = False,
+        id: Optional[str] = None,
+    ):
+
+        super().__init__(targets=targets, id=id)
+
+        for target in self._targets:
+            if not target.supports_summaries:
+                raise UpcheckException(
+                    msg=f"Can't use target '{target.get_id()}' for aggregated metrics.",
+                    reason=f"Target type '{target.__class__.__name__}' does not support summaries.",
+                )
+
+        self._rollup: RollupWriter = RollupWriter(
+            self._write_summaries,
+            interval=interval,
+            window=window,
+            grace=grace,
+            percentiles=percentiles,
+            histogram_bounds=histogram_bounds,
+            relative_accuracy=relative_accuracy,
+        )
+        self._forward_metrics: bool = forward_metrics
+
+    def get_id(self) -> str:
+
+        return f"aggregate::{self._id}"
+
+    @property
+    def aggregator(self) -> CheckAggregator:
+        return self._rollup.aggregator
+
+    async def run(self) -> None:
+
+        async with create_task_group() as tg:
+            await tg.spawn(self._rollup.run)
+            await tg.spawn(super().run)
+
+    async def disconnect(self) -> None:
+
+        try:
+            await self._rollup.flush()
+        finally:
+            await super().disconnect()
+
+    async def _write_summaries(self, *summaries: CheckSummary) -> None:
+
+        await self._forward_summaries(summaries)
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if self._forward_metrics:
+            await self._forward(results)
+
+        await self._rollup.add(*results)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Iterable, Mapping, Optional, Union
+
+from upcheck.filters import ChangeFilter
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import CheckTarget, WrappingTarget
+
+
+class ChangesTarget(WrappingTarget):
+    """Target that only forwards check metrics to other targets if they differ from the previous ones.
+
+    Check 'ChangeFilter' for details on when a metric is forwarded. The last forwarded values are only updated after
+    the other targets were written to successfully, so changes are not lost if a write fails, and the results are
+    re-delivered.
+
+    Args:
+        targets (Iterable[Union[CheckTarget, Mapping]]): the targets to forward metrics to (target objects, or target configurations)
+        latency_threshold (int): the (absolute) response time difference, in milliseconds, after which a metric is forwarded
+        latency_ratio (float): the (relative) response time difference after which a metric is forwarded (e.g. 0.5 for 50%)
+        heartbeat_interval (float): the maximum time, in seconds, between two forwarded metrics for the same url
+        id (str): the id of this target
+    """
+
+    def __init__(
+        self,
+        targets: Iterable[Union[CheckTarget, Mapping[str, Any]]],
+        latency_threshold: Optional[int] = 100,
+        latency_ratio: Optional[float] = None,
+        heartbeat_interval: Optional[float] = 300,
+        id: Optional[str] = None,
+    ):
+
+        super().__init__(targets=targets, id=id)
+
+        self._filter: ChangeFilter = ChangeFilter(
+            latency_threshold=latency_threshold,
+            latency_ratio=latency_ratio,
+            heartbeat_interval=heartbeat_interval,
+        )
+
+    def get_id(self) -> str:
+
+        return f"changes::{self._id}"
+
+    @property
+    def filter(self) -> ChangeFilter:
+        return self._filter
+
+    @property
+    def supports_summaries(self) -> bool:
+
+        return all(t.supports_summaries for t in self._targets)
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        await self._forward_summaries(summaries)
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        changed, commit = self._filter.select(results)
+        if changed:
+            await self._forward(changed)
+        # only once forwarding succeeded, otherwise the changes would be suppressed when the results are re-delivered
+        commit()
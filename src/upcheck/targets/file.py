@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import gzip
+import logging
+import os
+import shutil
+from typing import BinaryIO, Optional
+
+from anyio import run_in_thread
+from upcheck.models import CheckMetric
+from upcheck.targets import CheckTarget
+from upcheck.utils.records import SEGMENT_HEADER, encode_record
+from upcheck.utils.timestamps import micros_to_datetime, now_micros
+
+
+log = logging.getLogger("upcheck")
+
+SEGMENT_FILE_SUFFIX = ".ucseg"
+COMPRESSION_SUFFIXES = {"gzip": ".gz"}
+
+
+def _compress_file(path: str, compression: str) -> str:
+    """Compress a file, and delete the original. Returns the path of the compressed file."""
+
+    if compression != "gzip":
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    compressed = path + COMPRESSION_SUFFIXES[compression]
+    with open(path, "rb") as f_in, gzip.open(compressed, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(path)
+    return compressed
+
+
+class FileTarget(CheckTarget):
+    """Target to write check results to (binary) segment files in a local folder.
+
+    A new segment file is started every 'rotate_interval' seconds (aligned to multiples of the interval, so hourly
+    segments start at the full hour). Segment files are named '<prefix>-<start time>-<sequence number>.ucseg', which
+    means sorting them by name also sorts them by time. Closed segments can be compressed. Use a 'file' source to read
+    them again.
+
+    Args:
+        path (str): the folder to write segment files to
+        prefix (str): the prefix for segment file names
+        rotate_interval (float): the time (in seconds) after which a new segment file is started
+        compression (str): if set, closed segment files are compressed using this algorithm (only 'gzip' is supported)
+        fsync (bool): whether to sync segment files to disk when they are closed
+    """
+
+    def __init__(
+        self,
+        path: str,
+        prefix: str = "upcheck",
+        rotate_interval: float = 3600,
+        compression: Optional[str] = None,
+        fsync: bool = True,
+    ):
+
+        if rotate_interval <= 0:
+            raise ValueError(
+                f"Invalid rotate interval '{rotate_interval}', must be positive."
+            )
+        if compression is not None and compression not in COMPRESSION_SUFFIXES.keys():
+            raise ValueError(
+                f"Invalid compression '{compression}', must be one of: {', '.join(COMPRESSION_SUFFIXES.keys())}"
+            )
+
+        self._path: str = os.path.realpath(os.path.expanduser(path))
+        self._prefix: str = prefix
+        self._rotate_interval: int = int(rotate_interval * 1000000)
+        self._compression: Optional[str] = compression
+        self._fsync: bool = fsync
+
+        self._writer: Optional[BinaryIO] = None
+        self._segment_file: Optional[str] = None
+        self._segment_start: Optional[int] = None
+
+    def get_id(self) -> str:
+
+        return f"file::{self._path}"
+
+    @property
+    def segment_file(self) -> Optional[str]:
+        """The path of the segment file that is currently written to."""
+        return self._segment_file
+
+    async def connect(self) -> None:
+
+        os.makedirs(self._path, exist_ok=True)
+
+    async def disconnect(self) -> None:
+
+        await self._close_segment()
+
+    async def _close_segment(self) -> None:
+
+        if self._writer is None:
+            return
+
+        self._writer.flush()
+        if self._fsync:
+            os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._writer = None
+
+        if self._compression is not None:
+            path: str = self._segment_file  # type: ignore
+            compressed = await run_in_thread(_compress_file, path, self._compression)
+            log.debug(f"Compressed segment file: {compressed}")
+
+    async def _rotate(self, segment_start: int) -> None:
+
+        await self._close_segment()
+
+        os.makedirs(self._path, exist_ok=True)
+        timestamp = micros_to_datetime(segment_start).strftime("%Y%m%dT%H%M%SZ")
+        sequence = 0
+        while True:
+            name = f"{self._prefix}-{timestamp}-{sequence:04d}{SEGMENT_FILE_SUFFIX}"
+            path = os.path.join(self._path, name)
+            if not any(
+                os.path.exists(path + suffix)
+                for suffix in ["", *COMPRESSION_SUFFIXES.values()]
+            ):
+                break
+            sequence += 1
+
+        self._writer = open(path, "wb")
+        self._writer.write(SEGMENT_HEADER)
+        self._segment_file = path
+        self._segment_start = segment_start
+        log.debug(f"Started segment file: {path}")
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        now = now_micros()
+        segment_start = now - now % self._rotate_interval
+        if self._writer is None or segment_start != self._segment_start:
+            await self._rotate(segment_start)
+
+        self._writer.write(b"".join(encode_record(r) for r in results))  # type: ignore
+        self._writer.flush()  # type: ignore
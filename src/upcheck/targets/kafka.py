@@ -1,23 +1,31 @@
 # -*- coding: utf-8 -*-
-import io
-import os
-from typing import Any, Mapping, Optional
+import logging
+from typing import Optional
 
-import avro.schema
-from avro.io import DatumWriter
-from upcheck.models import CheckMetric
-from upcheck.targets import CheckTarget
-from upcheck.utils import create_temp_dir_with_text_files
-from upcheck.utils.aiven import UpcheckAivenClient
-from upcheck.utils.kafka import CHECK_METRIC_SCHEMA, UpcheckKafkaClient
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import RollupTarget
+from upcheck.utils.kafka import (
+    SCHEMA_VERSION,
+    EncodedCheckMetric,
+    UpcheckKafkaClient,
+    create_message_headers,
+    create_message_key,
+    create_summary_message_headers,
+    encode_check_metric,
+    encode_check_summary,
+)
 
 
-CHECK_METRIC_WRITER = DatumWriter(CHECK_METRIC_SCHEMA)
+log = logging.getLogger("upcheck")
 
 
-class KafkaTarget(CheckTarget):
+class KafkaTarget(RollupTarget):
     """Target to send check results to a Kafka topic.
 
+    If 'rollup_interval' is set, per-url summaries are sent to 'summary_topic' when an interval closes, keyed by url
+    and with their own schema version header (check 'create_summary_message_headers'). Consumers that only need the
+    summaries can disable 'write_raw', so a single message per url and interval is sent instead of one per check.
+
     Args:
         hsot (str): the host that runs the Kafka service
         port (int): the port on which Kafka listens
@@ -26,6 +34,10 @@ class KafkaTarget(CheckTarget):
         cafile (str): path to a ca file
         certfile (str): path to a cert file
         keyfile (str): path to a key file
+        summary_topic (str): the topic to send summaries to, defaults to the value of 'topic' with a '-summaries' suffix
+        rollup_interval (float): if set, send summaries of check results over intervals of this many seconds
+        rollup_grace (float): how long (in seconds) to wait for late check results before an interval is summarized
+        write_raw (bool): whether to send the individual check results, can only be disabled if 'rollup_interval' is set
     """
 
     def __init__(
@@ -37,6 +49,10 @@ class KafkaTarget(CheckTarget):
         cafile: Optional[str] = None,
         certfile: Optional[str] = None,
         keyfile: Optional[str] = None,
+        summary_topic: Optional[str] = None,
+        rollup_interval: Optional[float] = None,
+        rollup_grace: float = 0,
+        write_raw: bool = True,
     ):
 
         self._client = UpcheckKafkaClient(
@@ -48,6 +64,32 @@ class KafkaTarget(CheckTarget):
             certfile=certfile,
             keyfile=keyfile,
         )
+        self._init_output(
+            topic=topic,
+            summary_topic=summary_topic,
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
+        )
+
+    def _init_output(
+        self,
+        topic: str,
+        summary_topic: Optional[str],
+        rollup_interval: Optional[float],
+        rollup_grace: float,
+        write_raw: bool,
+    ) -> None:
+
+        if summary_topic is None:
+            summary_topic = f"{topic}-summaries"
+        self._summary_topic: str = summary_topic
+
+        self._init_rollup(
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
+        )
 
     def get_id(self) -> str:
 
@@ -59,38 +101,57 @@ class KafkaTarget(CheckTarget):
 
     async def disconnect(self) -> None:
 
-        await self._client.disconnect_producer()
+        try:
+            await self._flush_rollup()
+        finally:
+            await self._client.disconnect_producer()
 
-    async def write(self, *results: CheckMetric) -> None:
+    async def _write_metrics(self, *results: CheckMetric) -> None:
 
         producer = await self._client.get_producer()
 
         for result in results:
 
-            bytes_writer = io.BytesIO()
-            encoder = avro.io.BinaryEncoder(bytes_writer)
+            if (
+                isinstance(result, EncodedCheckMetric)
+                and result.schema_version == SCHEMA_VERSION
+            ):
+                # forward message as is, no need to decode and re-encode it
+                value = result.value
+                key = result.key
+                headers = result.headers
+            else:
+                value = encode_check_metric(result)
+                key = create_message_key(result)
+                headers = create_message_headers(result)
 
-            # we need to convert the start time to a string
-            # since datetime is not natively supported
-            data = dict(result.report_data)
-            data["check_time"] = str(data["check_time"])
+            await producer.send_and_wait(
+                self._client.topic, value, key=key, partition=0, headers=headers
+            )
 
-            if data["regex"] is None:
-                data.pop("regex")
-            if data["regex_matched"] is None:
-                data.pop("regex_matched")
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
 
-            CHECK_METRIC_WRITER.write(data, encoder)
+        if not summaries:
+            return
 
-            bytes = bytes_writer.getvalue()
+        producer = await self._client.get_producer()
 
-            await producer.send_and_wait(self._client.topic, bytes, partition=0)
+        for summary in summaries:
+            await producer.send_and_wait(
+                self._summary_topic,
+                encode_check_summary(summary),
+                key=summary.url_check.url.encode(),
+                partition=0,
+                headers=create_summary_message_headers(summary),
+            )
 
 
 class AivenKafkaTarget(KafkaTarget):
     """Convenience target class to not have to provide most of the Kafka config values manually.
 
-    Only useful if using the Aiven service.
+    Only useful if using the Aiven service. The service details are looked up when the target connects (check
+    'AivenServiceDiscovery'), and cached for 'cache_ttl' seconds. If connecting with cached details fails, they are
+    looked up again.
 
     Args:
         topic (str): the topic to send check results to
@@ -99,6 +160,11 @@ class AivenKafkaTarget(KafkaTarget):
         group_id (str): ignored for sources, only present to prevent errors when re-using a config for both Kafka source and target
         project_name (str): the name of the  aiven project to use
         service_name (str): the name of the Kafka service to use
+        summary_topic (str): the topic to send summaries to, defaults to the value of 'topic' with a '-summaries' suffix
+        rollup_interval (float): if set, send summaries of check results over intervals of this many seconds
+        rollup_grace (float): how long (in seconds) to wait for late check results before an interval is summarized
+        write_raw (bool): whether to send the individual check results, can only be disabled if 'rollup_interval' is set
+        cache_ttl (float): the time (in seconds) to use cached service details for, defaults to one hour
 
     """
 
@@ -110,34 +176,67 @@ class AivenKafkaTarget(KafkaTarget):
         project_name: Optional[str] = None,
         group_id: Optional[str] = None,
         service_name: Optional[str] = None,
+        summary_topic: Optional[str] = None,
+        rollup_interval: Optional[float] = None,
+        rollup_grace: float = 0,
+        write_raw: bool = True,
+        cache_ttl: Optional[float] = None,
     ):
 
-        # TODO: lazy initialization, on demand
-        self._aiven_client: UpcheckAivenClient = UpcheckAivenClient(
-            token_or_account_password=password, email=email
-        )
-        self._kafka_service_details: Mapping[
-            str, Any
-        ] = self._aiven_client.get_kafka_service_details(
-            project_name=project_name, service_name=service_name
+        self._password: str = password
+        self._email: Optional[str] = email
+        self._project_name: Optional[str] = project_name
+        self._service_name: Optional[str] = service_name
+        self._topic: str = topic
+        self._group_id: Optional[str] = group_id
+        self._cache_ttl: Optional[float] = cache_ttl
+
+        self._client: Optional[UpcheckKafkaClient] = None  # type: ignore
+        self._init_output(
+            topic=topic,
+            summary_topic=summary_topic,
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
         )
 
-        ca_cert = self._kafka_service_details["ca_cert"]
-        access_cert = self._kafka_service_details["access_cert"]
-        access_key = self._kafka_service_details["access_key"]
+    def get_id(self) -> str:
+
+        return f"kafka-aiven::{self._project_name or 'default'}/{self._service_name or 'default'}/{self._topic}"
+
+    async def _discover(self, refresh: bool = False) -> bool:
+        """Look up the service details, and create the Kafka client; returns whether cached details were used."""
+
+        # imported here, so the aiven client is only loaded for aiven services
+        from upcheck.utils.aiven import get_service_discovery
 
-        temp_dir = create_temp_dir_with_text_files(
-            {"ca.pem": ca_cert, "service.cert": access_cert, "service.key": access_key}
+        self._client, cached = await get_service_discovery().create_kafka_client(
+            topic=self._topic,
+            token_or_account_password=self._password,
+            email=self._email,
+            project_name=self._project_name,
+            service_name=self._service_name,
+            group_id=self._group_id,
+            refresh=refresh,
+            cache_ttl=self._cache_ttl,
         )
+        return cached
+
+    async def connect(self) -> None:
+
+        cached = await self._discover()
+        try:
+            await super().connect()
+        except Exception as e:
+            if not cached:
+                raise
+            log.debug(
+                f"Can't connect to '{self.get_id()}' with cached service details, looking them up again: {e}"
+            )
+            await self._discover(refresh=True)
+            await super().connect()
+
+    async def disconnect(self) -> None:
 
-        kafka_target_config = {
-            "host": self._kafka_service_details["host"],
-            "port": self._kafka_service_details["port"],
-            "topic": topic,
-            "group_id": group_id,
-            "cafile": os.path.join(temp_dir, "ca.pem"),
-            "certfile": os.path.join(temp_dir, "service.cert"),
-            "keyfile": os.path.join(temp_dir, "service.key"),
-        }
-
-        super().__init__(**kafka_target_config)
+        if self._client is not None:
+            await super().disconnect()
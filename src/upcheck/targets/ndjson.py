@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, List, Mapping, Optional
+
+from anyio import run_in_thread
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import CheckTarget
+
+
+log = logging.getLogger("upcheck")
+
+STDOUT_FD = 1
+"""The file descriptor lines are written to by default (if the cli writes to it as well, it prints status output to stderr instead)."""
+
+STOP_TIMEOUT = 5.0
+"""How long (in seconds) to wait for the writer thread to write the remaining lines on disconnect (e.g. if the reader of a pipe is stuck)."""
+
+
+def _encode_line(data: Mapping[str, Any]) -> str:
+
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+class NdjsonTarget(CheckTarget):
+    """Target that writes check results as newline-delimited json (one compact json object per line).
+
+    Lines are buffered, and written once 'batch_size' lines are buffered, or every 'flush_interval' seconds. Writing
+    happens in a background thread, so a slow reader never blocks writes to this target: if more than 'max_pending'
+    batches are waiting to be written, new batches are dropped (and a warning is logged).
+
+    Summaries are written as lines too, they can be told apart from check results by their 'start_time' key.
+
+    Args:
+        path (str): the file to append lines to, if not set, lines are written to the file descriptor 'fd'
+        fd (int): the file descriptor to write to, defaults to stdout (check 'writes_to_stdout')
+        batch_size (int): the number of buffered lines after which they are written
+        flush_interval (float): the maximum time (in seconds) lines are buffered
+        max_pending (int): the maximum number of batches waiting to be written
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        fd: int = STDOUT_FD,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_pending: int = 100,
+    ):
+
+        if flush_interval <= 0:
+            raise ValueError(
+                f"Invalid flush interval '{flush_interval}', must be positive."
+            )
+
+        self._path: Optional[str] = (
+            os.path.realpath(os.path.expanduser(path)) if path else None
+        )
+        self._fd: int = fd
+        self._batch_size: int = batch_size
+        self._flush_interval: float = flush_interval
+
+        self._buffer: List[str] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._pending: "queue.Queue[str]" = queue.Queue(maxsize=max_pending)
+        self._done: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file_fd: Optional[int] = None
+
+        self._dropped: int = 0
+        self._failed: bool = False
+
+    def get_id(self) -> str:
+
+        if self._path:
+            return f"ndjson::{self._path}"
+        return f"ndjson::fd{self._fd}"
+
+    @property
+    def writes_to_stdout(self) -> bool:
+        return self._path is None and self._fd == STDOUT_FD
+
+    @property
+    def dropped(self) -> int:
+        """The number of lines that were dropped, because the output could not keep up."""
+        return self._dropped
+
+    async def connect(self) -> None:
+
+        if self._thread is not None:
+            return
+
+        if self._path:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            self._file_fd = os.open(
+                self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+            )
+
+        self._done.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="upcheck-ndjson", daemon=True
+        )
+        self._thread.start()
+
+    async def disconnect(self) -> None:
+
+        if self._thread is None:
+            return
+
+        with self._lock:
+            self._submit()
+        self._done.set()
+        try:
+            # wake up the writer thread, if the queue is full it doesn't wait anyway
+            self._pending.put_nowait("")
+        except queue.Full:
+            pass
+        await run_in_thread(self._thread.join, STOP_TIMEOUT)
+
+        if self._thread.is_alive():
+            # most likely blocked on a full pipe, the (daemon) thread is left behind, and stops writing once it's
+            # unblocked; the file descriptor is not closed, since it might be re-used while the thread still writes
+            log.warning(
+                f"Output of '{self.get_id()}' didn't finish within {STOP_TIMEOUT} seconds, remaining lines are dropped."
+            )
+            self._failed = True
+            self._thread = None
+            return
+        self._thread = None
+
+        if self._file_fd is not None:
+            os.close(self._file_fd)
+            self._file_fd = None
+
+    def _output(self, data: str) -> None:
+
+        if self._failed:
+            return
+
+        fd = self._file_fd if self._file_fd is not None else self._fd
+        view = memoryview(data.encode("utf-8"))
+        try:
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        except OSError as e:
+            # e.g. a closed pipe, there is no point in trying again
+            log.error(f"Can't write to '{self.get_id()}', disabling it: {e}")
+            self._failed = True
+
+    def _run(self) -> None:
+
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, last_flush + self._flush_interval - time.monotonic())
+            try:
+                self._output(self._pending.get(timeout=timeout))
+                if not self._done.is_set():
+                    continue
+            except queue.Empty:
+                pass
+
+            # batches are only queued while holding the lock, so if the queue is empty here, everything that was
+            # buffered earlier was written already, and lines stay in order
+            with self._lock:
+                if not self._pending.empty():
+                    continue
+                data = "".join(self._buffer)
+                self._buffer.clear()
+            if data:
+                self._output(data)
+            last_flush = time.monotonic()
+
+            if self._done.is_set():
+                return
+
+    def _submit(self) -> None:
+        """Queue all buffered lines for writing (must be called while holding the lock)."""
+
+        if not self._buffer:
+            return
+
+        try:
+            self._pending.put_nowait("".join(self._buffer))
+        except queue.Full:
+            self._dropped += len(self._buffer)
+            log.warning(
+                f"Output of '{self.get_id()}' can't keep up, dropped {len(self._buffer)} lines."
+            )
+        self._buffer.clear()
+
+    def _write_lines(self, lines: List[str]) -> None:
+
+        with self._lock:
+            self._buffer.extend(lines)
+            if len(self._buffer) >= self._batch_size:
+                self._submit()
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        self._write_lines([_encode_line(r.report_data) for r in results])
+
+    @property
+    def supports_summaries(self) -> bool:
+        return True
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        self._write_lines([_encode_line(s.report_data) for s in summaries])
@@ -1,19 +1,30 @@
 # -*- coding: utf-8 -*-
+import json
+import logging
 import os
-from typing import Any, Mapping, Optional
+from typing import Any, Awaitable, Callable, Optional
 
 import aiopg
+import anyio
 from aiopg import Connection
 from upcheck.exceptions import UpcheckException
-from upcheck.models import CheckMetric
-from upcheck.targets import CheckTarget
-from upcheck.utils import create_temp_dir_with_text_files
-from upcheck.utils.aiven import UpcheckAivenClient
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import RollupTarget
 
 
-class PostgresTarget(CheckTarget):
+log = logging.getLogger("upcheck")
+
+connection_factory: Optional[Callable[..., Awaitable[Any]]] = None
+"""If set, Postgres targets use this instead of 'aiopg.connect' to connect to the database (for tests and benchmarks, e.g. 'FakePostgresDatabase.connect')."""
+
+
+class PostgresTarget(RollupTarget):
     """Class to write check results to a postgres database.
 
+    If 'rollup_interval' is set, per-url summaries are inserted into the 'check_summaries' table (check
+    'db/migrations') when an interval closes. With 'write_raw' disabled as well, the 'check_results' table is not
+    written to at all, which cuts the insert rate from one row per check to one row per url and interval.
+
     Args:
         username (str): the Postgres username
         password (str): the Postgres password
@@ -22,6 +33,9 @@ class PostgresTarget(CheckTarget):
         port (int): the port the Postgres service listens on
         sslmode (str): the ssl mode to use
         sslrootcert (str): an optional path to a ca cert pem file
+        rollup_interval (float): if set, write summaries of check results over intervals of this many seconds
+        rollup_grace (float): how long (in seconds) to wait for late check results before an interval is summarized
+        write_raw (bool): whether to write the individual check results, can only be disabled if 'rollup_interval' is set
     """
 
     def __init__(
@@ -33,6 +47,9 @@ class PostgresTarget(CheckTarget):
         port: int = 5432,
         sslmode: Optional[str] = None,
         sslrootcert: Optional[str] = None,
+        rollup_interval: Optional[float] = None,
+        rollup_grace: float = 0,
+        write_raw: bool = True,
     ):
 
         self._username: str = username
@@ -46,7 +63,23 @@ class PostgresTarget(CheckTarget):
         self._sslmode: Optional[str] = sslmode
         self._sslrootcert: Optional[str] = sslrootcert
 
+        self._init_output(
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
+        )
+
+    def _init_output(
+        self, rollup_interval: Optional[float], rollup_grace: float, write_raw: bool
+    ) -> None:
+
+        self._init_rollup(
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
+        )
         self._connection: Optional[Connection] = None
+        self._lock: Optional[anyio.Lock] = None
 
     def get_id(self) -> str:
 
@@ -74,8 +107,9 @@ class PostgresTarget(CheckTarget):
 
     async def connect(self) -> Connection:
 
+        connect = aiopg.connect if connection_factory is None else connection_factory
         try:
-            self._connection = await aiopg.connect(
+            self._connection = await connect(
                 host=self.host,
                 port=self.port,
                 user=self.username,
@@ -91,8 +125,11 @@ class PostgresTarget(CheckTarget):
 
     async def disconnect(self) -> None:
 
-        if self._connection is not None:
-            await self._connection.close()
+        try:
+            await self._flush_rollup()
+        finally:
+            if self._connection is not None:
+                await self._connection.close()
 
     async def connection(self):
 
@@ -100,23 +137,32 @@ class PostgresTarget(CheckTarget):
             await self.connect()
         return self._connection
 
+    def _get_lock(self) -> anyio.Lock:
+
+        # locks can only be created within an event loop
+        if self._lock is None:
+            self._lock = anyio.create_lock()
+        return self._lock
+
     async def _insert(self, query: str, args) -> None:
 
-        # cur = await self.cursor()
-        connection = await self.connection()
-        async with connection.cursor() as cur:
-            await cur.execute(query, args)
+        # an aiopg connection can only run one query at a time, and inserts of check results and summaries (from
+        # the 'run' loop) happen concurrently
+        async with self._get_lock():
+            connection = await self.connection()
+            async with connection.cursor() as cur:
+                await cur.execute(query, args)
 
-    async def write(self, *results: CheckMetric) -> None:
+    async def _write_metrics(self, *results: CheckMetric) -> None:
 
         # TODO: could use arrays for more efficient batch inserts, but probably not worth it at this stage
         for result in results:
             query = """
-            INSERT INTO check_results (url, regex, start_time, response_time_ms, response_code, regex_match) VALUES(%s, %s, %s, %s, %s, %s)"""
+            INSERT INTO check_results (url, regex, start_time, response_time_ms, response_code, regex_match) VALUES(%s, %s, TIMESTAMPTZ 'epoch' + %s * INTERVAL '1 microsecond', %s, %s, %s)"""
             args = (
                 result.url_check.url,
                 result.url_check.regex,
-                result.check_time,
+                result.check_time_micros,
                 result.response_time,
                 result.response_code,
                 result.regex_matched,
@@ -124,11 +170,35 @@ class PostgresTarget(CheckTarget):
 
             await self._insert(query, args)
 
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        for summary in summaries:
+            query = """
+            INSERT INTO check_summaries (url, regex, start_time, end_time, check_count, failure_count, response_time_min_ms, response_time_max_ms, response_time_mean_ms, response_time_percentiles, histogram_bounds_ms, histogram_counts) VALUES(%s, %s, TIMESTAMPTZ 'epoch' + %s * INTERVAL '1 microsecond', TIMESTAMPTZ 'epoch' + %s * INTERVAL '1 microsecond', %s, %s, %s, %s, %s, %s, %s, %s)"""
+            args = (
+                summary.url_check.url,
+                summary.url_check.regex,
+                summary.start_time_micros,
+                summary.end_time_micros,
+                summary.count,
+                summary.failures,
+                summary.response_time_min,
+                summary.response_time_max,
+                summary.response_time_mean,
+                json.dumps(summary.report_data["percentiles"]),
+                summary.histogram_bounds,
+                summary.histogram_counts,
+            )
+
+            await self._insert(query, args)
+
 
 class AivenPostgresTarget(PostgresTarget):
     """Convenience source class to not have to provide most of the Kafka config values manually.
 
-    Only useful if using the Aiven service.
+    Only useful if using the Aiven service. The service details are looked up when the target connects (check
+    'AivenServiceDiscovery'), and cached for 'cache_ttl' seconds. If connecting with cached details fails, they are
+    looked up again.
 
     Args:
         dbname (str): the database name
@@ -137,6 +207,10 @@ class AivenPostgresTarget(PostgresTarget):
         group_id (str): the group id of the Kafka consumer
         project_name (str): the name of the  aiven project to use
         service_name (str): the name of the Postgres service to use
+        rollup_interval (float): if set, write summaries of check results over intervals of this many seconds
+        rollup_grace (float): how long (in seconds) to wait for late check results before an interval is summarized
+        write_raw (bool): whether to write the individual check results, can only be disabled if 'rollup_interval' is set
+        cache_ttl (float): the time (in seconds) to use cached service details for, defaults to one hour
 
     """
 
@@ -147,29 +221,66 @@ class AivenPostgresTarget(PostgresTarget):
         email: Optional[str] = None,
         project_name: Optional[str] = None,
         service_name: Optional[str] = None,
+        rollup_interval: Optional[float] = None,
+        rollup_grace: float = 0,
+        write_raw: bool = True,
+        cache_ttl: Optional[float] = None,
     ):
 
-        # TODO: lazy initialization, on demand
-        self._client = UpcheckAivenClient(
-            token_or_account_password=password, email=email
+        self._aiven_password: str = password
+        self._email: Optional[str] = email
+        self._project_name: Optional[str] = project_name
+        self._service_name: Optional[str] = service_name
+        self._cache_ttl: Optional[float] = cache_ttl
+
+        self._dbname: str = dbname
+        self._sslmode: Optional[str] = "verify-ca"
+        self._sslrootcert: Optional[str] = None
+        self._init_output(
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
         )
-        self._postgres_service_details: Mapping[
-            str, Any
-        ] = self._client.get_postgres_service_details(
-            project_name=project_name, service_name=service_name
+
+    def get_id(self) -> str:
+
+        return f"postgres-aiven::{self._project_name or 'default'}/{self._service_name or 'default'}/{self._dbname}"
+
+    async def _discover(self, refresh: bool = False) -> bool:
+        """Look up the service details; returns whether cached details were used."""
+
+        # imported here, so the aiven client is only loaded for aiven services
+        from upcheck.utils.aiven import get_service_discovery
+
+        discovery = get_service_discovery()
+        details, cached = await discovery.discover_service(
+            "pg",
+            token_or_account_password=self._aiven_password,
+            email=self._email,
+            project_name=self._project_name,
+            service_name=self._service_name,
+            refresh=refresh,
+            cache_ttl=self._cache_ttl,
         )
+        cert_dir = discovery.get_cert_dir({"ca.pem": details["ca_cert"]})
 
-        ca_cert = self._postgres_service_details["ca_cert"]
-        temp_dir = create_temp_dir_with_text_files({"ca.pem": ca_cert})
+        self._username = details["user"]
+        self._password = details["password"]
+        self._host = details["host"]
+        self._port = details["port"]
+        self._sslrootcert = os.path.join(cert_dir, "ca.pem")
+        return cached
 
-        postgres_target_config = {
-            "username": self._postgres_service_details["user"],
-            "password": self._postgres_service_details["password"],
-            "host": self._postgres_service_details["host"],
-            "port": self._postgres_service_details["port"],
-            "dbname": dbname,
-            "sslmode": "verify-ca",
-            "sslrootcert": os.path.join(temp_dir, "ca.pem"),
-        }
+    async def connect(self) -> Connection:
 
-        super().__init__(**postgres_target_config)
+        cached = await self._discover()
+        try:
+            return await super().connect()
+        except Exception as e:
+            if not cached:
+                raise
+            log.debug(
+                f"Can't connect to '{self.get_id()}' with cached service details, looking them up again: {e}"
+            )
+            await self._discover(refresh=True)
+            return await super().connect()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+
+from anyio import run_in_thread
+from upcheck.aggregation import DEFAULT_HISTOGRAM_BOUNDS
+from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.targets import CheckTarget
+
+
+log = logging.getLogger("upcheck")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label_value(value: str) -> str:
+
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_float(value: float) -> str:
+
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _UrlMetrics(object):
+    """The metrics of a single url check, updated with every check result."""
+
+    __slots__ = ("labels", "buckets", "count", "sum", "codes", "last_seen", "up")
+
+    def __init__(self, url_check: UrlCheck, bucket_count: int):
+
+        labels = f'url="{_escape_label_value(url_check.url)}"'
+        if url_check.regex is not None:
+            labels = f'{labels},regex="{_escape_label_value(url_check.regex)}"'
+        self.labels: str = labels
+
+        # non-cumulative, the last bucket is '+Inf'
+        self.buckets: List[int] = [0] * (bucket_count + 1)
+        self.count: int = 0
+        self.sum: int = 0
+        self.codes: Dict[int, int] = {}
+        self.last_seen: int = 0
+        self.up: bool = False
+
+
+class PrometheusMetrics(object):
+    """Per-url metrics of check results, in a format that can be scraped by Prometheus.
+
+    All metrics are updated incrementally when check results are added, rendering them only depends on the number of
+    url checks. This class is thread-safe.
+
+    Args:
+        histogram_bounds (Iterable[int]): the (inclusive) upper bounds of the response time histogram buckets, in milliseconds
+        prefix (str): the prefix for all metric names
+    """
+
+    def __init__(
+        self, histogram_bounds: Optional[Iterable[int]] = None, prefix: str = "upcheck"
+    ):
+
+        if histogram_bounds is None:
+            histogram_bounds = DEFAULT_HISTOGRAM_BOUNDS
+        self._histogram_bounds: List[int] = sorted(histogram_bounds)
+        self._prefix: str = prefix
+
+        self._metrics: Dict[UrlCheck, _UrlMetrics] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, *results: CheckMetric) -> None:
+        """Add check results."""
+
+        bounds = self._histogram_bounds
+        with self._lock:
+            for result in results:
+                metrics = self._metrics.get(result.url_check, None)
+                if metrics is None:
+                    metrics = _UrlMetrics(result.url_check, len(bounds))
+                    self._metrics[result.url_check] = metrics
+
+                metrics.buckets[bisect.bisect_left(bounds, result.response_time)] += 1
+                metrics.count += 1
+                metrics.sum += result.response_time
+                metrics.codes[result.response_code] = (
+                    metrics.codes.get(result.response_code, 0) + 1
+                )
+                check_time = result.check_time_micros
+                if check_time >= metrics.last_seen:
+                    metrics.last_seen = check_time
+                    metrics.up = result.is_up
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+
+        prefix = self._prefix
+        bounds = [_format_float(b / 1000) for b in self._histogram_bounds] + ["+Inf"]
+
+        with self._lock:
+            all_metrics = list(self._metrics.values())
+
+            lines: List[str] = [
+                f"# HELP {prefix}_response_time_seconds The response time of checks.",
+                f"# TYPE {prefix}_response_time_seconds histogram",
+            ]
+            for m in all_metrics:
+                cumulative = 0
+                for bound, count in zip(bounds, m.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'{prefix}_response_time_seconds_bucket{{{m.labels},le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f"{prefix}_response_time_seconds_sum{{{m.labels}}} {_format_float(m.sum / 1000)}"
+                )
+                lines.append(
+                    f"{prefix}_response_time_seconds_count{{{m.labels}}} {m.count}"
+                )
+
+            lines.append(
+                f"# HELP {prefix}_responses_total The number of checks, per response code."
+            )
+            lines.append(f"# TYPE {prefix}_responses_total counter")
+            for m in all_metrics:
+                for code, count in sorted(m.codes.items()):
+                    lines.append(
+                        f'{prefix}_responses_total{{{m.labels},code="{code}"}} {count}'
+                    )
+
+            lines.append(
+                f"# HELP {prefix}_last_check_timestamp_seconds The time of the latest check."
+            )
+            lines.append(f"# TYPE {prefix}_last_check_timestamp_seconds gauge")
+            for m in all_metrics:
+                lines.append(
+                    f"{prefix}_last_check_timestamp_seconds{{{m.labels}}} {_format_float(m.last_seen / 1000000)}"
+                )
+
+            lines.append(
+                f"# HELP {prefix}_up Whether the latest check succeeded (1) or not (0)."
+            )
+            lines.append(f"# TYPE {prefix}_up gauge")
+            for m in all_metrics:
+                lines.append(f"{prefix}_up{{{m.labels}}} {1 if m.up else 0}")
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    metrics: PrometheusMetrics
+    path_: str
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] != self.path_:
+            self.send_error(404)
+            return
+
+        body = self.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        log.debug(f"Metrics request: {format % args}")
+
+
+class PrometheusTarget(CheckTarget):
+    """Target that exposes per-url metrics of check results via a local HTTP endpoint, to be scraped by Prometheus.
+
+    Metrics are a response time histogram, a counter of responses per response code, the time of the last check, and
+    whether it succeeded. They are kept in memory and updated as results arrive (check 'PrometheusMetrics'). The
+    endpoint is served from a background thread.
+
+    Args:
+        host (str): the interface to listen on
+        port (int): the port to listen on ('0' picks a free port)
+        path (str): the url path of the metrics endpoint
+        histogram_bounds (Iterable[int]): the (inclusive) upper bounds of the response time histogram buckets, in milliseconds
+        prefix (str): the prefix for all metric names
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 9468,
+        path: str = "/metrics",
+        histogram_bounds: Optional[Iterable[int]] = None,
+        prefix: str = "upcheck",
+    ):
+
+        self._host: str = host
+        self._port: int = port
+        self._path: str = path
+        self._metrics: PrometheusMetrics = PrometheusMetrics(
+            histogram_bounds=histogram_bounds, prefix=prefix
+        )
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def get_id(self) -> str:
+
+        return f"prometheus::{self._host}:{self._port}{self._path}"
+
+    @property
+    def metrics(self) -> PrometheusMetrics:
+        return self._metrics
+
+    @property
+    def port(self) -> int:
+        """The port the endpoint listens on (the actual one, once connected)."""
+
+        if self._server is not None:
+            return self._server.server_address[1]
+        return self._port
+
+    async def connect(self) -> None:
+
+        if self._server is not None:
+            return
+
+        handler = type(
+            "MetricsRequestHandler",
+            (_MetricsRequestHandler,),
+            {"metrics": self._metrics, "path_": self._path},
+        )
+        try:
+            self._server = ThreadingHTTPServer((self._host, self._port), handler)
+        except Exception as e:
+            raise UpcheckException(
+                msg=f"Can't start metrics endpoint on {self._host}:{self._port}.",
+                reason=str(e),
+            )
+        self._server.daemon_threads = True
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="upcheck-prometheus", daemon=True
+        )
+        self._thread.start()
+        log.debug(f"Serving metrics on: http://{self._host}:{self.port}{self._path}")
+
+    async def disconnect(self) -> None:
+
+        if self._server is None:
+            return
+
+        server = self._server
+        self._server = None
+        await run_in_thread(server.shutdown)
+        server.server_close()
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        self._metrics.add(*results)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+import time
+from typing import Any, Callable, Iterable, Mapping, Optional, Union
+
+import anyio
+from anyio import create_task_group, fail_after, run_in_thread
+from upcheck.defaults import UPCHECK_SPOOL_FOLDER
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.spool import Spool
+from upcheck.targets import CheckTarget, WrappingTarget
+
+
+log = logging.getLogger("upcheck")
+
+
+class SpoolingTarget(WrappingTarget):
+    """Target that writes check metrics to another target, and spools them to disk if that target is unavailable.
+
+    If writing to the target fails (or takes longer than 'write_timeout' seconds), metrics are appended to an on-disk
+    spool (check 'Spool'), and all further metrics are too, until the spool was replayed. Replaying is attempted after
+    'retry_interval' seconds, in batches of 'replay_batch_size' metrics, and at most 'replay_max_batches' batches at a
+    time (so draining a large spool doesn't stall the pipeline): with every write, and in the background (check 'run'),
+    so the spool also drains while no metrics arrive. The spool is kept across restarts, all file access happens in
+    worker threads.
+
+    If the target can't be connected to, connecting is retried (after 'retry_interval' seconds) before the next write.
+
+    Summaries are forwarded as is, and not spooled.
+
+    Args:
+        target (Union[CheckTarget, Mapping]): the target to write to (a target object, or a target configuration)
+        path (str): the folder for the spool, defaults to a folder (named after the target id) in the user data directory
+        segment_size (int): the size of a spool segment, in bytes
+        max_size (int): the maximum size of the spool, in bytes, after which the oldest metrics are dropped
+        fsync (str): when to sync the spool to disk: 'always', 'interval' or 'never'
+        fsync_interval (float): the minimum time (in seconds) between syncs, if using the 'interval' policy
+        retry_interval (float): the time (in seconds) to wait after a failed write, before writing to the target again
+        write_timeout (float): the time (in seconds) after which a write to the target is considered failed
+        replay_batch_size (int): the number of metrics to read from the spool and write to the target at once
+        replay_max_batches (int): the maximum number of batches to replay with a single write
+        id (str): the id of this target
+    """
+
+    def __init__(
+        self,
+        target: Union[CheckTarget, Mapping[str, Any]],
+        path: Optional[str] = None,
+        segment_size: int = 16 * 1024 * 1024,
+        max_size: int = 1024 * 1024 * 1024,
+        fsync: str = "interval",
+        fsync_interval: float = 1.0,
+        retry_interval: float = 10.0,
+        write_timeout: Optional[float] = None,
+        replay_batch_size: int = 500,
+        replay_max_batches: int = 10,
+        id: Optional[str] = None,
+    ):
+
+        super().__init__(targets=[target], id=id)
+        self._target: CheckTarget = self._targets[0]
+
+        if path is None:
+            name = re.sub(r"[^\w.-]", "_", self._target.get_id())
+            path = os.path.join(UPCHECK_SPOOL_FOLDER, name)
+        self._spool: Spool = Spool(
+            path=path,
+            segment_size=segment_size,
+            max_size=max_size,
+            fsync=fsync,
+            fsync_interval=fsync_interval,
+        )
+
+        self._retry_interval: float = retry_interval
+        self._write_timeout: Optional[float] = write_timeout
+        self._replay_batch_size: int = replay_batch_size
+        self._replay_max_batches: int = replay_max_batches
+        self._retry_after: Optional[float] = None
+        self._connected: bool = False
+
+        self._lock: Optional[anyio.Lock] = None
+        self._replaying: bool = False
+
+    def get_id(self) -> str:
+
+        return f"spool::{self._target.get_id()}"
+
+    @property
+    def spool(self) -> Spool:
+        return self._spool
+
+    @property
+    def available(self) -> bool:
+        """Whether the target is assumed to be available (no write failed within the last 'retry_interval' seconds)."""
+
+        return self._retry_after is None or time.monotonic() >= self._retry_after
+
+    def _mark_unavailable(self) -> None:
+
+        self._retry_after = time.monotonic() + self._retry_interval
+
+    def _get_lock(self) -> anyio.Lock:
+
+        # locks can only be created within an event loop
+        if self._lock is None:
+            self._lock = anyio.create_lock()
+        return self._lock
+
+    async def _spool_call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a (blocking) spool operation in a worker thread, one at a time."""
+
+        async with self._get_lock():
+            return await run_in_thread(func, *args)
+
+    async def _is_pending(self) -> bool:
+
+        # no spool operation is in progress while the lock is held
+        async with self._get_lock():
+            return self._spool.pending
+
+    async def connect(self) -> None:
+
+        try:
+            await self._target.connect()
+            self._connected = True
+        except Exception as e:
+            log.warning(
+                f"Can't connect to target '{self._target.get_id()}', spooling metrics to '{self._spool.path}': {e}"
+            )
+            self._mark_unavailable()
+
+    async def disconnect(self) -> None:
+
+        try:
+            if self._connected:
+                await super().disconnect()
+        finally:
+            self._connected = False
+            await self._spool_call(self._spool.close)
+
+    async def run(self) -> None:
+
+        async with create_task_group() as tg:
+            await tg.spawn(super().run)
+
+            # replay the spool even if no metrics are written (e.g. because all checks are paused, or failing)
+            while True:
+                await anyio.sleep(min(1.0, self._retry_interval))
+                if self.available and await self._is_pending():
+                    await self.replay(max_batches=self._replay_max_batches)
+
+    @property
+    def supports_summaries(self) -> bool:
+        return self._target.supports_summaries
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        await self._target.write_summaries(*summaries)
+
+    async def _write_to_target(self, metrics: Iterable[CheckMetric]) -> None:
+
+        async with fail_after(self._write_timeout):
+            if not self._connected:
+                await self._target.connect()
+                self._connected = True
+                log.info(f"Connected to target '{self._target.get_id()}'.")
+            await self._target.write(*metrics)
+        self._retry_after = None
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if self.available and not await self._is_pending():
+            try:
+                await self._write_to_target(results)
+                return
+            except Exception as e:
+                log.warning(
+                    f"Can't write to target '{self._target.get_id()}', spooling metrics to '{self._spool.path}': {e}"
+                )
+                self._mark_unavailable()
+
+        await self._spool_call(self._spool.append, results)
+        await self.replay(max_batches=self._replay_max_batches)
+
+    async def replay(self, max_batches: Optional[int] = None) -> None:
+        """Write spooled metrics to the target, unless it is unavailable.
+
+        Args:
+            max_batches (Optional[int]): the maximum number of batches to write, all spooled metrics if not set
+        """
+
+        # replaying from 'write' and 'run' at the same time would deliver batches twice
+        if self._replaying:
+            return
+
+        self._replaying = True
+        try:
+            await self._replay(max_batches=max_batches)
+        finally:
+            self._replaying = False
+
+    async def _replay(self, max_batches: Optional[int]) -> None:
+
+        batches = 0
+        while self.available and (max_batches is None or batches < max_batches):
+
+            batches += 1
+
+            metrics, position = await self._spool_call(
+                self._spool.read, self._replay_batch_size
+            )
+            if metrics:
+                try:
+                    await self._write_to_target(metrics)
+                except Exception as e:
+                    log.warning(
+                        f"Can't replay spooled metrics to target '{self._target.get_id()}': {e}"
+                    )
+                    self._mark_unavailable()
+                    return
+
+            await self._spool_call(self._spool.commit, position)
+            if not metrics:
+                return
+
+            log.debug(
+                f"Replayed {len(metrics)} spooled metrics to target '{self._target.get_id()}'."
+            )
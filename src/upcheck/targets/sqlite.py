@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, List, Optional, Tuple
+
+import anyio
+from anyio import create_task_group, run_in_thread
+from upcheck.defaults import UPCHECK_SQLITE_DB_FILE
+from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, CheckSummary
+from upcheck.targets import RollupTarget
+
+
+log = logging.getLogger("upcheck")
+
+SYNCHRONOUS_MODES = ["OFF", "NORMAL", "FULL"]
+
+# equivalent to the schema in 'db/migrations', timestamps are stored as microseconds since the epoch, and arrays and
+# json values as json strings
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS check_results (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    regex TEXT,
+    start_time INTEGER NOT NULL,
+    response_time_ms INTEGER NOT NULL,
+    response_code INTEGER NOT NULL,
+    regex_match INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS check_results_url_start_time_idx ON check_results (url, start_time);
+
+CREATE TABLE IF NOT EXISTS check_summaries (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    regex TEXT,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    check_count INTEGER NOT NULL,
+    failure_count INTEGER NOT NULL,
+    response_time_min_ms INTEGER NOT NULL,
+    response_time_max_ms INTEGER NOT NULL,
+    response_time_mean_ms REAL NOT NULL,
+    response_time_percentiles TEXT,
+    histogram_bounds_ms TEXT NOT NULL,
+    histogram_counts TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS check_summaries_url_start_time_idx ON check_summaries (url, start_time);
+"""
+
+INSERT_CHECK_RESULT = """
+INSERT INTO check_results (url, regex, start_time, response_time_ms, response_code, regex_match) VALUES (?, ?, ?, ?, ?, ?)"""
+
+INSERT_CHECK_SUMMARY = """
+INSERT INTO check_summaries (url, regex, start_time, end_time, check_count, failure_count, response_time_min_ms, response_time_max_ms, response_time_mean_ms, response_time_percentiles, histogram_bounds_ms, histogram_counts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+class SqliteTarget(RollupTarget):
+    """Class to write check results to a (local) SQLite database.
+
+    The database uses the same tables as the Postgres target, and is created if it doesn't exist yet. It is opened in
+    WAL mode. Check results are buffered, and inserted in a single transaction (using the same cached, prepared
+    statement) once 'batch_size' results are buffered, or every 'flush_interval' seconds. Buffered results are written
+    when the target is disconnected, but are lost if the process is killed.
+
+    If 'rollup_interval' is set, per-url summaries are inserted into the 'check_summaries' table (in a transaction of
+    their own) when an interval closes. Together with 'write_raw' disabled, this keeps the size of a long-running
+    database proportional to the number of urls and intervals, rather than the number of checks.
+
+    Args:
+        path (str): the path to the database file, defaults to 'upcheck.db' in the user data directory
+        synchronous (str): the SQLite 'synchronous' setting: 'OFF', 'NORMAL' (safe in WAL mode, only the last transactions might be lost on power failure), or 'FULL'
+        batch_size (int): the number of buffered check results after which they are written
+        flush_interval (float): the maximum time (in seconds) check results are buffered
+        rollup_interval (float): if set, write summaries of check results over intervals of this many seconds
+        rollup_grace (float): how long (in seconds) to wait for late check results before an interval is summarized
+        write_raw (bool): whether to write the individual check results, can only be disabled if 'rollup_interval' is set
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        synchronous: str = "NORMAL",
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+        rollup_interval: Optional[float] = None,
+        rollup_grace: float = 0,
+        write_raw: bool = True,
+    ):
+
+        if path is None:
+            path = UPCHECK_SQLITE_DB_FILE
+        self._path: str = os.path.realpath(os.path.expanduser(path))
+
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(
+                f"Invalid synchronous mode '{synchronous}', must be one of: {', '.join(SYNCHRONOUS_MODES)}"
+            )
+        self._synchronous: str = synchronous
+
+        if flush_interval <= 0:
+            raise ValueError(
+                f"Invalid flush interval '{flush_interval}', must be positive."
+            )
+        self._batch_size: int = batch_size
+        self._flush_interval: float = flush_interval
+        self._rows: List[Tuple[Any, ...]] = []
+
+        self._init_rollup(
+            rollup_interval=rollup_interval,
+            rollup_grace=rollup_grace,
+            write_raw=write_raw,
+        )
+
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock: Optional[anyio.Lock] = None
+
+    def get_id(self) -> str:
+
+        return f"sqlite::{self._path}"
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # transactions are handled explicitly, and the connection is used from worker threads (one at a time)
+        connection = sqlite3.connect(
+            self._path, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self._synchronous}")
+        connection.executescript(SQLITE_SCHEMA)
+        return connection
+
+    async def connect(self) -> sqlite3.Connection:
+
+        if self._connection is not None:
+            return self._connection
+
+        try:
+            self._connection = await run_in_thread(self._connect)
+        except Exception as e:
+            raise UpcheckException(msg="Can't open database.", reason=str(e))
+
+        return self._connection
+
+    async def disconnect(self) -> None:
+
+        try:
+            try:
+                await self.flush()
+            finally:
+                await self._flush_rollup()
+        finally:
+            if self._connection is not None:
+                await run_in_thread(self._connection.close)
+                self._connection = None
+
+    def _insert_many(self, connection: sqlite3.Connection, query: str, rows) -> None:
+
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(query, rows)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _get_lock(self) -> anyio.Lock:
+
+        # locks can only be created within an event loop
+        if self._lock is None:
+            self._lock = anyio.create_lock()
+        return self._lock
+
+    async def _insert(self, query: str, rows) -> None:
+
+        if not rows:
+            return
+        # the connection is shared between worker threads, so only one transaction can be in progress at a time
+        async with self._get_lock():
+            connection = await self.connect()
+            await run_in_thread(self._insert_many, connection, query, rows)
+
+    async def flush(self) -> None:
+        """Write all buffered check results.
+
+        If that fails, the check results stay buffered.
+        """
+
+        rows = self._rows
+        self._rows = []
+        try:
+            await self._insert(INSERT_CHECK_RESULT, rows)
+        except Exception:
+            self._rows[:0] = rows
+            raise
+
+    async def run(self) -> None:
+
+        async with create_task_group() as tg:
+            await tg.spawn(super().run)
+            while True:
+                await anyio.sleep(self._flush_interval)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    log.warning(
+                        f"Can't write buffered results to '{self.get_id()}', retrying: {e}"
+                    )
+
+    async def _write_metrics(self, *results: CheckMetric) -> None:
+
+        rows = [
+            (
+                result.url_check.url,
+                result.url_check.regex,
+                result.check_time_micros,
+                result.response_time,
+                result.response_code,
+                result.regex_matched,
+            )
+            for result in results
+        ]
+        self._rows.extend(rows)
+        if len(self._rows) < self._batch_size:
+            return
+
+        try:
+            await self.flush()
+        except Exception:
+            # the failed write is retried by the caller, so only check results of earlier writes stay buffered
+            added = {id(row) for row in rows}
+            self._rows = [row for row in self._rows if id(row) not in added]
+            raise
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        rows = [
+            (
+                summary.url_check.url,
+                summary.url_check.regex,
+                summary.start_time_micros,
+                summary.end_time_micros,
+                summary.count,
+                summary.failures,
+                summary.response_time_min,
+                summary.response_time_max,
+                summary.response_time_mean,
+                json.dumps(summary.report_data["percentiles"]),
+                json.dumps(list(summary.histogram_bounds)),
+                json.dumps(list(summary.histogram_counts)),
+            )
+            for summary in summaries
+        ]
+        await self._insert(INSERT_CHECK_SUMMARY, rows)
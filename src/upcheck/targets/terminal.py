@@ -1,20 +1,277 @@
 # -*- coding: utf-8 -*-
-from upcheck.interfaces.cli.main import console
-from upcheck.models import CheckMetric
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from rich import box
+from rich.console import (
+    Console,
+    ConsoleOptions,
+    ConsoleRenderable,
+    RenderHook,
+    RenderResult,
+)
+from rich.control import Control
+from rich.live_render import LiveRender
+from rich.table import Table
+from upcheck.models import CheckMetric, CheckSummary, UrlCheck
 from upcheck.targets import CheckTarget
 
 
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values: List[int]) -> str:
+    """Render values as a string of block characters, scaled between their minimum and maximum."""
+
+    if not values:
+        return ""
+
+    low = min(values)
+    high = max(values)
+    if high == low:
+        return SPARKLINE_CHARS[0] * len(values)
+
+    scale = (len(SPARKLINE_CHARS) - 1) / (high - low)
+    return "".join(SPARKLINE_CHARS[int((v - low) * scale)] for v in values)
+
+
+class _UrlStatus(object):
+
+    __slots__ = ("last", "count", "errors", "response_times")
+
+    def __init__(self, sparkline_width: int):
+
+        self.last: Optional[CheckMetric] = None
+        self.count: int = 0
+        self.errors: int = 0
+        self.response_times: Deque[int] = deque(maxlen=sparkline_width)
+
+
+class CheckDashboard(object):
+    """A table with the latest status of each url check, renderable by rich.
+
+    Adding results only updates the state per url, rendering is independent of the number of results.
+
+    Args:
+        sparkline_width (int): the number of response times to show in the sparkline of each url
+    """
+
+    def __init__(self, sparkline_width: int = 20):
+
+        self._sparkline_width: int = sparkline_width
+        self._status: Dict[UrlCheck, _UrlStatus] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._version: int = 0
+
+    @property
+    def version(self) -> int:
+        """A number that changes whenever results are added."""
+        return self._version
+
+    def add(self, *results: CheckMetric) -> None:
+
+        with self._lock:
+            for result in results:
+                status = self._status.get(result.url_check, None)
+                if status is None:
+                    status = _UrlStatus(self._sparkline_width)
+                    self._status[result.url_check] = status
+
+                status.count += 1
+                if not result.is_up:
+                    status.errors += 1
+                status.response_times.append(result.response_time)
+                if (
+                    status.last is None
+                    or result.check_time_micros >= status.last.check_time_micros
+                ):
+                    status.last = result
+            self._version += 1
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+
+        table = Table(box=box.SIMPLE)
+        table.add_column("url")
+        table.add_column("status")
+        table.add_column("last check", style="italic")
+        table.add_column("response time", justify="right")
+        table.add_column("latency")
+        table.add_column("checks", justify="right")
+        table.add_column("errors", justify="right")
+
+        with self._lock:
+            for url_check, status in self._status.items():
+                last: CheckMetric = status.last  # type: ignore
+                url = url_check.url
+                if url_check.regex is not None:
+                    url = f"{url} ({url_check.regex})"
+                code = str(last.response_code)
+                if last.regex_matched is False:
+                    code = f"{code}, no match"
+                table.add_row(
+                    url,
+                    f"[green]{code}[/green]" if last.is_up else f"[red]{code}[/red]",
+                    last.check_time.astimezone().strftime("%H:%M:%S"),
+                    f"{last.response_time} ms",
+                    sparkline(list(status.response_times)),
+                    str(status.count),
+                    f"[red]{status.errors}[/red]" if status.errors else "0",
+                )
+
+        yield table
+
+
+class _DashboardDisplay(RenderHook):
+    """Keeps a dashboard at the bottom of the terminal, and re-renders it at a fixed rate (from a background thread)."""
+
+    def __init__(
+        self, console: Console, dashboard: CheckDashboard, refresh_rate: float
+    ):
+
+        self._console: Console = console
+        self._dashboard: CheckDashboard = dashboard
+        self._refresh_rate: float = refresh_rate
+        self._live_render: LiveRender = LiveRender(dashboard)
+        self._rendered_version: Optional[int] = None
+
+        self._lock: threading.RLock = threading.RLock()
+        self._done: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def process_renderables(
+        self, renderables: List[ConsoleRenderable]
+    ) -> List[ConsoleRenderable]:
+
+        return [self._live_render.position_cursor(), *renderables, self._live_render]
+
+    def refresh(self, force: bool = False) -> None:
+
+        with self._lock:
+            if not force and self._dashboard.version == self._rendered_version:
+                return
+            self._rendered_version = self._dashboard.version
+            with self._console:
+                self._console.print(Control(""))
+
+    def _run(self) -> None:
+
+        while not self._done.wait(1.0 / self._refresh_rate):
+            self.refresh()
+
+    def start(self) -> None:
+
+        if not self._console.is_terminal or self._thread is not None:
+            return
+
+        self._console.show_cursor(False)
+        self._console.push_render_hook(self)
+        self._done.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="upcheck-dashboard", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+
+        if self._thread is None:
+            return
+
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.refresh(force=True)
+            self._console.line()
+        finally:
+            self._console.show_cursor(True)
+            self._console.pop_render_hook()
+
+
 class TerminalTarget(CheckTarget):
-    """Simple target to print check results to the terminal."""
+    """Simple target to print check results to the terminal.
+
+    By default, every check result is printed. In 'dashboard' mode, a single table with the latest status of each url
+    is displayed instead, and re-rendered at most 'refresh_rate' times per second (if new results arrived), independent
+    of how many results are written. The dashboard is only displayed if the console is a terminal, otherwise it is
+    printed once, when the target is disconnected.
 
-    def __init__(self, **config):
+    Args:
+        console (Optional[Console]): optional rich.console.Console object to print to, defaults to the one used by the cli
+        dashboard (bool): whether to display a live dashboard instead of every check result
+        refresh_rate (float): the maximum number of dashboard updates per second
+        sparkline_width (int): the number of response times to show in the dashboard latency sparklines
+    """
 
+    def __init__(
+        self,
+        console: Optional[Console] = None,
+        dashboard: bool = False,
+        refresh_rate: float = 4,
+        sparkline_width: int = 20,
+        **config,
+    ):
+
+        if console is None:
+            # imported here, since the cli modules import this one
+            from upcheck.interfaces.cli.main import console
+
+        self._console: Console = console  # type: ignore
         self._config = config  # ignored for now
 
+        if refresh_rate <= 0:
+            raise ValueError(
+                f"Invalid refresh rate '{refresh_rate}', must be positive."
+            )
+
+        self._dashboard: Optional[CheckDashboard] = None
+        self._display: Optional[_DashboardDisplay] = None
+        if dashboard:
+            self._dashboard = CheckDashboard(sparkline_width=sparkline_width)
+            self._display = _DashboardDisplay(
+                console=self._console,
+                dashboard=self._dashboard,
+                refresh_rate=refresh_rate,
+            )
+
     def get_id(self) -> str:
         return "terminal"
 
+    @property
+    def dashboard(self) -> Optional[CheckDashboard]:
+        return self._dashboard
+
+    async def connect(self) -> None:
+
+        if self._display is not None:
+            self._display.start()
+
+    async def disconnect(self) -> None:
+
+        if self._display is None:
+            return
+
+        if self._console.is_terminal:
+            self._display.stop()
+        elif self._dashboard.version:  # type: ignore
+            self._console.print(self._dashboard)
+
     async def write(self, *results: CheckMetric) -> None:
 
+        if self._dashboard is not None:
+            self._dashboard.add(*results)
+            return
+
         for result in results:
-            console.print(result)
+            self._console.print(result)
+
+    @property
+    def supports_summaries(self) -> bool:
+        return True
+
+    async def write_summaries(self, *summaries: CheckSummary) -> None:
+
+        for summary in summaries:
+            self._console.print(summary)
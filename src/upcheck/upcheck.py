@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 import logging
 import os
-from typing import Dict, Iterable, Optional
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Union
 
-from anyio import create_task_group
+from anyio import CancelScope, create_queue, create_task_group, open_cancel_scope
 from rich.console import Console
+from upcheck.defaults import DEFAULT_CONNECT_TIMEOUT
 from upcheck.exceptions import UpcheckException
 from upcheck.models import CheckError, CheckMetric, CheckResult
 from upcheck.sources import CheckSource
 from upcheck.targets import CheckTarget
-from upcheck.utils.callables import wait_for_tasks, wait_for_tasks_or_user_keypress
+from upcheck.utils.callables import (
+    run_concurrently,
+    wait_for_tasks,
+    wait_for_tasks_or_user_keypress,
+)
 
 
 log = logging.getLogger("upcheck")
@@ -23,6 +29,8 @@ class Upcheck(object):
         source (CheckSource): the source object that emits 'CheckResult' objects
         targets (Iterable[CheckTarget]): a list of target objects that consume the 'CheckResults'
         console (Optional[Console]): optional rich.console.Console object, for terminal output. A new one will be created if not provided.
+        max_pending_batches (int): the maximum number of batches emitted by the source that wait to be written to the targets, after which the source is blocked
+        connect_timeout (float): the maximum time (in seconds) to connect to (or disconnect from) the source or a target, 'None' for no timeout
     """
 
     def __init__(
@@ -30,6 +38,8 @@ class Upcheck(object):
         source: CheckSource,
         targets: Iterable[CheckTarget],
         console: Optional[Console] = None,
+        max_pending_batches: int = 16,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
     ):
 
         self._source: CheckSource = source
@@ -46,53 +56,95 @@ class Upcheck(object):
             console = Console()
         self._console = console
 
-    async def connect(self):
-        """Connect the source and all targets."""
+        self._max_pending_batches: int = max_pending_batches
+        self._connect_timeout: Optional[float] = connect_timeout
+        self._stats: Counter = Counter()
 
-        log.debug(f"Trying to connect to source: {self._source.get_id()}")
+        self._read_scope: Optional[CancelScope] = None
+        self._reading_stopped: bool = False
 
-        await self._source.connect()
-        log.debug("Source connected.")
+    @property
+    def stats(self) -> Mapping[str, int]:
+        """Counters for processed results.
 
-        failed: Dict[CheckTarget, Exception] = {}
-        for _target in self._targets.values():
-            log.debug(f"Trying to connect to target: {_target.get_id()}...")
-            try:
-                await _target.connect()
-                log.debug("Target connected.")
-            except Exception as e:
-                failed[_target] = e
-        if failed:
-            if len(failed) == 1:
-                _ft = list(failed.keys())[0]
-                _fe = failed[_ft]
-                msg = f"Can't connect to target '{_ft.get_id()}'."
-                reason = str(_fe)
-            else:
-                failed_ids = [_ft.get_id() for _ft in failed.keys()]
-                msg = f"Can't connect to targets: {', '.join(failed_ids)}"
-                _reason = []
-                for _ft, _fe in failed.items():
-                    _reason.append(f"  [bold]{_ft.get_id()}[/bold]:")
-                    _reason.append(f"       {_fe}")
-                reason = "\n".join(_reason)
-            raise UpcheckException(msg=msg, reason=reason)
+        Keys: 'received' (all results), 'check_errors' (failed checks, not forwarded), 'written' (metrics written to all
+        targets), 'failed' (metrics that could not be written to at least one target).
+        """
 
-    async def disconnect(self):
-        """Disconnect the source and all targets"""
+        return self._stats
 
-        log.debug(f"Disconnecting source {self._source.get_id()}...")
-        await self._source.disconnect()
-        log.debug("Source disconnected.")
+    async def connect(self):
+        """Connect the source and all targets (concurrently).
 
-        for _target in self._targets.values():
+        If connecting to any of them fails (or takes longer than 'connect_timeout' seconds), an exception with the
+        details of all failures is raised.
+        """
 
-            try:
-                log.debug(f"Disconnecting target {_target.get_id()}...")
-                await _target.disconnect()
-                log.debug("Target disconnected.")
-            except Exception as e:
-                log.warning(f"Failed to disconnect target '{_target.get_id()}': {e}")
+        components: Dict[str, Union[CheckSource, CheckTarget]] = {
+            f"source::{self._source.get_id()}": self._source
+        }
+        components.update(self._targets)
+
+        for component in components.values():
+            log.debug(f"Trying to connect to: {component.get_id()}")
+        failed = await run_concurrently(
+            {key: c.connect for key, c in components.items()},
+            timeout=self._connect_timeout,
+        )
+        for key in components.keys():
+            if key not in failed.keys():
+                log.debug(f"Connected: {components[key].get_id()}")
+
+        source_error: Optional[Exception] = failed.pop(
+            f"source::{self._source.get_id()}", None
+        )
+        failed_targets: Dict[CheckTarget, Exception] = {
+            target: failed[key]
+            for key, target in self._targets.items()
+            if key in failed
+        }
+
+        if source_error is None and not failed_targets:
+            return
+
+        if source_error is not None:
+            msg = f"Can't connect to source '{self._source.get_id()}'."
+            _reason = [str(source_error)]
+            if failed_targets:
+                _reason.append("")
+                _reason.append("Failed targets:")
+        elif len(failed_targets) == 1:
+            _ft = list(failed_targets.keys())[0]
+            raise UpcheckException(
+                msg=f"Can't connect to target '{_ft.get_id()}'.",
+                reason=str(failed_targets[_ft]),
+            )
+        else:
+            failed_ids = [_ft.get_id() for _ft in failed_targets.keys()]
+            msg = f"Can't connect to targets: {', '.join(failed_ids)}"
+            _reason = []
+
+        for _ft, _fe in failed_targets.items():
+            _reason.append(f"  [bold]{_ft.get_id()}[/bold]:")
+            _reason.append(f"       {_fe}")
+        raise UpcheckException(msg=msg, reason="\n".join(_reason))
+
+    async def disconnect(self):
+        """Disconnect the source and all targets (concurrently)."""
+
+        components: Dict[str, Union[CheckSource, CheckTarget]] = {
+            f"source::{self._source.get_id()}": self._source
+        }
+        components.update(self._targets)
+
+        log.debug("Disconnecting source and targets...")
+        failed = await run_concurrently(
+            {key: c.disconnect for key, c in components.items()},
+            timeout=self._connect_timeout,
+        )
+        for key, e in failed.items():
+            log.warning(f"Failed to disconnect '{components[key].get_id()}': {e}")
+        log.debug("Source and targets disconnected.")
 
     async def start(self, wait_for_keypress: Optional[bool] = True):
         """Start the check/listen process.
@@ -110,10 +162,44 @@ class Upcheck(object):
 
         log.debug("Starting upcheck pipeline...")
 
+        # results are written concurrently to the source producing new ones, sources that need to limit the number
+        # of results in flight can keep track of them via 'acknowledge'
+        queue = create_queue(self._max_pending_batches)
+
+        async def read():
+
+            async with open_cancel_scope() as scope:
+                self._read_scope = scope
+                if not self._reading_stopped:
+                    async for check_results in self._source.start_batches():
+                        await queue.put(check_results)
+            self._read_scope = None
+            await queue.put(None)
+
+        async def write():
+
+            while True:
+                check_results = await queue.get()
+                if check_results is None:
+                    return
+                success = await self.write_results(*check_results)
+                await self._source.acknowledge(check_results, success=success)
+
+        async def run_targets():
+
+            async with create_task_group() as tg:
+                for target in self._targets.values():
+                    await tg.spawn(target.run)
+
         async def watch():
 
-            async for check_result in self._source.start():
-                await self.write_result(check_result)
+            async with create_task_group() as tg:
+                # background work of the targets (e.g. periodic flushes), for as long as results are processed
+                await tg.spawn(run_targets)
+                async with create_task_group() as pipeline:
+                    await pipeline.spawn(read)
+                    await pipeline.spawn(write)
+                await tg.cancel_scope.cancel()
 
             return
 
@@ -130,46 +216,88 @@ class Upcheck(object):
         rest_results: Optional[Iterable[CheckResult]] = await self._source.stop()
 
         if rest_results:
-            for r in rest_results:
-                await self.write_result(r)
+            await self.write_results(*rest_results)
 
         log.debug("upcheck pipeline stopped.")
 
+    async def stop_reading(self) -> None:
+        """Stop reading from the source.
+
+        Batches that were already read are still written to the targets (and acknowledged), after which 'start' returns.
+        """
+
+        self._reading_stopped = True
+        if self._read_scope is not None:
+            await self._read_scope.cancel()
+
     async def write_result(self, check_result: CheckResult) -> None:
         """Write result to all targets."""
 
-        if not self._targets:
-            return
+        await self.write_results(check_result)
 
-        if isinstance(check_result, CheckError):
-            log.error(f"Check error: {check_result.error()}")
-            return
+    async def write_results(self, *check_results: CheckResult) -> bool:
+        """Write a batch of results to all targets.
 
-        if not isinstance(check_result, CheckMetric):
-            raise Exception(
-                f"Invalid type '{type(check_result)}' for check result (should be 'CheckMetric'. This is a bug."
-            )
+        Check errors are logged, and not forwarded to the targets.
+
+        Returns:
+            bool: whether all targets wrote the results successfully
+        """
+
+        self._stats["received"] += len(check_results)
+
+        if not self._targets:
+            return True
+
+        metrics: List[CheckMetric] = []
+        for check_result in check_results:
+            if isinstance(check_result, CheckError):
+                log.error(f"Check error: {check_result.error()}")
+                self._stats["check_errors"] += 1
+                continue
+
+            if not isinstance(check_result, CheckMetric):
+                raise Exception(
+                    f"Invalid type '{type(check_result)}' for check result (should be 'CheckMetric'. This is a bug."
+                )
+            metrics.append(check_result)
+
+        if not metrics:
+            return True
 
         if len(self._targets) == 1:
             target = list(self._targets.values())[0]
-            log.debug(f"Write metric to target: {target.get_id()}")
+            log.debug(f"Write metrics to target: {target.get_id()}")
             try:
-                await target.write(check_result)
+                await target.write(*metrics)
             except Exception as e:
-                log.error(f"Can't write metric to target '{target.get_id()}': {e}")
+                log.error(f"Can't write metrics to target '{target.get_id()}': {e}")
+                self._stats["failed"] += len(metrics)
+                return False
 
-            return
+            self._stats["written"] += len(metrics)
+            return True
+
+        failed: List[CheckTarget] = []
 
-        async def wrap(_result: CheckMetric, _target: CheckTarget):
+        async def wrap(_target: CheckTarget):
 
-            log.debug(f"Write metric to target: {_target.get_id()}")
+            log.debug(f"Write metrics to target: {_target.get_id()}")
             try:
-                await _target.write(_result)
+                await _target.write(*metrics)
                 log.debug(f"Finished writing to target: {_target.get_id()}")
             except Exception as e:
-                log.error(f"Can't write metric to target '{_target.get_id()}': {e}")
+                log.error(f"Can't write metrics to target '{_target.get_id()}': {e}")
+                failed.append(_target)
 
         async with create_task_group() as tg:
 
             for _t in self._targets.values():
-                await tg.spawn(wrap, check_result, _t)
+                await tg.spawn(wrap, _t)
+
+        if failed:
+            self._stats["failed"] += len(metrics)
+            return False
+
+        self._stats["written"] += len(metrics)
+        return True
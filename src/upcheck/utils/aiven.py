@@ -1,21 +1,48 @@
 # -*- coding: utf-8 -*-
 import copy
+import hashlib
+import json
+import logging
 import os
-from typing import Any, Mapping, Optional
+import tempfile
+import threading
+import time
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, Mapping, Optional, Tuple
 
-import aiopg
-from aiopg import Connection
 from aiven.client import AivenClient
+from aiven.client.client import Error as AivenError
+from anyio import run_in_thread
+from upcheck.defaults import DEFAULT_AIVEN_CACHE_TTL, UPCHECK_AIVEN_CACHE_FILE
 from upcheck.exceptions import UpcheckException
 from upcheck.utils import create_temp_dir_with_text_files
 from upcheck.utils.kafka import UpcheckKafkaClient
 
 
+if TYPE_CHECKING:
+    from aiopg import Connection
+
+
+log = logging.getLogger("upcheck")
+
 API_URL = "https://api.aiven.io"
 
+AUTH_FAILURE_STATUS_CODES = (401, 403)
+
+
+def _hash(*values: Any) -> str:
+
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()
+
 
 class UpcheckAivenClient(object):
-    def __init__(self, token_or_account_password: str, email: Optional[str] = None):
+    def __init__(
+        self,
+        token_or_account_password: str,
+        email: Optional[str] = None,
+        auth_token: Optional[str] = None,
+        auth_token_callback: Optional[Callable[[Optional[str]], None]] = None,
+    ):
         """Aiven client wrapper class.
 
         This class only exposes and consolidates the minimal necessary functions of the underlying Aiven client, which is needed for
@@ -24,33 +51,72 @@ class UpcheckAivenClient(object):
         If only the 'token_or_access_password' arg is specified, token authentication will be used, if also 'email' is
         provided, the first argument will be interpreted as the account password, and a 'full' authentication will be done.
 
+        Authentication happens lazily, with the first API request. All requests are blocking.
+
         Args:
 
             token_or_account_password (str): the account token or password
             email (Optional[str]): the email address
+            auth_token (Optional[str]): an auth token from an earlier 'full' authentication, used instead of authenticating again (until the API rejects it)
+            auth_token_callback (Optional[Callable]): called with the auth token after a 'full' authentication, and with 'None' if the token was rejected
         """
 
         self._token_or_account_password: Optional[str] = token_or_account_password
         self._email: Optional[str] = email
 
         self._client = AivenClient(base_url=API_URL, show_http=False)
-        if self._email:
+        self._auth_token: Optional[str] = None
+        self._auth_token_callback: Optional[
+            Callable[[Optional[str]], None]
+        ] = auth_token_callback
+        self._lock: threading.RLock = threading.RLock()
+
+        if not self._email:
+            self._set_auth_token(self._token_or_account_password)  # type: ignore
+        elif auth_token:
+            self._set_auth_token(auth_token)
+
+    def _set_auth_token(self, auth_token: str) -> None:
+
+        self._auth_token = auth_token
+        self._client.set_auth_token(auth_token)
+
+    def _authenticate(self) -> None:
+
+        with self._lock:
+            if self._auth_token is not None:
+                return
+
             result = self._client.authenticate_user(
-                email=email, password=token_or_account_password
+                email=self._email, password=self._token_or_account_password
             )
-            # TODO: save to filesystem for subsequent logins
-            self._auth_token = result["token"]
-        else:
-            self._auth_token = self._token_or_account_password
-
-        self._client.set_auth_token(self._auth_token)
+            self._set_auth_token(result["token"])
+            if self._auth_token_callback is not None:
+                self._auth_token_callback(self._auth_token)
+
+    def _request(self, method: str, *args) -> Any:
+        """Call a method of the underlying client, and authenticate again once if a stored auth token is rejected."""
+
+        self._authenticate()
+        try:
+            return getattr(self._client, method)(*args)
+        except AivenError as e:
+            if not self._email or e.status not in AUTH_FAILURE_STATUS_CODES:
+                raise
+            log.debug("Aiven auth token rejected, authenticating again.")
+            with self._lock:
+                self._auth_token = None
+                if self._auth_token_callback is not None:
+                    self._auth_token_callback(None)
+            self._authenticate()
+            return getattr(self._client, method)(*args)
 
     def get_project_details(
         self, project_name: Optional[str] = None
     ) -> Mapping[str, Any]:
 
         if project_name is None:
-            projects = self._client.get_projects()
+            projects = self._request("get_projects")
             if len(projects) != 1:
                 raise UpcheckException(
                     msg="Can't retrieve details for default project.",
@@ -60,7 +126,7 @@ class UpcheckAivenClient(object):
 
             return projects[0]
 
-        for details in self._client.get_projects():
+        for details in self._request("get_projects"):
 
             if details["project_name"] == project_name:
                 return details
@@ -84,7 +150,9 @@ class UpcheckAivenClient(object):
         if service_name is not None:
 
             try:
-                service_details = self._client.get_service(project_name, service_name)
+                service_details = self._request(
+                    "get_service", project_name, service_name
+                )
 
                 if service_type:
                     if service_details["service_type"] != service_type:
@@ -102,7 +170,7 @@ class UpcheckAivenClient(object):
                 )
         else:
 
-            services = self._client.get_services(project_name)
+            services = self._request("get_services", project_name)
 
             if not service_type and len(services) != 1:
                 raise UpcheckException(
@@ -148,7 +216,8 @@ class UpcheckAivenClient(object):
         )
 
         project_name = kafka_service["project"]["project_name"]
-        project_ca_pem: str = self._client.get_project_ca(project_name)["certificate"]
+        project_ca: Mapping[str, Any] = self._request("get_project_ca", project_name)
+        project_ca_pem: str = project_ca["certificate"]
 
         host = kafka_service["service_uri_params"]["host"]
         port = int(kafka_service["service_uri_params"]["port"])
@@ -197,7 +266,8 @@ class UpcheckAivenClient(object):
         )
         project_name = postgres_service["project"]["project_name"]
 
-        project_ca_pem: str = self._client.get_project_ca(project_name)["certificate"]
+        project_ca: Mapping[str, Any] = self._request("get_project_ca", project_name)
+        project_ca_pem: str = project_ca["certificate"]
 
         details = copy.copy(postgres_service["service_uri_params"])
         details["ca_cert"] = project_ca_pem
@@ -258,7 +328,7 @@ class UpcheckAivenClient(object):
         user: Optional[str] = None,
         project_name: Optional[str] = None,
         service_name: Optional[str] = None,
-    ) -> Connection:
+    ) -> "Connection":
 
         postgres_service_details: Mapping[str, Any] = self.get_postgres_service_details(
             postgres_username=user, project_name=project_name, service_name=service_name
@@ -277,5 +347,304 @@ class UpcheckAivenClient(object):
             "sslrootcert": os.path.join(temp_dir, "ca.pem"),
         }
 
-        connection: Connection = await aiopg.connect(**postgres_config)
+        # only needed for postgres services
+        import aiopg
+
+        connection: "Connection" = await aiopg.connect(**postgres_config)
         return connection
+
+
+class AivenServiceDiscovery(object):
+    """Discovers the connection details of Aiven services, and caches them.
+
+    Service details (including credentials) and auth tokens are cached in memory, and in a json file only readable by
+    the current user. Cached service details are used for 'cache_ttl' seconds, auth tokens until the API rejects
+    them. Consumers of service details should call 'discover_service' again with 'refresh' set if connecting with
+    cached details fails (e.g. because credentials were rotated).
+
+    Lookups of the same service are done only once, even when requested concurrently, and certificate files are only
+    written once per distinct set of certificates. All sources and targets in a process share the instance returned by
+    'get_service_discovery'. This class is thread-safe.
+
+    Args:
+        cache_file (Optional[str]): the file to cache details in, 'None' to only cache them in memory
+        cache_ttl (float): the time (in seconds) to use cached service details for, '0' to disable caching
+    """
+
+    def __init__(
+        self,
+        cache_file: Optional[str] = UPCHECK_AIVEN_CACHE_FILE,
+        cache_ttl: float = DEFAULT_AIVEN_CACHE_TTL,
+    ):
+
+        self._cache_file: Optional[str] = cache_file
+        self._cache_ttl: float = cache_ttl
+
+        self._lock: threading.Lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._cache: Optional[Dict[str, Dict[str, Any]]] = None
+        self._clients: Dict[str, UpcheckAivenClient] = {}
+        self._cert_dirs: Dict[str, str] = {}
+
+    @property
+    def cache_ttl(self) -> float:
+        return self._cache_ttl
+
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        """Return the cache contents (must be called while holding the lock)."""
+
+        if self._cache is not None:
+            return self._cache
+
+        self._cache = {"tokens": {}, "services": {}}
+        if self._cache_file and os.path.exists(self._cache_file):
+            try:
+                with open(self._cache_file, "r") as f:
+                    data = json.load(f)
+                self._cache["tokens"].update(data.get("tokens", {}))
+                self._cache["services"].update(data.get("services", {}))
+            except Exception as e:
+                log.warning(
+                    f"Can't read Aiven cache file '{self._cache_file}', ignoring it: {e}"
+                )
+        return self._cache
+
+    def _save_cache(self) -> None:
+        """Write the cache contents to the cache file (must be called while holding the lock)."""
+
+        if not self._cache_file:
+            return
+
+        try:
+            cache_dir = os.path.dirname(self._cache_file)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".aiven-")
+            try:
+                os.chmod(temp_path, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._cache, f)
+                os.replace(temp_path, self._cache_file)
+            except Exception:
+                os.unlink(temp_path)
+                raise
+        except Exception as e:
+            log.warning(f"Can't write Aiven cache file '{self._cache_file}': {e}")
+
+    def _update_cache(self, section: str, key: str, value: Optional[Any]) -> None:
+
+        with self._lock:
+            cache = self._load_cache()
+            if value is None:
+                if cache[section].pop(key, None) is None:
+                    return
+            else:
+                cache[section][key] = {"time": time.time(), "value": value}
+            self._save_cache()
+
+    def get_client(
+        self, token_or_account_password: str, email: Optional[str] = None
+    ) -> UpcheckAivenClient:
+        """Return the (shared) Aiven client for the provided credentials."""
+
+        key = _hash(email, token_or_account_password)
+        with self._lock:
+            client = self._clients.get(key, None)
+            if client is not None:
+                return client
+
+            auth_token: Optional[str] = None
+            if email:
+                entry = self._load_cache()["tokens"].get(key, None)
+                if entry is not None:
+                    auth_token = entry["value"]
+
+            client = UpcheckAivenClient(
+                token_or_account_password=token_or_account_password,
+                email=email,
+                auth_token=auth_token,
+                auth_token_callback=partial(self._update_cache, "tokens", key),
+            )
+            self._clients[key] = client
+            return client
+
+    def get_service_details(
+        self,
+        service_type: str,
+        token_or_account_password: str,
+        email: Optional[str] = None,
+        project_name: Optional[str] = None,
+        service_name: Optional[str] = None,
+        username: Optional[str] = None,
+        refresh: bool = False,
+        cache_ttl: Optional[float] = None,
+    ) -> Tuple[Mapping[str, Any], bool]:
+        """Return the connection details of a 'kafka', or 'pg' service (blocking).
+
+        Args:
+            service_type (str): the type of the service
+            token_or_account_password (str): the account token or password
+            email (Optional[str]): the account email
+            project_name (Optional[str]): the project name, can be omitted if there is only one project
+            service_name (Optional[str]): the service name, can be omitted if there is only one service of that type
+            username (Optional[str]): the service user, defaults to the first one (Kafka) or the one of the service uri (Postgres)
+            refresh (bool): whether to ignore (and replace) cached details
+            cache_ttl (Optional[float]): the time (in seconds) to use cached details for, defaults to the one of this object
+
+        Returns:
+            Tuple[Mapping[str, Any], bool]: the service details, and whether they were cached
+        """
+
+        if service_type not in ["kafka", "pg"]:
+            raise ValueError(f"Invalid service type: {service_type}")
+        if cache_ttl is None:
+            cache_ttl = self._cache_ttl
+
+        key = _hash(
+            service_type,
+            email,
+            token_or_account_password,
+            project_name,
+            service_name,
+            username,
+        )
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if not refresh:
+                with self._lock:
+                    entry = self._load_cache()["services"].get(key, None)
+                if entry is not None and time.time() - entry["time"] < cache_ttl:
+                    return entry["value"], True
+
+            client = self.get_client(
+                token_or_account_password=token_or_account_password, email=email
+            )
+            if service_type == "kafka":
+                details = client.get_kafka_service_details(
+                    project_name=project_name,
+                    service_name=service_name,
+                    kafka_username=username,
+                )
+            else:
+                details = client.get_postgres_service_details(
+                    project_name=project_name,
+                    service_name=service_name,
+                    postgres_username=username,
+                )
+
+            if cache_ttl > 0:
+                self._update_cache("services", key, details)
+            return details, False
+
+    async def discover_service(
+        self,
+        service_type: str,
+        token_or_account_password: str,
+        email: Optional[str] = None,
+        project_name: Optional[str] = None,
+        service_name: Optional[str] = None,
+        username: Optional[str] = None,
+        refresh: bool = False,
+        cache_ttl: Optional[float] = None,
+    ) -> Tuple[Mapping[str, Any], bool]:
+        """Return the connection details of a 'kafka', or 'pg' service, without blocking the event loop.
+
+        Check 'get_service_details' for details.
+        """
+
+        func = partial(
+            self.get_service_details,
+            service_type=service_type,
+            token_or_account_password=token_or_account_password,
+            email=email,
+            project_name=project_name,
+            service_name=service_name,
+            username=username,
+            refresh=refresh,
+            cache_ttl=cache_ttl,
+        )
+        return await run_in_thread(func)
+
+    async def create_kafka_client(
+        self,
+        topic: str,
+        token_or_account_password: str,
+        email: Optional[str] = None,
+        project_name: Optional[str] = None,
+        service_name: Optional[str] = None,
+        group_id: Optional[str] = None,
+        enable_auto_commit: bool = True,
+        refresh: bool = False,
+        cache_ttl: Optional[float] = None,
+    ) -> Tuple[UpcheckKafkaClient, bool]:
+        """Discover a Kafka service, and create a client for it.
+
+        Check 'get_service_details' for details.
+
+        Returns:
+            Tuple[UpcheckKafkaClient, bool]: the client, and whether cached service details were used
+        """
+
+        details, cached = await self.discover_service(
+            "kafka",
+            token_or_account_password=token_or_account_password,
+            email=email,
+            project_name=project_name,
+            service_name=service_name,
+            refresh=refresh,
+            cache_ttl=cache_ttl,
+        )
+        cert_dir = self.get_cert_dir(
+            {
+                "ca.pem": details["ca_cert"],
+                "service.cert": details["access_cert"],
+                "service.key": details["access_key"],
+            }
+        )
+        client = UpcheckKafkaClient(
+            host=details["host"],
+            port=details["port"],
+            topic=topic,
+            group_id=group_id,
+            cafile=os.path.join(cert_dir, "ca.pem"),
+            certfile=os.path.join(cert_dir, "service.cert"),
+            keyfile=os.path.join(cert_dir, "service.key"),
+            enable_auto_commit=enable_auto_commit,
+        )
+        return client, cached
+
+    def get_cert_dir(self, files: Mapping[str, str]) -> str:
+        """Return a temporary directory that contains the provided (certificate) files.
+
+        A directory is only created once for the same files and contents.
+
+        Args:
+            files (Mapping[str, str]): the file names, and their contents
+
+        Returns:
+            str: the path to the directory
+        """
+
+        key = _hash(sorted(files.items()))
+        with self._lock:
+            cert_dir = self._cert_dirs.get(key, None)
+            if cert_dir is None:
+                cert_dir = create_temp_dir_with_text_files(files)
+                self._cert_dirs[key] = cert_dir
+            return cert_dir
+
+
+_service_discovery: Optional[AivenServiceDiscovery] = None
+_service_discovery_lock = threading.Lock()
+
+
+def get_service_discovery() -> AivenServiceDiscovery:
+    """Return the Aiven service discovery object that is shared by all sources and targets."""
+
+    global _service_discovery
+
+    with _service_discovery_lock:
+        if _service_discovery is None:
+            _service_discovery = AivenServiceDiscovery()
+        return _service_discovery
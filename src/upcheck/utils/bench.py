@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers to benchmark the check pipeline against local stand-in servers (check 'upcheck.utils.standins')."""
+
+import itertools
+import logging
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+from array import array
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+import anyio
+from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.sources.check import ActualCheckCheckSource
+from upcheck.targets import CheckTarget
+from upcheck.upcheck import Upcheck
+from upcheck.utils.columns import percentile
+from upcheck.utils.standins import StandInHttpServer
+
+
+log = logging.getLogger("upcheck")
+
+LATENCY_DISTRIBUTIONS: Sequence[str] = ("uniform", "exponential")
+"""How latencies of url checks can be spread above the minimum latency (check 'create_url_checks')."""
+
+
+def _summarize(values: Sequence[float], digits: int = 3) -> Dict[str, Optional[float]]:
+    """Return the mean, median, 95th/99th percentile and maximum of a sequence of values."""
+
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+
+    _sorted = sorted(values)
+    return {
+        "mean": round(sum(_sorted) / len(_sorted), digits),
+        "p50": round(percentile(_sorted, 50), digits),
+        "p95": round(percentile(_sorted, 95), digits),
+        "p99": round(percentile(_sorted, 99), digits),
+        "max": round(_sorted[-1], digits),
+    }
+
+
+def _max_rss_mb() -> float:
+    """Return the peak resident memory of this process, in megabytes."""
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS, kilobytes everywhere else
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+class LoopLagMonitor(object):
+    """Measures how late the event loop wakes up a task that sleeps for 'interval' seconds.
+
+    A loop that is blocked (e.g. by cpu-heavy code in a coroutine) delays all other tasks by that much, including the
+    timer of a running check.
+
+    Args:
+        interval (float): how long to sleep between measurements, in seconds
+    """
+
+    def __init__(self, interval: float = 0.01):
+
+        self._interval: float = interval
+        self._lags: array = array("d")
+        self._stopped: bool = False
+
+    @property
+    def lags(self) -> Sequence[float]:
+        """All measured lags, in milliseconds."""
+        return self._lags
+
+    async def run(self) -> None:
+
+        while not self._stopped:
+            before = time.perf_counter()
+            await anyio.sleep(self._interval)
+            self._lags.append((time.perf_counter() - before - self._interval) * 1000)
+
+    def stop(self) -> None:
+
+        self._stopped = True
+
+
+class BenchmarkTarget(CheckTarget):
+    """Target that counts check results, and compares their response times to the latency of the stand-in server.
+
+    Args:
+        expected_latencies (Mapping[UrlCheck, Optional[float]]): the latency of each url check, in milliseconds ('None' for hung urls)
+    """
+
+    def __init__(self, expected_latencies: Mapping[UrlCheck, Optional[float]]):
+
+        self._expected_latencies: Mapping[
+            UrlCheck, Optional[float]
+        ] = expected_latencies
+        self._timing_errors: array = array("d")
+        self._response_codes: Dict[int, int] = {}
+
+    def get_id(self) -> str:
+        return "benchmark"
+
+    @property
+    def timing_errors(self) -> Sequence[float]:
+        """The difference between measured response times and the latency of the stand-in server, in milliseconds."""
+        return self._timing_errors
+
+    @property
+    def response_codes(self) -> Mapping[int, int]:
+        return self._response_codes
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        for result in results:
+            expected = self._expected_latencies.get(result.url_check, None)
+            if expected is not None:
+                self._timing_errors.append(result.response_time - expected)
+            self._response_codes[result.response_code] = (
+                self._response_codes.get(result.response_code, 0) + 1
+            )
+
+
+def create_url_checks(
+    base_url: str,
+    urls: int = 10,
+    latency: float = 0,
+    latency_jitter: float = 0,
+    latency_distribution: str = "uniform",
+    slow_rate: float = 0,
+    slow_latency: float = 1000,
+    hang_rate: float = 0,
+    body_size: Optional[int] = None,
+    body_size_jitter: int = 0,
+    regex: Optional[str] = None,
+    seed: Optional[int] = None,
+) -> Dict[UrlCheck, Optional[float]]:
+    """Create url checks for a stand-in server, each with its own (fixed) latency and response size.
+
+    With the 'uniform' distribution, latencies are picked between 'latency' and 'latency + latency_jitter'. With the
+    'exponential' one, 'latency_jitter' is the mean of the additional latency, which gives a long tail, like the
+    response times of real websites. A share of 'slow_rate' urls get 'slow_latency' instead, and a share of 'hang_rate'
+    urls never get a response (their checks fail once the http client times out).
+
+    Latencies and sizes are passed to the server as query parameters (check 'StandInHttpServer').
+
+    Args:
+        base_url (str): the url of the stand-in server
+        urls (int): the number of url checks to create
+        latency (float): the minimum latency, in milliseconds
+        latency_jitter (float): the maximum (or mean, for the exponential distribution) additional latency, in milliseconds
+        latency_distribution (str): how additional latencies are spread, one of 'LATENCY_DISTRIBUTIONS'
+        slow_rate (float): the share of urls with 'slow_latency' (between 0 and 1)
+        slow_latency (float): the latency of slow urls, in milliseconds
+        hang_rate (float): the share of urls that never get a response (between 0 and 1)
+        body_size (Optional[int]): the minimum size of response bodies, in bytes (the server default if not set)
+        body_size_jitter (int): the maximum additional size of response bodies, in bytes
+        regex (Optional[str]): the regex to check response bodies with
+        seed (Optional[int]): the seed for the random number generator that picks latencies
+
+    Returns:
+        Dict[UrlCheck, Optional[float]]: the url checks, and their latencies (in milliseconds, 'None' for hung urls)
+    """
+
+    if latency_distribution not in LATENCY_DISTRIBUTIONS:
+        raise UpcheckException(
+            msg=f"Invalid latency distribution: {latency_distribution}",
+            solution=f"Use one of: {', '.join(LATENCY_DISTRIBUTIONS)}",
+        )
+    for name, rate in (("slow", slow_rate), ("hang", hang_rate)):
+        if rate < 0 or rate > 1:
+            raise UpcheckException(
+                msg=f"Invalid {name} rate: {rate}",
+                reason="Rates must be between 0 and 1.",
+            )
+
+    rand = random.Random(seed)
+    url_checks: Dict[UrlCheck, Optional[float]] = {}
+    for i in range(urls):
+        params: Dict[str, Any] = {}
+        _latency: Optional[float]
+        if hang_rate and rand.random() < hang_rate:
+            params["hang"] = 1
+            _latency = None
+        elif slow_rate and rand.random() < slow_rate:
+            _latency = slow_latency
+        elif latency_distribution == "exponential" and latency_jitter > 0:
+            _latency = latency + rand.expovariate(1 / latency_jitter)
+        else:
+            _latency = latency + rand.random() * latency_jitter
+        if _latency is not None:
+            _latency = round(_latency, 1)
+            params["latency"] = _latency
+        if body_size is not None or body_size_jitter:
+            _body_size = 1024 if body_size is None else body_size
+            params["size"] = _body_size + rand.randint(0, body_size_jitter)
+
+        url = f"{base_url.rstrip('/')}/{i}?{urlencode(params)}"
+        url_checks[UrlCheck(url=url, regex=regex)] = _latency
+    return url_checks
+
+
+async def run_check_benchmark(
+    url_checks: Mapping[UrlCheck, Optional[float]],
+    checks: int = 1000,
+    targets: Iterable[CheckTarget] = (),
+    lag_interval: float = 0.01,
+) -> Dict[str, Any]:
+    """Run checks through the check pipeline, and measure its performance.
+
+    The url checks are run round-robin by an 'ActualCheckCheckSource', until 'checks' checks are done. Results are
+    written to a 'BenchmarkTarget', and the provided targets.
+
+    Args:
+        url_checks (Mapping[UrlCheck, Optional[float]]): the url checks, and their expected latency (in milliseconds)
+        checks (int): the number of checks to run
+        targets (Iterable[CheckTarget]): additional targets to write results to
+        lag_interval (float): the interval of event loop lag measurements, in seconds
+
+    Returns:
+        Dict[str, Any]: the results: checks per second, cpu time per check, timing errors, event loop lag, and memory
+    """
+
+    benchmark_target = BenchmarkTarget(url_checks)
+    source = ActualCheckCheckSource(
+        *itertools.islice(itertools.cycle(url_checks.keys()), checks)
+    )
+    upcheck = Upcheck(source=source, targets=[benchmark_target, *targets])
+    monitor = LoopLagMonitor(interval=lag_interval)
+
+    await upcheck.connect()
+    rss_before = _max_rss_mb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    try:
+        async with anyio.create_task_group() as tg:
+            await tg.spawn(monitor.run)
+            await upcheck.start(wait_for_keypress=False)
+            monitor.stop()
+    finally:
+        duration = time.perf_counter() - started
+        cpu_time = time.process_time() - cpu_before
+        await upcheck.disconnect()
+
+    stats = upcheck.stats
+    return {
+        "checks": checks,
+        "urls": len(url_checks),
+        "duration": round(duration, 3),
+        "checks_per_second": round(checks / duration, 1),
+        "cpu_per_check_ms": round(cpu_time * 1000 / checks, 3),
+        "cpu_utilization": round(cpu_time / duration, 3),
+        "check_errors": stats.get("check_errors", 0),
+        "failed_writes": stats.get("failed", 0),
+        "response_codes": {
+            str(k): v for k, v in sorted(benchmark_target.response_codes.items())
+        },
+        "timing_error_ms": _summarize(benchmark_target.timing_errors),
+        "loop_lag_ms": _summarize(monitor.lags),
+        "max_rss_mb": round(_max_rss_mb(), 1),
+        "max_rss_growth_mb": round(_max_rss_mb() - rss_before, 1),
+    }
+
+
+def _serve(config: Mapping[str, Any], url_queue) -> None:
+
+    server = StandInHttpServer(**config)
+    server.start()
+    url_queue.put(server.url())
+    while True:
+        time.sleep(3600)
+
+
+def start_server_process(**config: Any) -> Tuple[multiprocessing.Process, str]:
+    """Start a stand-in server in a separate process, so it doesn't use the cpu time of the benchmarked process.
+
+    Args:
+        **config: the arguments for 'StandInHttpServer'
+
+    Returns:
+        Tuple[multiprocessing.Process, str]: the server process (terminate it when done), and the url of the server
+    """
+
+    context = multiprocessing.get_context("spawn")
+    url_queue = context.Queue()
+    process = context.Process(target=_serve, args=(config, url_queue), daemon=True)
+    process.start()
+    url = url_queue.get(timeout=30)
+    return process, url
+
+
+def environment_details() -> Dict[str, Any]:
+    """Return details about the environment a benchmark runs in, to be able to compare results."""
+
+    import upcheck
+
+    return {
+        "upcheck_version": upcheck.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
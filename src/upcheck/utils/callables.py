@@ -7,9 +7,9 @@ import logging
 import os
 import sys
 from threading import Thread
-from typing import Any, Callable, Dict, Mapping, Optional, Union
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional, Union
 
-from anyio import create_task_group, run_in_thread
+from anyio import create_task_group, fail_after, run_in_thread
 from rich.console import Console
 
 
@@ -52,6 +52,42 @@ async def wait_for_tasks(*tasks: Mapping[str, Any], cancel_task: Dict = None):
             await tg.spawn(run_tasks)
 
 
+async def run_concurrently(
+    calls: Mapping[Hashable, Callable[[], Awaitable[Any]]],
+    timeout: Optional[float] = None,
+) -> Dict[Hashable, Exception]:
+    """Run coroutine functions concurrently, and wait for all of them to finish.
+
+    Exceptions don't cancel the other calls, they are collected and returned instead. A call that takes longer than
+    'timeout' seconds is cancelled, and fails with a 'TimeoutError'.
+
+    Args:
+        calls: the coroutine functions to call (without arguments), with keys to identify them
+        timeout: the maximum time (in seconds) for each call, 'None' for no timeout
+
+    Returns:
+        Dict[Hashable, Exception]: the exceptions of all calls that failed, by key
+    """
+
+    failed: Dict[Hashable, Exception] = {}
+
+    async def run(key: Hashable, func: Callable[[], Awaitable[Any]]):
+
+        try:
+            async with fail_after(timeout):
+                await func()
+        except TimeoutError:
+            failed[key] = TimeoutError(f"Timed out after {timeout} seconds.")
+        except Exception as e:
+            failed[key] = e
+
+    async with create_task_group() as tg:
+        for key, func in calls.items():
+            await tg.spawn(run, key, func)
+
+    return failed
+
+
 async def wait_for_tasks_or_user_keypress(
     *tasks: Mapping[str, Any],
     stop_key=DEFAULT_STOP_KEY,
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from upcheck.models import CheckMetric, UrlCheck
+
+
+# values used to store the (optional) 'regex_matched' value in a byte array
+_REGEX_MATCHED_NONE = -1
+_REGEX_MATCHED_VALUES = {None: _REGEX_MATCHED_NONE, False: 0, True: 1}
+_REGEX_MATCHED_LOOKUP = {v: k for k, v in _REGEX_MATCHED_VALUES.items()}
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Compute a percentile of an already sorted sequence, interpolating linearly between the closest ranks.
+
+    Args:
+        sorted_values: the (sorted, non-empty) values
+        q: the percentile, between 0 and 100
+    """
+
+    if not sorted_values:
+        raise ValueError("Can't compute percentile of empty sequence.")
+    if q < 0 or q > 100:
+        raise ValueError(f"Invalid percentile '{q}', must be between 0 and 100.")
+
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = pos - lower
+    return (
+        sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+    )
+
+
+class ColumnarCheckMetrics(object):
+    """A compact, column-oriented store for check metrics.
+
+    Every attribute of a metric is stored in a typed array, the url check is dictionary-encoded (the 'check_ids'
+    column contains indexes into the 'checks' list). Metric objects are only created when iterating over, or indexing
+    into this object.
+
+    Args:
+        metrics (Iterable[CheckMetric]): optional metrics to add
+    """
+
+    def __init__(self, metrics: Optional[Iterable[CheckMetric]] = None):
+
+        self._checks: List[UrlCheck] = []
+        self._check_index: Dict[UrlCheck, int] = {}
+
+        self._check_ids: array = array("I")
+        self._check_times: array = array("q")
+        self._response_times: array = array("l")
+        self._response_codes: array = array("H")
+        self._regex_matched: array = array("b")
+
+        if metrics:
+            self.extend(metrics)
+
+    def append(self, metric: CheckMetric) -> None:
+
+        url_check = metric.url_check
+        check_id = self._check_index.get(url_check, None)
+        new_check = check_id is None
+        if check_id is None:
+            check_id = len(self._checks)
+            self._checks.append(url_check)
+            self._check_index[url_check] = check_id
+
+        size = len(self._check_ids)
+        try:
+            self._check_ids.append(check_id)
+            self._check_times.append(metric.check_time_micros)
+            self._response_times.append(metric.response_time)
+            self._response_codes.append(metric.response_code)
+            self._regex_matched.append(_REGEX_MATCHED_VALUES[metric.regex_matched])
+        except Exception:
+            # a value that doesn't fit its column (e.g. a response code above 65535) would leave the columns with
+            # different lengths, so the whole metric is removed again
+            for column in self._columns:
+                del column[size:]
+            if new_check:
+                self._checks.pop()
+                self._check_index.pop(url_check)
+            raise
+
+    @property
+    def _columns(self) -> List[array]:
+
+        return [
+            self._check_ids,
+            self._check_times,
+            self._response_times,
+            self._response_codes,
+            self._regex_matched,
+        ]
+
+    def extend(self, metrics: Iterable[CheckMetric]) -> None:
+
+        for metric in metrics:
+            self.append(metric)
+
+    @property
+    def checks(self) -> List[UrlCheck]:
+        """All distinct url checks, the values of the 'check_ids' column are indexes into this list."""
+        return self._checks
+
+    @property
+    def check_ids(self) -> array:
+        return self._check_ids
+
+    @property
+    def check_times(self) -> array:
+        """Check times, in microseconds since the epoch (UTC)."""
+        return self._check_times
+
+    @property
+    def response_times(self) -> array:
+        """Response times, in milliseconds."""
+        return self._response_times
+
+    @property
+    def response_codes(self) -> array:
+        return self._response_codes
+
+    def __len__(self) -> int:
+        return len(self._check_ids)
+
+    def __getitem__(self, index: int) -> CheckMetric:
+
+        return CheckMetric(
+            url_check=self._checks[self._check_ids[index]],
+            check_time=self._check_times[index],
+            response_time=self._response_times[index],
+            response_code=self._response_codes[index],
+            regex_matched=_REGEX_MATCHED_LOOKUP[self._regex_matched[index]],
+        )
+
+    def __iter__(self) -> Iterator[CheckMetric]:
+
+        for i in range(len(self)):
+            yield self[i]
+
+    def _group(self, column: array) -> Dict[UrlCheck, array]:
+        """Split up a column by url check."""
+
+        groups = [array(column.typecode) for _ in self._checks]
+        for check_id, value in zip(self._check_ids, column):
+            groups[check_id].append(value)
+
+        return {
+            self._checks[check_id]: values
+            for check_id, values in enumerate(groups)
+            if values
+        }
+
+    def counts(self) -> Dict[UrlCheck, int]:
+        """The number of metrics per url check."""
+
+        counts = [0] * len(self._checks)
+        for check_id in self._check_ids:
+            counts[check_id] += 1
+
+        return {self._checks[i]: c for i, c in enumerate(counts) if c}
+
+    def error_counts(self, min_response_code: int = 400) -> Dict[UrlCheck, int]:
+        """The number of metrics with a response code of 'min_response_code' or higher, per url check."""
+
+        counts = [0] * len(self._checks)
+        for check_id, code in zip(self._check_ids, self._response_codes):
+            if code >= min_response_code:
+                counts[check_id] += 1
+
+        return {self._checks[i]: c for i, c in enumerate(counts) if c}
+
+    def mean_response_times(self) -> Dict[UrlCheck, float]:
+        """The mean response time (in milliseconds) per url check."""
+
+        counts = [0] * len(self._checks)
+        sums = [0] * len(self._checks)
+        for check_id, response_time in zip(self._check_ids, self._response_times):
+            counts[check_id] += 1
+            sums[check_id] += response_time
+
+        return {self._checks[i]: sums[i] / c for i, c in enumerate(counts) if c}
+
+    def response_time_percentiles(
+        self, *percentiles: float
+    ) -> Dict[UrlCheck, Dict[float, float]]:
+        """Percentiles of the response times (in milliseconds) per url check.
+
+        Args:
+            *percentiles: the percentiles to compute (between 0 and 100), defaults to 50, 95 and 99
+        """
+
+        if not percentiles:
+            percentiles = (50, 95, 99)
+
+        result: Dict[UrlCheck, Dict[float, float]] = {}
+        for url_check, values in self._group(self._response_times).items():
+            sorted_values = sorted(values)
+            result[url_check] = {q: percentile(sorted_values, q) for q in percentiles}
+
+        return result
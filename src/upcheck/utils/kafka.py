@@ -1,21 +1,292 @@
 # -*- coding: utf-8 -*-
+import io
+import json
 import os
+from functools import lru_cache
 from ssl import SSLContext
-from typing import Callable, Optional
-
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+import avro.io
 import avro.schema
-from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
-from aiokafka.helpers import create_ssl_context
+from avro.io import DatumReader, DatumWriter
 from upcheck.defaults import DEFAULT_KAFKA_GROUP_ID, UPCHECK_RESOURCES_FOLDER
 from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, CheckSummary
+
+
+if TYPE_CHECKING:
+    from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
 
 
 CHECK_METRIC_SCHEMA_FILE = os.path.join(UPCHECK_RESOURCES_FOLDER, "check_metric.avsc")
-CHECK_METRIC_SCHEMA = avro.schema.parse(open(CHECK_METRIC_SCHEMA_FILE, "rb").read())
+CHECK_METRIC_LEGACY_SCHEMA_FILE = os.path.join(
+    UPCHECK_RESOURCES_FOLDER, "check_metric_legacy.avsc"
+)
+CHECK_SUMMARY_SCHEMA_FILE = os.path.join(UPCHECK_RESOURCES_FOLDER, "check_summary.avsc")
+
+SCHEMA_VERSION_HEADER = "upcheck_schema_version"
+"""Name of the Kafka record header that contains the version of the schema a message was encoded with."""
+SCHEMA_VERSION = b"2"
+"""Current schema version. Messages without a schema version header are decoded using the legacy schema."""
+SUMMARY_SCHEMA_VERSION = b"1"
+"""Current schema version for check summaries."""
+RESPONSE_CODE_HEADER = "upcheck_response_code"
+"""Name of the Kafka record header that contains the response code of a check metric (to be able to filter messages without decoding them)."""
+
+
+def _strip_logical_types(schema: Any) -> Any:
+    """Remove all 'logicalType' annotations from a (json) schema.
+
+    The binary encoding is not affected by this, but avro won't convert values to/from datetime objects, which
+    means we can use the integer timestamps we use internally directly.
+    """
+
+    if isinstance(schema, Mapping):
+        return {
+            k: _strip_logical_types(v) for k, v in schema.items() if k != "logicalType"
+        }
+    if isinstance(schema, list):
+        return [_strip_logical_types(v) for v in schema]
+    return schema
+
+
+def _load_schema_json(path: str) -> Any:
+
+    with open(path, "rb") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def _get_schemas() -> Dict[str, Any]:
+    """Parse all schemas, and create readers and writers for them.
+
+    This only happens on first use, to not slow down the import of this module.
+    """
+
+    check_metric_schema_json = _load_schema_json(CHECK_METRIC_SCHEMA_FILE)
+    check_metric_legacy_schema_json = _load_schema_json(CHECK_METRIC_LEGACY_SCHEMA_FILE)
+    check_summary_schema_json = _load_schema_json(CHECK_SUMMARY_SCHEMA_FILE)
+
+    check_metric_wire_schema = avro.schema.parse(
+        json.dumps(_strip_logical_types(check_metric_schema_json))
+    )
+    check_metric_legacy_schema = avro.schema.parse(
+        json.dumps(check_metric_legacy_schema_json)
+    )
+    check_summary_wire_schema = avro.schema.parse(
+        json.dumps(_strip_logical_types(check_summary_schema_json))
+    )
+
+    return {
+        "CHECK_METRIC_SCHEMA": avro.schema.parse(json.dumps(check_metric_schema_json)),
+        "CHECK_METRIC_WIRE_SCHEMA": check_metric_wire_schema,
+        "CHECK_METRIC_LEGACY_SCHEMA": check_metric_legacy_schema,
+        "CHECK_METRIC_WRITER": DatumWriter(check_metric_wire_schema),
+        "CHECK_METRIC_READER": DatumReader(check_metric_wire_schema),
+        "CHECK_METRIC_LEGACY_READER": DatumReader(check_metric_legacy_schema),
+        "CHECK_SUMMARY_WIRE_SCHEMA": check_summary_wire_schema,
+        "CHECK_SUMMARY_WRITER": DatumWriter(check_summary_wire_schema),
+        "CHECK_SUMMARY_READER": DatumReader(check_summary_wire_schema),
+    }
+
+
+def __getattr__(name: str) -> Any:
+    """Provide the (lazily created) schemas, readers and writers as module attributes, e.g. 'CHECK_METRIC_SCHEMA'."""
+
+    schemas = _get_schemas()
+    if name in schemas.keys():
+        return schemas[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def encode_check_metric(metric: CheckMetric) -> bytes:
+    """Encode a check metric, using the current (avro) schema."""
+
+    data = metric.report_data
+    if data["regex"] is None:
+        data.pop("regex")
+    if data["regex_matched"] is None:
+        data.pop("regex_matched")
+
+    bytes_writer = io.BytesIO()
+    encoder = avro.io.BinaryEncoder(bytes_writer)
+    _get_schemas()["CHECK_METRIC_WRITER"].write(data, encoder)
+
+    return bytes_writer.getvalue()
+
+
+def create_message_key(metric: CheckMetric) -> bytes:
+    """Create the Kafka record key for a check metric (the url of the check)."""
+
+    return metric.url_check.url.encode()
+
+
+def create_message_headers(metric: CheckMetric) -> List[Tuple[str, bytes]]:
+    """Create the Kafka record headers that need to be sent alongside an encoded check metric."""
+
+    return [
+        (SCHEMA_VERSION_HEADER, SCHEMA_VERSION),
+        (RESPONSE_CODE_HEADER, str(metric.response_code).encode()),
+    ]
+
+
+def get_message_header(
+    headers: Optional[Iterable[Tuple[str, bytes]]], name: str
+) -> Optional[bytes]:
+    """Return the value of a Kafka record header, or None if it does not exist."""
+
+    if headers:
+        for k, v in headers:
+            if k == name:
+                return v
+    return None
+
+
+def decode_check_metric(
+    value: bytes, headers: Optional[Iterable[Tuple[str, bytes]]] = None
+) -> CheckMetric:
+    """Decode a check metric.
+
+    Messages that don't have a schema version header were written by older versions of 'upcheck', and are
+    decoded using the legacy schema (which uses a string for the 'check_time' value).
+
+    Args:
+        value: the encoded message
+        headers: the Kafka record headers of the message
+
+    Returns:
+        CheckMetric: the decoded metric
+    """
+
+    schemas = _get_schemas()
+    reader = schemas["CHECK_METRIC_LEGACY_READER"]
+    version = get_message_header(headers, SCHEMA_VERSION_HEADER)
+    if version is not None:
+        if version != SCHEMA_VERSION:
+            raise UpcheckException(
+                msg="Can't decode check metric.",
+                reason=f"Unsupported schema version: {version!r}",
+            )
+        reader = schemas["CHECK_METRIC_READER"]
+
+    decoder = avro.io.BinaryDecoder(io.BytesIO(value))
+    data: Mapping[str, Any] = reader.read(decoder)
+    return CheckMetric.from_dict(data)
+
+
+def encode_check_summary(summary: CheckSummary) -> bytes:
+    """Encode a check summary, using the current (avro) schema."""
+
+    bytes_writer = io.BytesIO()
+    encoder = avro.io.BinaryEncoder(bytes_writer)
+    _get_schemas()["CHECK_SUMMARY_WRITER"].write(summary.report_data, encoder)
+
+    return bytes_writer.getvalue()
+
+
+def create_summary_message_headers(summary: CheckSummary) -> List[Tuple[str, bytes]]:
+    """Create the Kafka record headers that need to be sent alongside an encoded check summary."""
+
+    return [(SCHEMA_VERSION_HEADER, SUMMARY_SCHEMA_VERSION)]
+
+
+def decode_check_summary(
+    value: bytes, headers: Optional[Iterable[Tuple[str, bytes]]] = None
+) -> CheckSummary:
+    """Decode a check summary.
+
+    Args:
+        value: the encoded message
+        headers: the Kafka record headers of the message
+
+    Returns:
+        CheckSummary: the decoded summary
+    """
+
+    version = get_message_header(headers, SCHEMA_VERSION_HEADER)
+    if version is not None and version != SUMMARY_SCHEMA_VERSION:
+        raise UpcheckException(
+            msg="Can't decode check summary.",
+            reason=f"Unsupported schema version: {version!r}",
+        )
+
+    decoder = avro.io.BinaryDecoder(io.BytesIO(value))
+    data: Mapping[str, Any] = _get_schemas()["CHECK_SUMMARY_READER"].read(decoder)
+    return CheckSummary.from_dict(data)
+
+
+class EncodedCheckMetric(CheckMetric):
+    """A check metric consumed from Kafka, which keeps the original record value, key and headers.
+
+    The value is decoded (and so validated) when the object is created, but a Kafka target can forward the original
+    message without having to re-encode it.
+
+    Args:
+        value (bytes): the encoded metric
+        key (Optional[bytes]): the record key
+        headers (Iterable[Tuple[str, bytes]]): the record headers
+    """
+
+    __slots__ = ("_value", "_key", "_headers")
+
+    def __init__(
+        self,
+        value: bytes,
+        key: Optional[bytes] = None,
+        headers: Optional[Iterable[Tuple[str, bytes]]] = None,
+    ):
+
+        self._value: bytes = value
+        self._key: Optional[bytes] = key
+        self._headers: List[Tuple[str, bytes]] = list(headers) if headers else []
+
+        metric = decode_check_metric(value, self._headers)
+        super().__init__(
+            url_check=metric.url_check,
+            check_time=metric.check_time_micros,
+            response_time=metric.response_time,
+            response_code=metric.response_code,
+            regex_matched=metric.regex_matched,
+        )
+
+    @property
+    def value(self) -> bytes:
+        return self._value
+
+    @property
+    def key(self) -> Optional[bytes]:
+        return self._key
+
+    @property
+    def headers(self) -> List[Tuple[str, bytes]]:
+        return self._headers
+
+    @property
+    def schema_version(self) -> Optional[bytes]:
+        """The version of the schema the value was encoded with, or None for messages using the legacy schema."""
+        return get_message_header(self._headers, SCHEMA_VERSION_HEADER)
+
+
+broker_factory: Optional[Callable[[str, int], Any]] = None
+"""If set, Kafka clients use producers and consumers of the broker this returns (for their host and port) instead of connecting to Kafka (for tests and benchmarks, e.g. a 'FakeKafkaBroker')."""
 
 
 class UpcheckKafkaClient(object):
-    """Wrapper class for Kafka client functionality, used in both Kafka source and target."""
+    """Wrapper class for Kafka client functionality, used in both Kafka source and target.
+
+    If 'broker_factory' is set, producers and consumers of the broker it returns are used instead of connecting to
+    Kafka.
+    """
 
     def __init__(
         self,
@@ -26,6 +297,7 @@ class UpcheckKafkaClient(object):
         cafile: Optional[str] = None,
         certfile: Optional[str] = None,
         keyfile: Optional[str] = None,
+        enable_auto_commit: bool = True,
     ):
 
         self._host = host
@@ -41,9 +313,11 @@ class UpcheckKafkaClient(object):
         self._certfile: Optional[str] = certfile
         self._keyfile: Optional[str] = keyfile
 
+        self._enable_auto_commit: bool = enable_auto_commit
+
         self._ssl_context: Optional[SSLContext] = None
-        self._producer: Optional[AIOKafkaProducer] = None
-        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._producer: Optional["AIOKafkaProducer"] = None
+        self._consumer: Optional["AIOKafkaConsumer"] = None
 
     @property
     def host(self) -> str:
@@ -62,6 +336,8 @@ class UpcheckKafkaClient(object):
         if self._ssl_context is None and (
             self._cafile or self._certfile or self._keyfile
         ):
+            from aiokafka.helpers import create_ssl_context
+
             try:
                 self._ssl_context = create_ssl_context(
                     cafile=self._cafile, certfile=self._certfile, keyfile=self._keyfile
@@ -85,6 +361,14 @@ class UpcheckKafkaClient(object):
                 "Can't connect to producer.", reason="Producer already exists."
             )
 
+        if broker_factory is not None:
+            broker = broker_factory(self._host, self._port)
+            self._producer = broker.create_producer()
+            await self._producer.start()
+            return
+
+        from aiokafka import AIOKafkaProducer
+
         self._producer = AIOKafkaProducer(
             bootstrap_servers=f"{self._host}:{self._port}",
             security_protocol=self._security_protocol,
@@ -109,10 +393,23 @@ class UpcheckKafkaClient(object):
             raise UpcheckException(
                 "Can't connect to producer.", reason="Producer already exists."
             )
+        if broker_factory is not None:
+            broker = broker_factory(self._host, self._port)
+            self._consumer = broker.create_consumer(
+                self._topic,
+                group_id=self._group_id,
+                enable_auto_commit=self._enable_auto_commit,
+            )
+            await self._consumer.start()
+            return
+
+        from aiokafka import AIOKafkaConsumer
+
         self._consumer = AIOKafkaConsumer(
             self._topic,
             bootstrap_servers=f"{self._host}:{self._port}",
             group_id=self._group_id,
+            enable_auto_commit=self._enable_auto_commit,
             security_protocol=self._security_protocol,
             ssl_context=self._get_ssl_context(),
         )
@@ -123,7 +420,7 @@ class UpcheckKafkaClient(object):
         if self._consumer is not None:
             await self._consumer.stop()
 
-    async def get_consumer(self) -> AIOKafkaConsumer:
+    async def get_consumer(self) -> "AIOKafkaConsumer":
 
         if self._consumer is None:
             await self.connect_consumer()
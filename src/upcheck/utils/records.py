@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers to read and write check metrics as length-prefixed, checksummed records (as used by spools and segment
+files)."""
+
+import logging
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+from upcheck.models import CheckMetric
+from upcheck.utils.kafka import (
+    SCHEMA_VERSION,
+    SCHEMA_VERSION_HEADER,
+    decode_check_metric,
+    encode_check_metric,
+)
+
+
+log = logging.getLogger("upcheck")
+
+SEGMENT_HEADER = b"UPSEG" + SCHEMA_VERSION
+"""Every segment file starts with this, the version is the one of the schema the metrics are encoded with."""
+
+# each record is prefixed with the length and crc32 checksum of the encoded metric
+RECORD_HEADER = struct.Struct("<II")
+
+_DECODE_HEADERS = [(SCHEMA_VERSION_HEADER, SCHEMA_VERSION)]
+
+
+def encode_record(metric: CheckMetric) -> bytes:
+    """Encode a check metric as record."""
+
+    value = encode_check_metric(metric)
+    return RECORD_HEADER.pack(len(value), zlib.crc32(value)) + value
+
+
+def read_records(
+    buffer, offset: int = 0, max_records: Optional[int] = None
+) -> Tuple[List[CheckMetric], int, bool]:
+    """Read records from a buffer (e.g. a 'bytes' or 'mmap' object).
+
+    Reading stops at the end of the buffer, after 'max_records' records, or at the first incomplete or corrupted
+    record (e.g. one that was only written partially because of a crash).
+
+    Args:
+        buffer: the buffer
+        offset: the position of the first record in the buffer
+        max_records: the maximum number of records to read
+
+    Returns:
+        Tuple[List[CheckMetric], int, bool]: the metrics, the offset after the last record that was read, and whether the buffer is corrupted at that offset
+    """
+
+    metrics: List[CheckMetric] = []
+    size = len(buffer)
+
+    while offset < size and (max_records is None or len(metrics) < max_records):
+
+        if offset + RECORD_HEADER.size > size:
+            return metrics, offset, True
+        length, crc = RECORD_HEADER.unpack_from(buffer, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        value = buffer[start:end]
+        if len(value) < length or zlib.crc32(value) != crc:
+            return metrics, offset, True
+
+        try:
+            metrics.append(decode_check_metric(value, _DECODE_HEADERS))
+        except Exception as e:
+            log.warning(f"Can't decode record: {e}")
+        offset = end
+
+    return metrics, offset, False
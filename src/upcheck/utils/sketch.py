@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+from typing import Optional
+
+
+DEFAULT_RELATIVE_ACCURACY = 0.02
+"""The default maximum relative error of percentiles computed from a sketch."""
+MAX_TRACKED_VALUE = 3600000
+"""Values above this (one hour, in milliseconds) are put in the last bucket of a sketch."""
+
+
+class LatencySketch(object):
+    """A mergeable, fixed-size sketch of response times, used to compute approximate percentiles.
+
+    Values are counted in logarithmically sized buckets, which means percentiles are accurate up to a relative error
+    of 'relative_accuracy', independent of the number and distribution of values (the same approach as DDSketch or
+    HDR histograms). The memory used by a sketch only depends on the relative accuracy.
+
+    Sketches can only be merged with sketches that were created with the same relative accuracy.
+
+    Args:
+        relative_accuracy (float): the maximum relative error of computed percentiles (between 0 and 1)
+    """
+
+    __slots__ = (
+        "_relative_accuracy",
+        "_gamma",
+        "_log_gamma",
+        "_buckets",
+        "_count",
+        "_sum",
+        "_min",
+        "_max",
+    )
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+
+        if relative_accuracy <= 0 or relative_accuracy >= 1:
+            raise ValueError(
+                f"Invalid relative accuracy '{relative_accuracy}', must be between 0 and 1."
+            )
+
+        self._relative_accuracy: float = relative_accuracy
+        self._gamma: float = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma: float = math.log(self._gamma)
+
+        # bucket 0 holds values smaller than 1, bucket i holds values in (gamma^(i-2), gamma^(i-1)]
+        size = int(math.ceil(math.log(MAX_TRACKED_VALUE) / self._log_gamma)) + 2
+        self._buckets: array = array("I", bytes(4 * size))
+
+        self._count: int = 0
+        self._sum: int = 0
+        self._min: Optional[int] = None
+        self._max: Optional[int] = None
+
+    @property
+    def relative_accuracy(self) -> float:
+        return self._relative_accuracy
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> int:
+        return self._sum
+
+    @property
+    def min(self) -> Optional[int]:
+        return self._min
+
+    @property
+    def max(self) -> Optional[int]:
+        return self._max
+
+    @property
+    def mean(self) -> Optional[float]:
+
+        if not self._count:
+            return None
+        return self._sum / self._count
+
+    def _bucket_index(self, value: int) -> int:
+
+        if value < 1:
+            return 0
+        index = int(math.ceil(math.log(value) / self._log_gamma)) + 1
+        return min(index, len(self._buckets) - 1)
+
+    def _bucket_value(self, index: int) -> float:
+
+        if index == 0:
+            return 0.0
+        # the value with the smallest relative distance to both ends of the bucket
+        return 2 * self._gamma ** (index - 1) / (self._gamma + 1)
+
+    def add(self, value: int) -> None:
+        """Add a value to this sketch."""
+
+        self._buckets[self._bucket_index(value)] += 1
+        self._count += 1
+        self._sum += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def merge(self, other: "LatencySketch") -> None:
+        """Add all values of another sketch to this one."""
+
+        if other._relative_accuracy != self._relative_accuracy:
+            raise ValueError(
+                "Can't merge sketches, relative accuracy differs: "
+                f"{self._relative_accuracy} != {other._relative_accuracy}"
+            )
+
+        if not other._count:
+            return
+
+        buckets = self._buckets
+        for index, count in enumerate(other._buckets):
+            if count:
+                buckets[index] += count
+
+        self._count += other._count
+        self._sum += other._sum
+        if self._min is None or other._min < self._min:  # type: ignore
+            self._min = other._min
+        if self._max is None or other._max > self._max:  # type: ignore
+            self._max = other._max
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the (approximate) percentile 'q' (between 0 and 100) of the values in this sketch.
+
+        Returns 'None' if the sketch is empty.
+        """
+
+        if q < 0 or q > 100:
+            raise ValueError(f"Invalid percentile '{q}', must be between 0 and 100.")
+
+        if not self._count:
+            return None
+        if q == 0:
+            return float(self._min)  # type: ignore
+        if q == 100:
+            return float(self._max)  # type: ignore
+
+        rank = q / 100.0 * (self._count - 1)
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen > rank:
+                value = self._bucket_value(index)
+                # the exact extremes are known, so never report anything outside of them
+                return min(max(value, self._min), self._max)  # type: ignore
+
+        return float(self._max)  # type: ignore
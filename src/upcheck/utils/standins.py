@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+
+"""Local stand-ins for the services 'upcheck' talks to, to run tests and benchmarks offline, and repeatably."""
+
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import anyio
+from upcheck.exceptions import UpcheckException
+
+
+log = logging.getLogger("upcheck")
+
+_INSERT_REGEX = re.compile(r"\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+
+
+class _StandInRequestHandler(BaseHTTPRequestHandler):
+
+    server: "_StandInServer"
+
+    # keep-alive, like most real websites
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+
+        config: StandInHttpServer = self.server.config
+        params = parse_qs(urlsplit(self.path).query)
+
+        def param(name: str, default):
+            values = params.get(name, None)
+            return type(default)(values[0]) if values else default
+
+        latency = param("latency", float(config.latency))
+        size = param("size", config.body_size)
+        status = config._register_request(param("status", 0))
+
+        if param("hang", 0):
+            # never respond, the client has to give up (or the server is stopped)
+            config._stopped.wait(config.hang_time)
+            self.close_connection = True
+            return
+
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        body = config.get_body(size)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StandInServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    config: "StandInHttpServer"
+
+
+class StandInHttpServer(object):
+    """A local HTTP server that stands in for the websites to check.
+
+    Every response is delayed by 'latency' milliseconds, has a body of 'body_size' bytes, and has the status
+    'error_status' with a probability of 'error_rate' (otherwise '200'). Requests can override those with the query
+    parameters 'latency', 'size' and 'status' (check 'url'), which makes it possible to know the expected response
+    time of every check. Requests with the query parameter 'hang=1' never get a response: the connection is held
+    open for 'hang_time' seconds (or until the server is stopped), and then closed.
+
+    Requests are served from background threads, one per connection.
+
+    Args:
+        host (str): the interface to listen on
+        port (int): the port to listen on ('0' picks a free port)
+        latency (float): the default delay of every response, in milliseconds
+        body_size (int): the default size of response bodies, in bytes
+        error_rate (float): the probability of a response to have the 'error_status' (between 0 and 1)
+        error_status (int): the status of failed responses
+        seed (int): the seed for the random number generator that picks failed responses
+        hang_time (float): how long to hold connections of hung requests open, in seconds
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        body_size: int = 1024,
+        error_rate: float = 0,
+        error_status: int = 500,
+        seed: Optional[int] = None,
+        hang_time: float = 300,
+    ):
+
+        if error_rate < 0 or error_rate > 1:
+            raise ValueError(
+                f"Invalid error rate '{error_rate}', must be between 0 and 1."
+            )
+
+        self._host: str = host
+        self._port: int = port
+        self._latency: float = latency
+        self._body_size: int = body_size
+        self._error_rate: float = error_rate
+        self._error_status: int = error_status
+        self._random: random.Random = random.Random(seed)
+        self._hang_time: float = hang_time
+
+        self._lock: threading.Lock = threading.Lock()
+        self._stopped: threading.Event = threading.Event()
+        self._requests: int = 0
+        self._body: bytes = b""
+
+        self._server: Optional[_StandInServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on (the actual one, once started)."""
+
+        if self._server is not None:
+            return self._server.server_address[1]
+        return self._port
+
+    @property
+    def latency(self) -> float:
+        return self._latency
+
+    @property
+    def body_size(self) -> int:
+        return self._body_size
+
+    @property
+    def hang_time(self) -> float:
+        return self._hang_time
+
+    @property
+    def requests(self) -> int:
+        """The number of requests that were served."""
+        return self._requests
+
+    def _register_request(self, status: int) -> int:
+        """Count a request, and return the status of its response (picked randomly, if 'status' is not set)."""
+
+        with self._lock:
+            self._requests += 1
+            if status:
+                return status
+            if self._error_rate and self._random.random() < self._error_rate:
+                return self._error_status
+            return 200
+
+    def get_body(self, size: int) -> bytes:
+        """Return a (html) response body of the requested size."""
+
+        if len(self._body) < size:
+            with self._lock:
+                chunk = b"<p>upcheck stand-in</p>\n"
+                self._body = chunk * (size // len(chunk) + 1)
+        return self._body[:size]
+
+    def url(self, path: str = "/", **params: Any) -> str:
+        """Return the url for a path on this server, with optional query parameters ('latency', 'size', 'status', 'hang')."""
+
+        url = f"http://{self._host}:{self.port}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        return url
+
+    def start(self) -> None:
+
+        if self._server is not None:
+            return
+
+        self._stopped.clear()
+        try:
+            self._server = _StandInServer(
+                (self._host, self._port), _StandInRequestHandler
+            )
+        except Exception as e:
+            raise UpcheckException(
+                msg=f"Can't start stand-in server on {self._host}:{self._port}.",
+                reason=str(e),
+            )
+        self._server.config = self
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="upcheck-standin", daemon=True
+        )
+        self._thread.start()
+        log.debug(f"Stand-in server listening on: {self.url()}")
+
+    def stop(self) -> None:
+
+        if self._server is None:
+            return
+
+        server = self._server
+        self._server = None
+        # releases hung requests
+        self._stopped.set()
+        server.shutdown()
+        server.server_close()
+        self._thread = None
+
+    def __enter__(self) -> "StandInHttpServer":
+
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self.stop()
+
+
+class StandInError(Exception):
+    """Raised by stand-ins for injected failures."""
+
+
+class _FailureInjector(object):
+    """Base class for stand-ins that delay operations, and make them fail randomly."""
+
+    def __init__(
+        self, latency: float = 0, failure_rate: float = 0, seed: Optional[int] = None
+    ):
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random: random.Random = random.Random(seed)
+        self._failures: int = 0
+
+    @property
+    def latency(self) -> float:
+        """The delay of every operation, in milliseconds."""
+        return self._latency
+
+    @latency.setter
+    def latency(self, latency: float) -> None:
+        self._latency = latency
+
+    @property
+    def failure_rate(self) -> float:
+        """The probability of an operation to fail (between 0 and 1), can be changed at any time."""
+        return self._failure_rate
+
+    @failure_rate.setter
+    def failure_rate(self, failure_rate: float) -> None:
+
+        if failure_rate < 0 or failure_rate > 1:
+            raise ValueError(
+                f"Invalid failure rate '{failure_rate}', must be between 0 and 1."
+            )
+        self._failure_rate = failure_rate
+
+    @property
+    def failures(self) -> int:
+        """The number of injected failures."""
+        return self._failures
+
+    async def _operation(self, name: str) -> None:
+        """Delay an operation, and fail it with a probability of 'failure_rate'."""
+
+        if self._latency > 0:
+            await anyio.sleep(self._latency / 1000)
+        if self._failure_rate and self._random.random() < self._failure_rate:
+            self._failures += 1
+            raise StandInError(f"Injected failure: {name}")
+
+
+class FakeKafkaRecord(object):
+    """A message stored by a 'FakeKafkaBroker', with the attributes of the records returned by aiokafka consumers."""
+
+    __slots__ = ("topic", "partition", "offset", "key", "value", "headers", "timestamp")
+
+    def __init__(
+        self,
+        topic: str,
+        partition: int,
+        offset: int,
+        key: Optional[bytes],
+        value: bytes,
+        headers: Sequence[Tuple[str, bytes]],
+    ):
+
+        self.topic: str = topic
+        self.partition: int = partition
+        self.offset: int = offset
+        self.key: Optional[bytes] = key
+        self.value: bytes = value
+        self.headers: Sequence[Tuple[str, bytes]] = headers
+        self.timestamp: int = int(time.time() * 1000)
+
+
+class FakeKafkaBroker(_FailureInjector):
+    """An in-process stand-in for a Kafka cluster, to be used instead of a real one by 'UpcheckKafkaClient'.
+
+    Messages are kept in memory, per topic and partition. Producers and consumers created by the broker implement
+    the parts of the aiokafka API that 'upcheck' uses. Every operation (sending a message, fetching records, and
+    committing offsets) is delayed by 'latency' milliseconds, and fails with a probability of 'failure_rate'.
+
+    Consumers start at the committed offset of their group, or at the first message if there is none.
+
+    Args:
+        partitions (int): the number of partitions of every topic
+        latency (float): the delay of every operation, in milliseconds
+        failure_rate (float): the probability of an operation to fail (between 0 and 1)
+        seed (int): the seed for the random number generator that picks failing operations
+    """
+
+    def __init__(
+        self,
+        partitions: int = 1,
+        latency: float = 0,
+        failure_rate: float = 0,
+        seed: Optional[int] = None,
+    ):
+
+        super().__init__(latency=latency, failure_rate=failure_rate, seed=seed)
+        self._partitions: int = partitions
+        self._logs: Dict[Tuple[str, int], List[FakeKafkaRecord]] = {}
+        self._committed: Dict[Tuple[str, str, int], int] = {}
+
+    @property
+    def partitions(self) -> int:
+        return self._partitions
+
+    def messages(self, topic: str, partition: int = 0) -> List[FakeKafkaRecord]:
+        """Return all messages of a topic partition."""
+
+        return self._logs.setdefault((topic, partition), [])
+
+    def append(
+        self,
+        topic: str,
+        value: bytes,
+        key: Optional[bytes] = None,
+        partition: int = 0,
+        headers: Optional[Sequence[Tuple[str, bytes]]] = None,
+    ) -> FakeKafkaRecord:
+        """Append a message to a topic partition (without delay or failure)."""
+
+        if partition < 0 or partition >= self._partitions:
+            raise StandInError(f"Invalid partition: {partition}")
+
+        messages = self.messages(topic, partition)
+        record = FakeKafkaRecord(
+            topic=topic,
+            partition=partition,
+            offset=len(messages),
+            key=key,
+            value=value,
+            headers=list(headers or []),
+        )
+        messages.append(record)
+        return record
+
+    def committed(self, group_id: str, topic: str, partition: int = 0) -> Optional[int]:
+        """Return the committed offset of a consumer group."""
+
+        return self._committed.get((group_id, topic, partition), None)
+
+    def commit(self, group_id: str, topic: str, partition: int, offset: int) -> None:
+
+        self._committed[(group_id, topic, partition)] = offset
+
+    def create_producer(self) -> "FakeKafkaProducer":
+
+        return FakeKafkaProducer(self)
+
+    def create_consumer(
+        self, topic: str, group_id: str, enable_auto_commit: bool = True
+    ) -> "FakeKafkaConsumer":
+
+        return FakeKafkaConsumer(
+            self, topic=topic, group_id=group_id, enable_auto_commit=enable_auto_commit
+        )
+
+
+class FakeKafkaProducer(object):
+    """A producer for a 'FakeKafkaBroker' (check 'aiokafka.AIOKafkaProducer')."""
+
+    def __init__(self, broker: FakeKafkaBroker):
+
+        self._broker: FakeKafkaBroker = broker
+        self._started: bool = False
+
+    async def start(self) -> None:
+
+        await self._broker._operation("start producer")
+        self._started = True
+
+    async def stop(self) -> None:
+
+        self._started = False
+
+    async def send_and_wait(
+        self,
+        topic: str,
+        value: bytes,
+        key: Optional[bytes] = None,
+        partition: Optional[int] = None,
+        headers: Optional[Sequence[Tuple[str, bytes]]] = None,
+    ) -> FakeKafkaRecord:
+
+        if not self._started:
+            raise StandInError("Producer not started.")
+        await self._broker._operation("send")
+        return self._broker.append(
+            topic, value, key=key, partition=partition or 0, headers=headers
+        )
+
+
+class FakeKafkaConsumer(object):
+    """A consumer for a 'FakeKafkaBroker' (check 'aiokafka.AIOKafkaConsumer').
+
+    The consumer is assigned all partitions of its topic.
+    """
+
+    def __init__(
+        self,
+        broker: FakeKafkaBroker,
+        topic: str,
+        group_id: str,
+        enable_auto_commit: bool = True,
+    ):
+
+        from aiokafka import TopicPartition
+
+        self._broker: FakeKafkaBroker = broker
+        self._topic: str = topic
+        self._group_id: str = group_id
+        self._enable_auto_commit: bool = enable_auto_commit
+
+        self._assignment: Set[Any] = {
+            TopicPartition(topic, p) for p in range(broker.partitions)
+        }
+        self._positions: Dict[Any, int] = {}
+        self._paused: Set[Any] = set()
+        self._started: bool = False
+
+    async def start(self) -> None:
+
+        await self._broker._operation("start consumer")
+        for tp in self._assignment:
+            committed = self._broker.committed(self._group_id, tp.topic, tp.partition)
+            self._positions[tp] = committed or 0
+        self._started = True
+
+    async def stop(self) -> None:
+
+        self._started = False
+
+    def assignment(self) -> Set[Any]:
+        return set(self._assignment)
+
+    def pause(self, *partitions) -> None:
+        self._paused.update(partitions)
+
+    def resume(self, *partitions) -> None:
+        self._paused.difference_update(partitions)
+
+    def paused(self) -> Set[Any]:
+        return set(self._paused)
+
+    def seek(self, partition, offset: int) -> None:
+        self._positions[partition] = offset
+
+    def position(self, partition) -> int:
+        return self._positions[partition]
+
+    def _fetch(self, max_records: Optional[int]) -> Dict[Any, List[FakeKafkaRecord]]:
+
+        result: Dict[Any, List[FakeKafkaRecord]] = {}
+        for tp in sorted(self._assignment - self._paused):
+            if max_records is not None and max_records <= 0:
+                break
+            position = self._positions[tp]
+            messages = self._broker.messages(tp.topic, tp.partition)
+            end = len(messages)
+            if max_records is not None:
+                end = min(end, position + max_records)
+                max_records -= end - position
+            if end > position:
+                result[tp] = messages[position:end]
+                self._positions[tp] = end
+        return result
+
+    async def getmany(
+        self, timeout_ms: int = 0, max_records: Optional[int] = None
+    ) -> Dict[Any, List[FakeKafkaRecord]]:
+
+        if not self._started:
+            raise StandInError("Consumer not started.")
+        await self._broker._operation("fetch")
+
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            records = self._fetch(max_records)
+            if records or time.monotonic() >= deadline:
+                break
+            await anyio.sleep(min(0.01, max(0.0, deadline - time.monotonic())))
+
+        if records and self._enable_auto_commit:
+            for tp in records.keys():
+                self._broker.commit(
+                    self._group_id, tp.topic, tp.partition, self._positions[tp]
+                )
+        return records
+
+    async def commit(self, offsets: Mapping[Any, int]) -> None:
+
+        await self._broker._operation("commit")
+        for tp, offset in offsets.items():
+            self._broker.commit(self._group_id, tp.topic, tp.partition, offset)
+
+    def __aiter__(self) -> "FakeKafkaConsumer":
+        return self
+
+    async def __anext__(self) -> FakeKafkaRecord:
+
+        while True:
+            records = await self.getmany(timeout_ms=1000, max_records=1)
+            for messages in records.values():
+                return messages[0]
+
+
+class FakePostgresCursor(object):
+    """A cursor of a 'FakePostgresConnection' (check 'aiopg.Cursor')."""
+
+    def __init__(self, connection: "FakePostgresConnection"):
+
+        self._connection: FakePostgresConnection = connection
+
+    async def __aenter__(self) -> "FakePostgresCursor":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def execute(self, query: str, args: Optional[Sequence[Any]] = None) -> None:
+
+        await self._connection.execute(query, args)
+
+
+class FakePostgresConnection(object):
+    """A connection to a 'FakePostgresDatabase' (check 'aiopg.Connection').
+
+    Like an aiopg connection, it can only execute one query at a time: executing a query while another one is in
+    progress fails.
+    """
+
+    def __init__(self, database: "FakePostgresDatabase", **config: Any):
+
+        self._database: FakePostgresDatabase = database
+        self._config: Mapping[str, Any] = config
+        self._closed: bool = False
+        self._executing: bool = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def cursor(self) -> FakePostgresCursor:
+
+        return FakePostgresCursor(self)
+
+    async def execute(self, query: str, args: Optional[Sequence[Any]] = None) -> None:
+
+        if self._closed:
+            raise StandInError("Connection closed.")
+        if self._executing:
+            raise StandInError(
+                "Can't execute a query while another one is in progress on the same connection."
+            )
+
+        self._executing = True
+        try:
+            await self._database._operation("execute")
+            self._database.record(query, args)
+        finally:
+            self._executing = False
+
+    async def close(self) -> None:
+
+        self._closed = True
+
+
+class FakePostgresDatabase(_FailureInjector):
+    """An in-process stand-in for a Postgres database, to be used instead of a real one by 'PostgresTarget'.
+
+    Queries are not executed, but recorded: the arguments of inserts are kept per table (check 'rows'), all other
+    queries in 'queries'. Every operation (connecting, and executing a query) is delayed by 'latency' milliseconds,
+    and fails with a probability of 'failure_rate'.
+
+    Args:
+        latency (float): the delay of every operation, in milliseconds
+        failure_rate (float): the probability of an operation to fail (between 0 and 1)
+        seed (int): the seed for the random number generator that picks failing operations
+    """
+
+    def __init__(
+        self, latency: float = 0, failure_rate: float = 0, seed: Optional[int] = None
+    ):
+
+        super().__init__(latency=latency, failure_rate=failure_rate, seed=seed)
+        self._rows: Dict[str, List[Sequence[Any]]] = {}
+        self._queries: List[Tuple[str, Optional[Sequence[Any]]]] = []
+        self._connections: int = 0
+
+    @property
+    def connections(self) -> int:
+        """The number of connections that were opened."""
+        return self._connections
+
+    @property
+    def queries(self) -> List[Tuple[str, Optional[Sequence[Any]]]]:
+        """All queries that were executed, except inserts."""
+        return self._queries
+
+    def rows(self, table: str) -> List[Sequence[Any]]:
+        """Return the arguments of all inserts into a table."""
+
+        return self._rows.setdefault(table, [])
+
+    def record(self, query: str, args: Optional[Sequence[Any]]) -> None:
+
+        match = _INSERT_REGEX.match(query)
+        if match is None:
+            self._queries.append((query, args))
+        else:
+            self.rows(match.group(1)).append(tuple(args or ()))
+
+    async def connect(self, **config: Any) -> FakePostgresConnection:
+        """Open a connection (takes the arguments of 'aiopg.connect', which are ignored)."""
+
+        await self._operation("connect")
+        self._connections += 1
+        return FakePostgresConnection(self, **config)
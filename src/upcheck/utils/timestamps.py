@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers to convert between the internal timestamp representation (integer microseconds since the epoch, UTC) and
+other formats."""
+
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def now_micros() -> int:
+    """Return the current time as microseconds since the epoch (UTC)."""
+
+    return time.time_ns() // 1000
+
+
+def datetime_to_micros(value: datetime) -> int:
+    """Convert a datetime object to microseconds since the epoch.
+
+    Naive datetime objects are interpreted as local time.
+    """
+
+    if value.tzinfo is None:
+        value = value.astimezone()
+
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def micros_to_datetime(value: int) -> datetime:
+    """Convert microseconds since the epoch to a (timezone-aware, UTC) datetime object."""
+
+    return EPOCH + timedelta(microseconds=value)
+
+
+def to_micros(value: Union[int, datetime, str]) -> int:
+    """Convert a timestamp to microseconds since the epoch.
+
+    Accepts integers (returned as is), datetime objects, and strings in the format created by 'str(datetime)'
+    (as used by the original wire format for check metrics).
+    """
+
+    if isinstance(value, bool):
+        raise TypeError(f"Invalid type for timestamp: {type(value)}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        return datetime_to_micros(value)
+    if isinstance(value, str):
+        return datetime_to_micros(datetime.fromisoformat(value))
+
+    raise TypeError(f"Invalid type for timestamp: {type(value)}")
@@ -12,6 +12,25 @@ import uuid
 
 import pytest
 from upcheck.utils.aiven import UpcheckAivenClient
+from upcheck.utils.standins import FakeKafkaBroker, FakePostgresDatabase
+
+
+@pytest.fixture
+def kafka_standin(monkeypatch):
+    """An in-process Kafka broker, used by all Kafka sources and targets instead of connecting to Kafka."""
+
+    broker = FakeKafkaBroker()
+    monkeypatch.setattr("upcheck.utils.kafka.broker_factory", lambda host, port: broker)
+    return broker
+
+
+@pytest.fixture
+def postgres_standin(monkeypatch):
+    """An in-process Postgres database, used by all Postgres targets instead of connecting to Postgres."""
+
+    database = FakePostgresDatabase()
+    monkeypatch.setattr("upcheck.targets.postgres.connection_factory", database.connect)
+    return database
 
 
 @pytest.fixture
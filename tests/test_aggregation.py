@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+
+import anyio
+import pytest
+from upcheck import aggregation
+from upcheck.aggregation import CheckAggregator, RollupWriter
+from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.targets import CheckTarget, CollectorCheckTarget
+from upcheck.targets.aggregate import AggregatingTarget
+from upcheck.utils.sketch import LatencySketch
+
+
+START = 1594000020000000  # the start of a minute
+FRKL = UrlCheck(url="https://frkl.io")
+FRKL_DEV = UrlCheck(url="https://frkl.dev")
+
+
+def _metric(url_check, seconds, response_time, response_code=200):
+
+    return CheckMetric(
+        url_check=url_check,
+        check_time=START + int(seconds * 1000000),
+        response_time=response_time,
+        response_code=response_code,
+        regex_matched=None,
+    )
+
+
+def test_sketch_percentiles():
+
+    values = list(range(1, 10001))
+    random.Random(42).shuffle(values)
+
+    sketch = LatencySketch(relative_accuracy=0.01)
+    for v in values:
+        sketch.add(v)
+
+    assert sketch.count == 10000
+    assert sketch.min == 1
+    assert sketch.max == 10000
+    assert sketch.mean == 5000.5
+    assert sketch.percentile(50) == pytest.approx(5000, rel=0.01)
+    assert sketch.percentile(99) == pytest.approx(9900, rel=0.01)
+    assert sketch.percentile(100) == 10000
+
+
+def test_sketch_merge():
+
+    a = LatencySketch()
+    b = LatencySketch()
+    for v in range(0, 500):
+        a.add(v)
+    for v in range(500, 1000):
+        b.add(v)
+    a.merge(b)
+
+    assert a.count == 1000
+    assert a.min == 0
+    assert a.max == 999
+    assert a.percentile(50) == pytest.approx(500, rel=0.02)
+
+    with pytest.raises(ValueError):
+        a.merge(LatencySketch(relative_accuracy=0.1))
+
+
+def test_aggregator_tumbling_window():
+
+    aggregator = CheckAggregator(interval=60)
+
+    summaries = aggregator.add(
+        _metric(FRKL, 0, 100),
+        _metric(FRKL, 10, 300, response_code=500),
+        _metric(FRKL_DEV, 20, 50),
+    )
+    assert summaries == []
+
+    summaries = aggregator.add(_metric(FRKL, 61, 200))
+    assert [s.url_check for s in summaries] == [FRKL_DEV, FRKL]
+
+    frkl = summaries[1]
+    assert frkl.start_time_micros == START
+    assert frkl.end_time_micros == START + 60000000
+    assert frkl.count == 2
+    assert frkl.failures == 1
+    assert frkl.response_time_min == 100
+    assert frkl.response_time_max == 300
+    assert frkl.response_time_mean == 200
+    assert frkl.histogram_counts == [0, 1, 0, 1, 0, 0, 0, 0, 0]
+
+    # too late, the first interval was already summarized
+    assert aggregator.add(_metric(FRKL, 30, 100)) == []
+    assert aggregator.late == 1
+
+    summaries = aggregator.flush()
+    assert len(summaries) == 1
+    assert summaries[0].count == 1
+    assert summaries[0].start_time_micros == START + 60000000
+
+
+def test_aggregator_sliding_window():
+
+    aggregator = CheckAggregator(interval=60, window=180, grace=5)
+
+    summaries = []
+    for minute in range(0, 5):
+        summaries.extend(aggregator.add(_metric(FRKL, minute * 60 + 30, minute + 1)))
+    summaries.extend(aggregator.add(_metric(FRKL, 5 * 60 + 6, 100)))
+
+    assert [s.count for s in summaries] == [1, 2, 3, 3, 3]
+    assert [s.response_time_max for s in summaries] == [1, 2, 3, 4, 5]
+    assert summaries[-1].start_time_micros == START + 120000000
+    assert summaries[-1].end_time_micros == START + 300000000
+
+    # late, but still part of open windows
+    aggregator.add(_metric(FRKL, 4 * 60, 1000))
+    assert aggregator.late == 0
+
+    summaries = aggregator.flush()
+    assert [s.count for s in summaries] == [4]
+    assert summaries[0].response_time_max == 1000
+
+
+def test_aggregator_duplicates():
+
+    aggregator = CheckAggregator(interval=60)
+
+    batch = [_metric(FRKL, 0, 100), _metric(FRKL, 30, 200)]
+    aggregator.add(*batch)
+    aggregator.add(*batch)
+    assert aggregator.duplicates == 2
+
+    summaries = aggregator.flush()
+    assert [s.count for s in summaries] == [2]
+
+
+def test_aggregator_duplicates_limit(monkeypatch):
+
+    monkeypatch.setattr(aggregation, "MAX_TRACKED_CHECK_TIMES", 2)
+    aggregator = CheckAggregator(interval=60)
+
+    batch = [_metric(FRKL, 0, 100), _metric(FRKL, 10, 200), _metric(FRKL, 20, 300)]
+    aggregator.add(*batch)
+    aggregator.add(*batch)
+
+    # only the first check times of an interval are kept
+    assert aggregator.duplicates == 2
+    assert [s.count for s in aggregator.flush()] == [4]
+
+
+@pytest.mark.anyio
+async def test_rollup_writer_failed_write():
+
+    written = []
+    failures = [Exception("can't write summaries")]
+
+    async def write_summaries(*summaries):
+        if failures:
+            raise failures.pop()
+        written.extend(summaries)
+
+    rollup = RollupWriter(write_summaries, interval=60)
+    await rollup.add(_metric(FRKL, 0, 100), _metric(FRKL, 30, 200))
+
+    # closes the first interval, but the summary can't be written
+    batch = [_metric(FRKL, 50, 300), _metric(FRKL, 90, 400)]
+    with pytest.raises(Exception):
+        await rollup.add(*batch)
+    assert len(rollup.pending) == 1
+    assert written == []
+
+    # the source re-delivers the batch, the first interval was already summarized
+    await rollup.add(*batch)
+    assert rollup.pending == []
+    assert rollup.aggregator.duplicates == 1
+    assert rollup.aggregator.late == 1
+    assert [s.count for s in written] == [3]
+
+    await rollup.flush()
+    assert [s.count for s in written] == [3, 1]
+
+
+def test_aggregator_close_expired():
+
+    aggregator = CheckAggregator(interval=60, grace=5)
+
+    assert aggregator.add(_metric(FRKL, 0, 100), _metric(FRKL, 30, 200)) == []
+    added = time.monotonic()
+
+    # the newest check time is assumed to advance with the time since it was added
+    assert aggregator.close_expired(now=added + 30) == []
+    summaries = aggregator.close_expired(now=added + 36)
+    assert [s.count for s in summaries] == [2]
+    assert aggregator.close_expired(now=added + 36) == []
+
+    assert aggregator.flush() == []
+
+
+def test_aggregator_invalid_window():
+
+    with pytest.raises(ValueError):
+        CheckAggregator(interval=60, window=90)
+
+
+@pytest.mark.anyio
+async def test_aggregating_target():
+
+    collector = CollectorCheckTarget()
+    target = AggregatingTarget(targets=[collector], interval=60, forward_metrics=True)
+
+    await target.connect()
+    await target.write(_metric(FRKL, 0, 100), _metric(FRKL, 30, 200))
+    await target.write(_metric(FRKL, 90, 300))
+    assert len(collector.summaries) == 1
+    await target.disconnect()
+
+    assert len(collector.results) == 3
+    assert [s.count for s in collector.summaries] == [2, 1]
+    assert collector.summaries[0].percentiles[50] == pytest.approx(100, rel=0.02)
+
+
+@pytest.mark.anyio
+async def test_aggregating_target_run():
+
+    collector = CollectorCheckTarget()
+    target = AggregatingTarget(targets=[collector], interval=0.1)
+
+    await target.connect()
+    metric = CheckMetric(
+        url_check=FRKL,
+        check_time=int(time.time() * 1000000),
+        response_time=100,
+        response_code=200,
+        regex_matched=None,
+    )
+    await target.write(metric)
+
+    # no more metrics arrive, the window is closed anyway
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(target.run)
+        async with anyio.fail_after(5):
+            while not collector.summaries:
+                await anyio.sleep(0.01)
+        await tg.cancel_scope.cancel()
+
+    assert [s.count for s in collector.summaries] == [1]
+    await target.disconnect()
+    assert len(collector.summaries) == 1
+
+
+def test_aggregating_target_config():
+
+    target = CheckTarget.create_from_dict(
+        {"type": "aggregate", "interval": 300, "targets": [{"type": "terminal"}]}
+    )
+    assert isinstance(target, AggregatingTarget)
+    assert target.targets[0].get_id() == "terminal"
+
+
+def test_aggregating_target_unsupported():
+
+    with pytest.raises(UpcheckException):
+        CheckTarget.create_from_dict(
+            {
+                "type": "aggregate",
+                "targets": [{"type": "aggregate", "targets": [{"type": "terminal"}]}],
+            }
+        )
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import threading
+import time
+
+import anyio
+import pytest
+from aiven.client.client import Error as AivenError
+from upcheck.targets.kafka import AivenKafkaTarget
+from upcheck.utils import aiven
+from upcheck.utils.aiven import AivenServiceDiscovery
+
+
+class FakeResponse(object):
+
+    text = "Invalid token"
+
+
+class FakeAivenClient(object):
+    """Stands in for the Aiven API client, and records all requests."""
+
+    requests = []
+    valid_token = "token-1"
+    lock = threading.Lock()
+
+    def __init__(self, base_url, show_http):
+
+        self._token = None
+
+    def set_auth_token(self, token):
+
+        self._token = token
+
+    def _record(self, name):
+
+        with self.lock:
+            self.requests.append(name)
+        if self._token != self.valid_token:
+            raise AivenError(FakeResponse(), status=403)
+
+    def authenticate_user(self, email, password):
+
+        with self.lock:
+            self.requests.append("authenticate_user")
+        return {"token": self.valid_token}
+
+    def get_projects(self):
+
+        self._record("get_projects")
+        # slow enough for concurrent lookups to overlap
+        time.sleep(0.1)
+        return [{"project_name": "project"}]
+
+    def get_services(self, project_name):
+
+        self._record("get_services")
+        return [
+            {
+                "service_name": "kafka-1",
+                "service_type": "kafka",
+                "service_uri_params": {"host": "kafka.example.com", "port": "1234"},
+                "users": [
+                    {
+                        "username": "avnadmin",
+                        "access_key": "KEY",
+                        "access_cert": "CERT",
+                    }
+                ],
+            }
+        ]
+
+    def get_project_ca(self, project_name):
+
+        self._record("get_project_ca")
+        return {"certificate": "CA"}
+
+
+@pytest.fixture
+def fake_aiven(monkeypatch):
+
+    monkeypatch.setattr(aiven, "AivenClient", FakeAivenClient)
+    monkeypatch.setattr(FakeAivenClient, "requests", [])
+    monkeypatch.setattr(FakeAivenClient, "valid_token", "token-1")
+    return FakeAivenClient
+
+
+@pytest.mark.anyio
+async def test_service_discovery_cache(fake_aiven, tmp_path):
+
+    cache_file = os.path.join(tmp_path, "aiven.json")
+    discovery = AivenServiceDiscovery(cache_file=cache_file)
+
+    results = []
+
+    async def discover():
+        results.append(await discovery.discover_service("kafka", "token-1"))
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(5):
+            await tg.spawn(discover)
+
+    assert fake_aiven.requests == ["get_projects", "get_services", "get_project_ca"]
+    details = results[0][0]
+    assert details["host"] == "kafka.example.com"
+    assert details["port"] == 1234
+    assert sorted(cached for _, cached in results) == [False, True, True, True, True]
+    assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o600
+
+    # a new process uses the cache file
+    discovery = AivenServiceDiscovery(cache_file=cache_file)
+    assert discovery.get_service_details("kafka", "token-1") == (details, True)
+    assert len(fake_aiven.requests) == 3
+
+    assert discovery.get_service_details("kafka", "token-1", refresh=True) == (
+        details,
+        False,
+    )
+    assert len(fake_aiven.requests) == 6
+    assert discovery.get_service_details("kafka", "token-1", cache_ttl=0) == (
+        details,
+        False,
+    )
+    assert len(fake_aiven.requests) == 9
+
+    # different credentials don't share cached details
+    with pytest.raises(AivenError):
+        discovery.get_service_details("kafka", "token-2")
+
+
+def test_service_discovery_auth_token(fake_aiven, tmp_path):
+
+    cache_file = os.path.join(tmp_path, "aiven.json")
+    discovery = AivenServiceDiscovery(cache_file=cache_file, cache_ttl=0)
+    discovery.get_service_details("kafka", "password", email="user@example.com")
+    assert fake_aiven.requests.count("authenticate_user") == 1
+
+    # the auth token is cached, and re-used by a new process
+    discovery = AivenServiceDiscovery(cache_file=cache_file, cache_ttl=0)
+    discovery.get_service_details("kafka", "password", email="user@example.com")
+    assert fake_aiven.requests.count("authenticate_user") == 1
+
+    # an expired token is replaced
+    fake_aiven.valid_token = "token-2"
+    discovery = AivenServiceDiscovery(cache_file=cache_file, cache_ttl=0)
+    discovery.get_service_details("kafka", "password", email="user@example.com")
+    assert fake_aiven.requests.count("authenticate_user") == 2
+
+    discovery = AivenServiceDiscovery(cache_file=cache_file, cache_ttl=0)
+    discovery.get_service_details("kafka", "password", email="user@example.com")
+    assert fake_aiven.requests.count("authenticate_user") == 2
+
+
+@pytest.mark.anyio
+async def test_aiven_kafka_target_discovery(fake_aiven, tmp_path, monkeypatch):
+
+    discovery = AivenServiceDiscovery(cache_file=os.path.join(tmp_path, "aiven.json"))
+    monkeypatch.setattr(aiven, "_service_discovery", discovery)
+
+    # creating the target doesn't call the API
+    target = AivenKafkaTarget(topic="checks", password="token-1")
+    other = AivenKafkaTarget(topic="other", password="token-1")
+    assert target.get_id() == "kafka-aiven::default/default/checks"
+    assert fake_aiven.requests == []
+
+    await target._discover()
+    await other._discover()
+    assert len(fake_aiven.requests) == 3
+    assert target._client.host == "kafka.example.com"
+    assert target._client._cafile == other._client._cafile
+    with open(target._client._keyfile) as f:
+        assert f.read() == "KEY"
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import httpx
+import pytest
+from upcheck.exceptions import UpcheckException
+from upcheck.targets import CollectorCheckTarget
+from upcheck.utils.bench import create_url_checks, run_check_benchmark
+from upcheck.utils.standins import StandInHttpServer
+
+
+@pytest.mark.anyio
+async def test_standin_server():
+
+    with StandInHttpServer(body_size=100, error_rate=0.5, seed=1) as server:
+        async with httpx.AsyncClient() as client:
+            codes = set()
+            for _ in range(20):
+                response = await client.get(server.url("/"))
+                assert len(response.content) == 100
+                codes.add(response.status_code)
+            assert codes == {200, 500}
+
+            response = await client.get(server.url("/x", size=10, status=404))
+            assert response.status_code == 404
+            assert len(response.content) == 10
+
+        assert server.requests == 21
+
+
+@pytest.mark.anyio
+async def test_standin_server_hang():
+
+    server = StandInHttpServer(hang_time=30)
+    server.start()
+    try:
+        async with httpx.AsyncClient(timeout=0.2) as client:
+            with pytest.raises(httpx.ReadTimeout):
+                await client.get(server.url("/", hang=1))
+    finally:
+        started = time.perf_counter()
+        server.stop()
+    # hung requests don't block stopping the server
+    assert time.perf_counter() - started < 5
+
+
+def test_create_url_checks():
+
+    url_checks = create_url_checks(
+        "http://localhost:8080",
+        urls=100,
+        latency=10,
+        latency_jitter=20,
+        latency_distribution="exponential",
+        slow_rate=0.2,
+        slow_latency=1000,
+        hang_rate=0.1,
+        body_size=100,
+        body_size_jitter=100,
+        seed=1,
+    )
+    latencies = list(url_checks.values())
+    hung = [u for u, latency in url_checks.items() if latency is None]
+    slow = [latency for latency in latencies if latency == 1000]
+
+    assert 0 < len(hung) < 30
+    assert all("hang=1" in u.url and "latency" not in u.url for u in hung)
+    assert 0 < len(slow) < 40
+    assert all(latency >= 10 for latency in latencies if latency is not None)
+    assert all("size=" in u.url for u in url_checks.keys())
+
+    with pytest.raises(UpcheckException):
+        create_url_checks("http://localhost:8080", latency_distribution="normal")
+    with pytest.raises(UpcheckException):
+        create_url_checks("http://localhost:8080", hang_rate=2)
+
+
+@pytest.mark.anyio
+async def test_check_benchmark(caplog):
+
+    caplog.set_level(logging.CRITICAL, logger="upcheck")
+
+    collector = CollectorCheckTarget()
+    with StandInHttpServer() as server:
+        url_checks = create_url_checks(
+            server.url(), urls=3, latency=10, latency_jitter=10, seed=1
+        )
+        assert all(10 <= latency <= 20 for latency in url_checks.values())
+
+        result = await run_check_benchmark(
+            url_checks, checks=10, targets=[collector], lag_interval=0.001
+        )
+        assert server.requests == 10
+
+    assert len(collector.results) == 10
+    assert result["checks"] == 10
+    assert result["urls"] == 3
+    assert result["response_codes"] == {"200": 10}
+    assert result["checks_per_second"] > 0
+    # response times include the latency of the server
+    assert result["timing_error_ms"]["p50"] >= 0
+    assert result["loop_lag_ms"]["max"] is not None
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 
+import anyio
 import pytest
+from upcheck.exceptions import UpcheckException
 from upcheck.models import CheckMetric, UrlCheck
+from upcheck.sources import CheckSource
 from upcheck.sources.check import ActualCheckCheckSource
-from upcheck.targets import CollectorCheckTarget
+from upcheck.targets import CheckTarget, CollectorCheckTarget
 from upcheck.upcheck import Upcheck
 
 
@@ -45,7 +49,7 @@ async def test_check_regex_match(httpserver):
     await upcheck.start(wait_for_keypress=False)
     result = target.results[0]
 
-    print(result.__dict__)
+    print(result)
 
     assert isinstance(result, CheckMetric)
     assert result.response_code == 200
@@ -114,3 +118,165 @@ async def test_multiple_checks(httpserver):
             assert result.regex_matched is True
         elif result.url_check.regex == "321":
             assert result.regex_matched is False
+
+
+def test_metric_compact():
+
+    metric = CheckMetric(
+        url_check=UrlCheck(url="https://frkl.io"),
+        check_time=1594000000000000,
+        response_time=10,
+        response_code=200,
+        regex_matched=None,
+    )
+
+    assert not hasattr(metric, "__dict__")
+    assert not hasattr(metric.url_check, "__dict__")
+    # report data is created on demand, not stored
+    assert metric.report_data == metric.report_data
+    assert metric.report_data is not metric.report_data
+
+
+class SlowSource(CheckSource):
+    def __init__(self, delay: float = 0, fail: bool = False):
+
+        self._delay = delay
+        self._fail = fail
+
+    def get_id(self) -> str:
+        return "slow"
+
+    async def connect(self) -> None:
+
+        await anyio.sleep(self._delay)
+        if self._fail:
+            raise Exception("source failed")
+
+    async def start(self):  # type: ignore
+
+        for _ in []:
+            yield _
+
+
+class SlowTarget(CheckTarget):
+    def __init__(self, id: str, delay: float = 0, fail: bool = False):
+
+        self._id = id
+        self._delay = delay
+        self._fail = fail
+        self.connected = False
+        self.disconnected = False
+
+    def get_id(self) -> str:
+        return self._id
+
+    async def connect(self) -> None:
+
+        await anyio.sleep(self._delay)
+        if self._fail:
+            raise Exception(f"{self._id} failed")
+        self.connected = True
+
+    async def disconnect(self) -> None:
+
+        await anyio.sleep(self._delay)
+        self.disconnected = True
+
+    async def write(self, *results: CheckMetric) -> None:
+        pass
+
+
+@pytest.mark.anyio
+async def test_connect_concurrently():
+
+    targets = [SlowTarget(f"target_{i}", delay=0.2) for i in range(5)]
+    upcheck = Upcheck(source=SlowSource(delay=0.2), targets=targets)
+
+    start = time.monotonic()
+    await upcheck.connect()
+    assert time.monotonic() - start < 0.6
+    assert all(t.connected for t in targets)
+
+    start = time.monotonic()
+    await upcheck.disconnect()
+    assert time.monotonic() - start < 0.6
+    assert all(t.disconnected for t in targets)
+
+
+@pytest.mark.anyio
+async def test_connect_errors():
+
+    targets = [
+        SlowTarget("ok"),
+        SlowTarget("slow", delay=5),
+        SlowTarget("broken", fail=True),
+    ]
+    upcheck = Upcheck(source=SlowSource(), targets=targets, connect_timeout=0.2)
+
+    with pytest.raises(UpcheckException) as e:
+        await upcheck.connect()
+    assert e.value.msg == "Can't connect to targets: slow, broken"
+    assert "Timed out after 0.2 seconds." in e.value.reason
+    assert "broken failed" in e.value.reason
+    assert targets[0].connected
+
+    upcheck = Upcheck(source=SlowSource(fail=True), targets=targets[:1])
+    with pytest.raises(UpcheckException) as e:
+        await upcheck.connect()
+    assert e.value.msg == "Can't connect to source 'slow'."
+
+
+class EndlessSource(CheckSource):
+    def __init__(self):
+
+        self.acknowledged = 0
+
+    def get_id(self) -> str:
+        return "endless"
+
+    async def start(self):  # type: ignore
+
+        i = 0
+        while True:
+            yield CheckMetric(
+                url_check=UrlCheck(url="https://frkl.io"),
+                check_time=1594000020000000 + i * 1000000,
+                response_time=100,
+                response_code=200,
+                regex_matched=None,
+            )
+            i += 1
+
+    async def acknowledge(self, results, success: bool) -> None:
+
+        self.acknowledged += len(results)
+
+
+class SlowWritingTarget(CollectorCheckTarget):
+    async def write(self, *results: CheckMetric) -> None:
+
+        await anyio.sleep(0.01)
+        await super().write(*results)
+
+
+@pytest.mark.anyio
+async def test_stop_reading():
+
+    source = EndlessSource()
+    target = SlowWritingTarget()
+    upcheck = Upcheck(source=source, targets=[target], max_pending_batches=4)
+
+    async def stop():
+        await anyio.sleep(0.1)
+        await upcheck.stop_reading()
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(stop)
+        async with anyio.fail_after(5):
+            await upcheck.start(wait_for_keypress=False)
+
+    # all results that were read were written and acknowledged
+    assert upcheck.stats["received"] > 0
+    assert upcheck.stats["written"] == upcheck.stats["received"]
+    assert len(target.results) == upcheck.stats["written"]
+    assert source.acknowledged == upcheck.stats["received"]
@@ -5,7 +5,8 @@
 import os
 
 import pytest  # noqa
-from upcheck.models import UrlCheck
+from upcheck.defaults import URL_CHECK_CACHE_SIZE
+from upcheck.models import CheckMetric, UrlCheck, _intern_url_check
 
 
 RESOURCES_FOLDER = os.path.join(os.path.dirname(__file__), "resources")
@@ -53,3 +54,49 @@ def test_read_invalid_url_config():
     with pytest.raises(Exception) as excinfo:
         UrlCheck(url="spiegel.de")
     assert "invalid url (no scheme)" in str(excinfo)
+
+
+def test_intern_url_check():
+
+    check = UrlCheck.intern(url="https://frkl.io", regex="frkl")
+
+    assert check is UrlCheck.intern(url="https://frkl.io", regex="frkl")
+    assert check is not UrlCheck.intern(url="https://frkl.io")
+    assert check == UrlCheck(url="https://frkl.io", regex="frkl")
+
+    metric_1 = CheckMetric.from_dict(
+        {
+            "url": "https://frkl.io",
+            "regex": "frkl",
+            "check_time": 1594000000000000,
+            "response_code": 200,
+            "response_time": 10,
+            "regex_matched": True,
+        }
+    )
+    assert metric_1.url_check is check
+
+    with pytest.raises(Exception) as excinfo:
+        UrlCheck.intern(url="frkl.io")
+    assert "invalid url (no scheme)" in str(excinfo)
+
+
+def test_intern_url_check_cache_size():
+
+    _intern_url_check.cache_clear()
+    first = UrlCheck.intern(url="https://frkl.io/0")
+
+    urls = [f"https://frkl.io/{i}" for i in range(URL_CHECK_CACHE_SIZE + 100)]
+    for url in urls:
+        UrlCheck.intern(url=url)
+
+    # the cache doesn't grow beyond its size, the least recently used objects are dropped
+    assert _intern_url_check.cache_info().currsize == URL_CHECK_CACHE_SIZE
+    check = UrlCheck.intern(url="https://frkl.io/0")
+    assert check is not first
+    assert check == first
+    assert hash(check) == hash(first)
+
+    # recently used objects are still shared
+    assert UrlCheck.intern(url=urls[-1]) is UrlCheck.intern(url=urls[-1])
+    assert UrlCheck.intern(url=urls[-1]) == UrlCheck(url=urls[-1])
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import subprocess
+import sys
 
 import pytest
 from asyncclick.testing import CliRunner
@@ -29,6 +32,10 @@ async def test_cli_help():
     assert result.exit_code == 0
     assert "Listen to a Kafka topic" in result.output
 
+    result = await runner.invoke(main.command, ["bench", "--help"])
+    assert result.exit_code == 0
+    assert "Benchmark checks against a local stand-in server" in result.output
+
 
 @pytest.mark.anyio
 async def test_simple_website_check(httpserver):
@@ -45,3 +52,119 @@ async def test_simple_website_check(httpserver):
     # assert check_url in result.output
     # assert "response_code" in result.output
     # assert "200" in result.output
+
+
+@pytest.mark.anyio
+async def test_bench(tmp_path):
+
+    output = tmp_path / "bench.jsonl"
+    runner = CliRunner()
+    result = await runner.invoke(
+        main.command,
+        [
+            "bench",
+            "--checks",
+            "6",
+            "--urls",
+            "3",
+            "--latency",
+            "5",
+            "--latency-distribution",
+            "exponential",
+            "--latency-jitter",
+            "5",
+            "--slow-rate",
+            "0.5",
+            "--slow-latency",
+            "20",
+            "--json",
+            "--output",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0
+
+    report = json.loads(result.output.strip().splitlines()[-1])
+    assert report["parameters"]["latency_distribution"] == "exponential"
+    assert report["results"]["checks"] == 6
+    assert report["results"]["check_errors"] == 0
+    assert report["results"]["response_codes"] == {"200": 6}
+    assert report["results"]["timing_error_ms"]["mean"] is not None
+    assert json.loads(output.read_text()) == report
+
+
+@pytest.mark.anyio
+async def test_kafka_listen_dashboard_workers(monkeypatch):
+
+    from upcheck.interfaces.cli import kafka_listen
+
+    created = []
+    monkeypatch.setattr(
+        kafka_listen, "UpcheckSupervisor", lambda **kwargs: created.append(kwargs)
+    )
+
+    source = os.path.join(os.path.dirname(__file__), "resources", "kafka_source.yaml")
+    runner = CliRunner()
+    result = await runner.invoke(
+        main.command,
+        ["kafka-listen", "--source", source, "--dashboard", "--workers", "2"],
+    )
+    assert result.exit_code == 1
+    assert created == []
+
+
+IMPORT_CHECK_SCRIPT = """
+import json, sys, time
+
+started = time.perf_counter()
+import upcheck.interfaces.cli
+import upcheck.interfaces.cli.check
+import upcheck.utils.kafka
+duration = time.perf_counter() - started
+
+heavy = ["aiokafka", "aiopg", "httpx", "pkg_resources", "upcheck.interfaces.cli.kafka_listen"]
+print(json.dumps({
+    "duration": duration,
+    "imported": [m for m in heavy if m in sys.modules],
+    "schemas_parsed": upcheck.utils.kafka._get_schemas.cache_info().currsize,
+}))
+"""
+
+
+def test_cli_import_time():
+    """Guard against slow imports creeping back into the cli startup path."""
+
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+    env["PYTHONPATH"] = os.pathsep.join([src, env.get("PYTHONPATH", "")])
+
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_CHECK_SCRIPT],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    result = json.loads(output.decode().strip().splitlines()[-1])
+
+    assert result["imported"] == []
+    assert result["schemas_parsed"] == 0
+    # very generous, it's usually a small fraction of this
+    assert result["duration"] < 2.0
+
+
+def test_kafka_import_without_aiven():
+    """Plain Kafka sources and targets shouldn't load the aiven client (or aiopg)."""
+
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+    env["PYTHONPATH"] = os.pathsep.join([src, env.get("PYTHONPATH", "")])
+
+    script = (
+        "import json, sys\n"
+        "import upcheck.sources.kafka, upcheck.targets.kafka\n"
+        "print(json.dumps([m for m in ('aiven.client', 'aiopg') if m in sys.modules]))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], env=env, check=True, stdout=subprocess.PIPE
+    ).stdout
+    assert json.loads(output.decode().strip().splitlines()[-1]) == []
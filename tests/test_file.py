@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.sources import CheckSource
+from upcheck.sources.file import FileSource
+from upcheck.targets import CheckTarget
+from upcheck.targets.file import FileTarget
+
+
+def _create_metrics(count, start=0):
+
+    return [
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io", regex="frkl"),
+            check_time=1594000020000000 + i * 1000000,
+            response_time=i,
+            response_code=200,
+            regex_matched=True,
+        )
+        for i in range(start, start + count)
+    ]
+
+
+async def _read_all(source):
+
+    batches = []
+    async for batch in source.start_batches():
+        batches.append(batch)
+    return batches
+
+
+@pytest.mark.anyio
+async def test_file_target_and_source(tmp_path):
+
+    target = FileTarget(path=str(tmp_path))
+    await target.connect()
+    await target.write(*_create_metrics(5))
+    await target.write(*_create_metrics(5, start=5))
+    await target.disconnect()
+
+    source = FileSource(path=str(tmp_path), batch_size=4)
+    batches = await _read_all(source)
+    assert [len(b) for b in batches] == [4, 4, 2]
+
+    metrics = [m for b in batches for m in b]
+    assert [m.response_time for m in metrics] == list(range(0, 10))
+    assert metrics[0].url_check == UrlCheck(url="https://frkl.io", regex="frkl")
+    assert metrics[0].regex_matched is True
+    assert metrics[3].check_time_micros == 1594000023000000
+
+
+@pytest.mark.anyio
+async def test_file_target_rotation_and_compression(tmp_path, monkeypatch):
+
+    now = [1594000020000000]
+    monkeypatch.setattr("upcheck.targets.file.now_micros", lambda: now[0])
+
+    target = FileTarget(path=str(tmp_path), rotate_interval=60, compression="gzip")
+    await target.connect()
+    await target.write(*_create_metrics(2))
+    first_segment = target.segment_file
+    now[0] += 30000000
+    await target.write(*_create_metrics(1, start=2))
+    assert target.segment_file == first_segment
+    now[0] += 30000000
+    await target.write(*_create_metrics(3, start=3))
+    await target.disconnect()
+
+    files = sorted(os.listdir(tmp_path))
+    assert files == [
+        "upcheck-20200706T014700Z-0000.ucseg.gz",
+        "upcheck-20200706T014800Z-0000.ucseg.gz",
+    ]
+    assert files[0] == os.path.basename(first_segment) + ".gz"
+
+    source = FileSource(path=str(tmp_path))
+    results = [r async for r in source.start()]
+    assert [m.response_time for m in results] == list(range(0, 6))
+
+
+@pytest.mark.anyio
+async def test_file_source_truncated_segment(tmp_path):
+
+    target = FileTarget(path=str(tmp_path))
+    await target.connect()
+    await target.write(*_create_metrics(3))
+    segment = target.segment_file
+    await target.disconnect()
+
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - 5)
+
+    source = FileSource(path=segment)
+    results = [r async for r in source.start()]
+    assert len(results) == 2
+
+
+@pytest.mark.anyio
+async def test_file_source_reads_in_thread(tmp_path, monkeypatch):
+
+    target = FileTarget(path=str(tmp_path))
+    await target.connect()
+    await target.write(*_create_metrics(5))
+    await target.disconnect()
+
+    threads = []
+    read_batches = FileSource._read_batches
+
+    def _read_batches(self, buffer, path):
+        for batch in read_batches(self, buffer, path):
+            threads.append(threading.current_thread())
+            yield batch
+
+    monkeypatch.setattr(FileSource, "_read_batches", _read_batches)
+
+    source = FileSource(path=str(tmp_path), batch_size=2)
+    batches = await _read_all(source)
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
+
+
+def test_file_config(tmp_path):
+
+    target = CheckTarget.create_from_dict(
+        {"type": "file", "path": str(tmp_path), "compression": "gzip"}
+    )
+    assert isinstance(target, FileTarget)
+
+    source = CheckSource.create_from_dict({"type": "file", "path": str(tmp_path)})
+    assert isinstance(source, FileSource)
+
+    with pytest.raises(ValueError):
+        FileTarget(path=str(tmp_path), compression="zip")
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import pytest
+from upcheck.defaults import URL_FILTER_CACHE_SIZE
+from upcheck.filters import ChangeFilter, CheckResultFilter
+from upcheck.models import CheckMetric, UrlCheck
+
+
+def test_filter_urls():
+
+    f = CheckResultFilter(urls=["https://frkl.io/*", "https://frkl.dev"])
+
+    assert f.match_url("https://frkl.io/blog")
+    assert f.match_url("https://frkl.dev")
+    assert not f.match_url("https://frkl.dev/blog")
+    assert not f.match_url("https://google.com")
+
+
+def test_filter_urls_cache_size():
+
+    f = CheckResultFilter(urls=["https://frkl.io/*"])
+
+    for i in range(URL_FILTER_CACHE_SIZE + 100):
+        assert f.match_url(f"https://frkl.io/{i}")
+    assert not f.match_url("https://frkl.dev")
+
+    assert f._match_url_pattern.cache_info().currsize == URL_FILTER_CACHE_SIZE
+    assert f.match_url("https://frkl.io/0")
+
+
+def test_filter_response_codes():
+
+    f = CheckResultFilter(response_codes=["500-599", 404])
+
+    assert f.match_response_code(404)
+    assert f.match_response_code(503)
+    assert not f.match_response_code(200)
+
+    assert f.match("https://frkl.io", 500)
+
+
+def test_filter_invalid_response_codes():
+
+    with pytest.raises(ValueError):
+        CheckResultFilter(response_codes=["2xx"])
+
+
+def _metric(seconds, response_time, response_code=200, url="https://frkl.io"):
+
+    return CheckMetric(
+        url_check=UrlCheck(url=url),
+        check_time=1594000020000000 + seconds * 1000000,
+        response_time=response_time,
+        response_code=response_code,
+        regex_matched=None,
+    )
+
+
+def test_change_filter():
+
+    f = ChangeFilter(latency_threshold=100, heartbeat_interval=60)
+
+    assert f.match_metric(_metric(0, 200))
+    assert not f.match_metric(_metric(10, 250))
+    # differences are computed against the last metric that passed
+    assert f.match_metric(_metric(20, 300))
+    assert f.match_metric(_metric(30, 300, response_code=503))
+    assert not f.match_metric(_metric(40, 310, response_code=503))
+    assert f.match_metric(_metric(45, 300, url="https://frkl.dev"))
+    # heartbeat
+    assert f.match_metric(_metric(90, 300, response_code=503))
+
+    assert f.suppressed == 2
+
+
+def test_change_filter_latency_ratio():
+
+    f = ChangeFilter(latency_threshold=None, latency_ratio=0.5, heartbeat_interval=None)
+
+    metrics = [_metric(i * 10, rt) for i, rt in enumerate([100, 140, 60, 40, 1000])]
+    assert [m.response_time for m in f.filter(metrics)] == [100, 40, 1000]
+
+
+def test_change_filter_latency_ratio_zero():
+
+    f = ChangeFilter(latency_threshold=None, latency_ratio=0.5, heartbeat_interval=None)
+
+    metrics = [_metric(i * 10, rt) for i, rt in enumerate([0, 1, 3, 4, 6, 20])]
+    assert [m.response_time for m in f.filter(metrics)] == [0, 6, 20]
@@ -1,10 +1,32 @@
 # -*- coding: utf-8 -*-
+import io
+import json
 import os
+from datetime import datetime, timezone
 
+import anyio
 import pytest
+from aiokafka import TopicPartition
+from avro.io import BinaryEncoder, DatumWriter
 from upcheck.exceptions import UpcheckException
+from upcheck.models import CheckMetric, UrlCheck
 from upcheck.sources import CheckSource
 from upcheck.sources.kafka import KafkaSource
+from upcheck.sources.stream import StreamSource
+from upcheck.targets import CheckTarget, CollectorCheckTarget
+from upcheck.targets.aggregate import AggregatingTarget
+from upcheck.targets.kafka import KafkaTarget
+from upcheck.upcheck import Upcheck
+from upcheck.utils.kafka import (
+    CHECK_METRIC_LEGACY_SCHEMA,
+    SCHEMA_VERSION_HEADER,
+    create_message_headers,
+    create_message_key,
+    decode_check_metric,
+    encode_check_metric,
+)
+from upcheck.utils.records import SEGMENT_HEADER, encode_record
+from upcheck.utils.standins import FakeKafkaBroker
 
 
 RESOURCES_FOLDER = os.path.join(os.path.dirname(__file__), "resources")
@@ -47,3 +69,411 @@ async def test_source_create():
         return
 
     assert source._client._consumer is not None
+
+
+def test_decode_check_metric():
+
+    url_check = UrlCheck(url="https://frkl.io", regex="frkl")
+    metric = CheckMetric(
+        url_check=url_check,
+        check_time=1594000000123456,
+        response_time=120,
+        response_code=200,
+        regex_matched=True,
+    )
+
+    value = encode_check_metric(metric)
+    decoded = decode_check_metric(value, create_message_headers(metric))
+
+    assert decoded.url_check == url_check
+    assert decoded.check_time_micros == 1594000000123456
+    assert decoded.check_time == metric.check_time
+    assert decoded.response_time == 120
+    assert decoded.response_code == 200
+    assert decoded.regex_matched is True
+
+
+def test_decode_legacy_check_metric():
+
+    check_time = datetime(2020, 7, 6, 1, 46, 40, 123456, tzinfo=timezone.utc)
+    data = {
+        "url": "https://frkl.io",
+        "check_time": str(check_time),
+        "response_code": 404,
+        "response_time": 80,
+    }
+    bytes_writer = io.BytesIO()
+    DatumWriter(CHECK_METRIC_LEGACY_SCHEMA).write(data, BinaryEncoder(bytes_writer))
+
+    decoded = decode_check_metric(bytes_writer.getvalue())
+
+    assert decoded.url_check.url == "https://frkl.io"
+    assert decoded.url_check.regex is None
+    assert decoded.check_time == check_time
+    assert decoded.response_code == 404
+    assert decoded.regex_matched is None
+
+
+class BatchSource(CheckSource):
+    def __init__(self, *batches):
+
+        self._batches = batches
+        self.acknowledged = []
+
+    def get_id(self) -> str:
+        return "batches"
+
+    async def start(self):  # type: ignore
+
+        for batch in self._batches:
+            for result in batch:
+                yield result
+
+    async def start_batches(self):  # type: ignore
+
+        for batch in self._batches:
+            yield batch
+
+    async def acknowledge(self, results, success: bool) -> None:
+
+        self.acknowledged.append((len(results), success))
+
+
+class FailingTarget(CheckTarget):
+    def get_id(self) -> str:
+        return "failing"
+
+    async def write(self, *results) -> None:
+        raise Exception("write failed")
+
+
+def _create_metric(url: str) -> CheckMetric:
+
+    return CheckMetric(
+        url_check=UrlCheck(url=url),
+        check_time=1594000000000000,
+        response_time=10,
+        response_code=200,
+        regex_matched=None,
+    )
+
+
+@pytest.mark.anyio
+async def test_source_batches_acknowledged():
+
+    batches = [
+        [_create_metric("https://frkl.io"), _create_metric("https://frkl.dev")],
+        [_create_metric("https://frkl.io")],
+    ]
+    source = BatchSource(*batches)
+    target = CollectorCheckTarget()
+
+    upcheck = Upcheck(source=source, targets=[target])
+    await upcheck.start(wait_for_keypress=False)
+
+    assert len(target.results) == 3
+    assert source.acknowledged == [(2, True), (1, True)]
+
+
+@pytest.mark.anyio
+async def test_source_batches_not_acknowledged_on_failure():
+
+    source = BatchSource([_create_metric("https://frkl.io")])
+    target = CollectorCheckTarget()
+
+    upcheck = Upcheck(source=source, targets=[target, FailingTarget()])
+    await upcheck.start(wait_for_keypress=False)
+
+    assert len(target.results) == 1
+    assert source.acknowledged == [(1, False)]
+
+
+def _create_broker(monkeypatch, *metrics: CheckMetric) -> FakeKafkaBroker:
+    """Create an in-process broker with the metrics in the 'check_metrics' topic, used by all Kafka clients."""
+
+    broker = FakeKafkaBroker()
+    monkeypatch.setattr("upcheck.utils.kafka.broker_factory", lambda host, port: broker)
+    for metric in metrics:
+        broker.append(
+            "check_metrics",
+            encode_check_metric(metric),
+            key=create_message_key(metric),
+            headers=create_message_headers(metric),
+        )
+    return broker
+
+
+@pytest.mark.anyio
+async def test_kafka_source_flow_control(monkeypatch):
+
+    tp = TopicPartition("check_metrics", 0)
+    metrics = [_create_metric("https://frkl.io")] * 4
+    broker = _create_broker(monkeypatch, *metrics)
+
+    source = KafkaSource(
+        host="localhost",
+        port=9092,
+        topic="check_metrics",
+        batch_max_records=2,
+        retry_interval=0,
+        pause_high_watermark=4,
+        pause_low_watermark=2,
+    )
+
+    batches = source.start_batches()
+    first = await batches.__anext__()
+    second = await batches.__anext__()
+    assert source.pending == 4
+
+    consumer = await source._client.get_consumer()
+    source._apply_flow_control(consumer)
+    assert consumer.paused() == {tp}
+
+    await source.acknowledge(first, success=True)
+    assert broker.committed("upcheck", "check_metrics") == 2
+    source._apply_flow_control(consumer)
+    assert not consumer.paused()
+
+    await source.acknowledge(second, success=False)
+    assert broker.committed("upcheck", "check_metrics") == 2
+    assert consumer.position(tp) == 2
+    assert source.pending == 0
+
+    await batches.aclose()
+
+
+@pytest.mark.anyio
+async def test_kafka_source_filter(monkeypatch):
+
+    error_metric = CheckMetric(
+        url_check=UrlCheck(url="https://frkl.io/blog"),
+        check_time=1594000000000000,
+        response_time=10,
+        response_code=503,
+        regex_matched=None,
+    )
+    broker = _create_broker(
+        monkeypatch,
+        _create_metric("https://frkl.io"),
+        error_metric,
+        _create_metric("https://google.com"),
+    )
+
+    source = KafkaSource(
+        host="localhost",
+        port=9092,
+        topic="check_metrics",
+        filters={"urls": ["https://frkl.io*"], "response_codes": ["500-599"]},
+    )
+
+    batches = source.start_batches()
+    results = await batches.__anext__()
+
+    assert len(results) == 1
+    assert results[0].url_check.url == "https://frkl.io/blog"
+
+    await source.acknowledge(results, success=True)
+    assert broker.committed("upcheck", "check_metrics") == 3
+
+    await batches.aclose()
+
+
+def _stream_metrics(count):
+
+    return [
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io"),
+            check_time=1594000020000000 + i * 1000000,
+            response_time=i,
+            response_code=200,
+            regex_matched=None,
+        )
+        for i in range(count)
+    ]
+
+
+async def _read_stream(source):
+
+    return [r async for r in source.start()]
+
+
+@pytest.mark.anyio
+async def test_stream_source_ndjson(tmp_path):
+
+    path = os.path.join(tmp_path, "results.ndjson")
+    lines = [json.dumps(m.report_data) for m in _stream_metrics(500)]
+    # a summary, an invalid line, and a missing newline at the end
+    lines.insert(10, json.dumps({"url": "https://frkl.io", "start_time": 0}))
+    lines.insert(20, "{invalid")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+    source = CheckSource.create_from_dict(
+        {"type": "stream", "path": path, "chunk_size": 100}
+    )
+    assert isinstance(source, StreamSource)
+
+    results = await _read_stream(source)
+    assert [r.response_time for r in results] == list(range(500))
+    assert source.skipped == 2
+
+
+@pytest.mark.anyio
+async def test_stream_source_ndjson_line_too_large(tmp_path):
+
+    path = os.path.join(tmp_path, "results.ndjson")
+    lines = [json.dumps(m.report_data) for m in _stream_metrics(3)]
+    lines.insert(1, "x" * 1000)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    source = StreamSource(path=path, chunk_size=64, max_record_size=256)
+    results = await _read_stream(source)
+    assert [r.response_time for r in results] == [0, 1, 2]
+    assert source.skipped == 1
+
+
+@pytest.mark.anyio
+async def test_stream_source_binary(tmp_path):
+
+    path = os.path.join(tmp_path, "results.bin")
+    with open(path, "wb") as f:
+        # two concatenated segments, the last record truncated
+        for metrics in [_stream_metrics(100), _stream_metrics(50)]:
+            f.write(SEGMENT_HEADER)
+            f.write(b"".join(encode_record(m) for m in metrics))
+        f.write(encode_record(_stream_metrics(1)[0])[:-3])
+
+    source = StreamSource(path=path, chunk_size=100)
+    results = await _read_stream(source)
+    assert len(results) == 150
+    assert results[99].response_time == 99
+    assert results[149].response_time == 49
+
+
+@pytest.mark.anyio
+async def test_kafka_source_passthrough_aggregate(monkeypatch):
+
+    metrics = [_create_metric("https://frkl.io"), _create_metric("https://frkl.dev")]
+    _create_broker(monkeypatch, *metrics)
+
+    source = KafkaSource(
+        host="localhost", port=9092, topic="check_metrics", passthrough=True
+    )
+    collector = CollectorCheckTarget()
+    target = AggregatingTarget(targets=[collector], interval=60)
+    await target.connect()
+
+    batches = source.start_batches()
+    results = await batches.__anext__()
+    await target.write(*results)
+    await source.acknowledge(results, success=True)
+    await batches.aclose()
+    await target.disconnect()
+
+    assert sorted(s.url_check.url for s in collector.summaries) == [
+        "https://frkl.dev",
+        "https://frkl.io",
+    ]
+    assert [s.failures for s in collector.summaries] == [0, 0]
+
+
+@pytest.mark.anyio
+async def test_kafka_source_passthrough_invalid_message(monkeypatch):
+
+    metric = _create_metric("https://frkl.io")
+    broker = _create_broker(monkeypatch, metric)
+    broker.append(
+        "check_metrics",
+        b"invalid",
+        key=create_message_key(metric),
+        headers=create_message_headers(metric),
+    )
+    broker.append(
+        "check_metrics",
+        encode_check_metric(metric),
+        key=create_message_key(metric),
+        headers=[(SCHEMA_VERSION_HEADER, b"99")],
+    )
+
+    source = KafkaSource(
+        host="localhost", port=9092, topic="check_metrics", passthrough=True
+    )
+    batches = source.start_batches()
+    results = await batches.__anext__()
+    await batches.aclose()
+
+    # only the valid message is forwarded, the others can't stall the partition
+    assert [r.url_check.url for r in results] == ["https://frkl.io"]
+
+
+@pytest.mark.anyio
+async def test_kafka_source_filter_invalid_key(monkeypatch):
+
+    metric = _create_metric("https://frkl.io")
+    broker = _create_broker(monkeypatch)
+    broker.append(
+        "check_metrics",
+        encode_check_metric(metric),
+        key=b"https://frkl.io/\xff",
+        headers=create_message_headers(metric),
+    )
+    other = _create_metric("https://frkl.dev")
+    broker.append(
+        "check_metrics",
+        encode_check_metric(other),
+        key=create_message_key(other),
+        headers=create_message_headers(other),
+    )
+
+    source = KafkaSource(
+        host="localhost",
+        port=9092,
+        topic="check_metrics",
+        filters={"urls": ["https://frkl.dev*"]},
+    )
+    batches = source.start_batches()
+    results = await batches.__anext__()
+    await batches.aclose()
+    assert [r.url_check.url for r in results] == ["https://frkl.dev"]
+
+
+@pytest.mark.anyio
+async def test_kafka_source_to_target_standin(monkeypatch):
+
+    metrics = [_create_metric(f"https://frkl.io/{i}") for i in range(10)]
+    source_broker = _create_broker(monkeypatch, *metrics)
+    target_broker = FakeKafkaBroker(latency=1, failure_rate=0.3, seed=2)
+    brokers = {9092: source_broker, 9093: target_broker}
+    monkeypatch.setattr(
+        "upcheck.utils.kafka.broker_factory", lambda host, port: brokers[port]
+    )
+
+    source = KafkaSource(
+        host="localhost",
+        port=9092,
+        topic="check_metrics",
+        batch_max_records=3,
+        batch_timeout_ms=10,
+        retry_interval=0,
+        passthrough=True,
+    )
+    target = KafkaTarget(host="localhost", port=9093, topic="mirror")
+    upcheck = Upcheck(source=source, targets=[target])
+    await upcheck.connect()
+
+    async def mirror():
+        await upcheck.start(wait_for_keypress=False)
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(mirror)
+        async with anyio.fail_after(10):
+            while source_broker.committed("upcheck", "check_metrics") != 10:
+                await anyio.sleep(0.01)
+        await tg.cancel_scope.cancel()
+    await upcheck.disconnect()
+
+    # failed batches are re-read, so every message arrives at least once
+    mirrored = {m.key for m in target_broker.messages("mirror")}
+    assert mirrored == {create_message_key(m) for m in metrics}
+    assert target_broker.failures > 0
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import anyio
+import pytest
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.spool import Spool
+from upcheck.targets import CheckTarget, CollectorCheckTarget
+from upcheck.targets.spool import SpoolingTarget
+
+
+def _create_metrics(count, start=0):
+
+    return [
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io"),
+            check_time=1594000020000000 + i * 1000000,
+            response_time=i,
+            response_code=200,
+            regex_matched=None,
+        )
+        for i in range(start, start + count)
+    ]
+
+
+class UnavailableTarget(CollectorCheckTarget):
+    def __init__(self):
+
+        self.available = False
+        super().__init__(id="unavailable")
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if not self.available:
+            raise Exception("Target not available.")
+        await super().write(*results)
+
+
+def test_spool_read_commit(tmp_path):
+
+    spool = Spool(path=str(tmp_path), segment_size=1024, max_size=1024 * 1024)
+    assert not spool.pending
+
+    spool.append(_create_metrics(100))
+    assert spool.pending
+    assert len([f for f in os.listdir(tmp_path) if f.endswith(".spool")]) > 1
+
+    metrics, position = spool.read(max_records=60)
+    assert [m.response_time for m in metrics] == list(range(0, 60))
+
+    # not committed, so we read the same metrics again
+    metrics, position = spool.read(max_records=60)
+    assert metrics[0].response_time == 0
+    spool.commit(position)
+
+    metrics, position = spool.read(max_records=60)
+    assert [m.response_time for m in metrics] == list(range(60, 100))
+    spool.commit(position)
+    assert not spool.pending
+    spool.close()
+
+
+def test_spool_reopen(tmp_path):
+
+    spool = Spool(path=str(tmp_path), fsync="always")
+    spool.append(_create_metrics(10))
+    metrics, position = spool.read(max_records=4)
+    spool.commit(position)
+    spool.close()
+
+    spool = Spool(path=str(tmp_path))
+    spool.append(_create_metrics(2, start=10))
+    metrics, position = spool.read()
+    assert [m.response_time for m in metrics] == list(range(4, 12))
+    assert metrics[0].check_time_micros == 1594000024000000
+    spool.close()
+
+
+def test_spool_truncated_record(tmp_path):
+
+    spool = Spool(path=str(tmp_path))
+    spool.append(_create_metrics(3))
+    spool.close()
+
+    segment = os.path.join(tmp_path, [f for f in os.listdir(tmp_path)][0])
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - 5)
+
+    spool = Spool(path=str(tmp_path))
+    metrics, position = spool.read()
+    assert len(metrics) == 2
+    spool.commit(position)
+    assert not spool.pending
+
+
+def test_spool_max_size(tmp_path):
+
+    spool = Spool(path=str(tmp_path), segment_size=512, max_size=2048)
+    spool.append(_create_metrics(200))
+
+    assert spool.size <= 2048
+    metrics, _ = spool.read(max_records=1000)
+    assert 0 < len(metrics) < 200
+    assert metrics[-1].response_time == 199
+
+
+@pytest.mark.anyio
+async def test_spooling_target(tmp_path):
+
+    inner = UnavailableTarget()
+    target = SpoolingTarget(target=inner, path=str(tmp_path), retry_interval=0)
+
+    await target.connect()
+    await target.write(*_create_metrics(5))
+    await target.write(*_create_metrics(5, start=5))
+    assert inner.results == []
+    assert target.spool.pending
+
+    inner.available = True
+    await target.write(*_create_metrics(5, start=10))
+    assert [m.response_time for m in inner.results] == list(range(0, 15))
+    assert not target.spool.pending
+
+    await target.write(*_create_metrics(1, start=15))
+    assert len(inner.results) == 16
+    await target.disconnect()
+
+
+class UnreachableTarget(CollectorCheckTarget):
+    def __init__(self):
+
+        self.reachable = False
+        self.connected = False
+        super().__init__(id="unreachable")
+
+    async def connect(self) -> None:
+
+        if not self.reachable:
+            raise Exception("Target not reachable.")
+        self.connected = True
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if not self.connected:
+            raise Exception("Target not connected.")
+        await super().write(*results)
+
+
+@pytest.mark.anyio
+async def test_spooling_target_reconnect(tmp_path):
+
+    inner = UnreachableTarget()
+    target = SpoolingTarget(target=inner, path=str(tmp_path), retry_interval=0)
+
+    await target.connect()
+    await target.write(*_create_metrics(5))
+    assert target.spool.pending
+
+    inner.reachable = True
+    await target.write(*_create_metrics(5, start=5))
+    assert inner.connected
+    assert [m.response_time for m in inner.results] == list(range(0, 10))
+    assert not target.spool.pending
+    await target.disconnect()
+
+
+@pytest.mark.anyio
+async def test_spooling_target_bounded_replay(tmp_path):
+
+    inner = UnavailableTarget()
+    target = SpoolingTarget(
+        target=inner,
+        path=str(tmp_path),
+        retry_interval=0,
+        replay_batch_size=5,
+        replay_max_batches=2,
+    )
+
+    await target.connect()
+    await target.write(*_create_metrics(30))
+    inner.available = True
+
+    # every write only replays a limited number of batches
+    await target.write(*_create_metrics(1, start=30))
+    assert len(inner.results) == 10
+    assert target.spool.pending
+
+    for i in range(31, 34):
+        await target.write(*_create_metrics(1, start=i))
+    assert [m.response_time for m in inner.results] == list(range(0, 34))
+    assert not target.spool.pending
+    await target.disconnect()
+
+
+@pytest.mark.anyio
+async def test_spooling_target_background_replay(tmp_path):
+
+    inner = UnavailableTarget()
+    target = SpoolingTarget(
+        target=inner,
+        path=str(tmp_path),
+        retry_interval=0.05,
+        replay_batch_size=5,
+        replay_max_batches=2,
+    )
+
+    # spool files are only accessed from worker threads
+    append = target.spool.append
+    threads = []
+
+    def check_append(metrics):
+        threads.append(threading.get_ident())
+        append(metrics)
+
+    target.spool.append = check_append
+
+    await target.connect()
+    await target.write(*_create_metrics(30))
+    assert threads and threading.get_ident() not in threads
+    inner.available = True
+
+    # the spool is drained without further writes
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(target.run)
+        async with anyio.fail_after(5):
+            while target.spool.pending:
+                await anyio.sleep(0.05)
+        await tg.cancel_scope.cancel()
+
+    assert [m.response_time for m in inner.results] == list(range(0, 30))
+    await target.disconnect()
+
+
+def test_spooling_target_config(tmp_path):
+
+    target = CheckTarget.create_from_dict(
+        {"type": "spool", "path": str(tmp_path), "target": {"type": "terminal"}}
+    )
+    assert target.get_id() == "spool::terminal"
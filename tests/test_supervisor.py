@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+from upcheck.exceptions import UpcheckException
+from upcheck.supervisor import UpcheckSupervisor
+
+
+RESOURCES_FOLDER = os.path.join(os.path.dirname(__file__), "resources")
+
+
+def test_supervisor_invalid_workers():
+
+    with pytest.raises(UpcheckException):
+        UpcheckSupervisor(
+            source_config=os.path.join(RESOURCES_FOLDER, "kafka_source.yaml"),
+            target_configs=[],
+            workers=0,
+        )
+
+
+def test_supervisor_single_process_targets(tmp_path):
+
+    target_config = tmp_path / "spool.yaml"
+    target_config.write_text(
+        "type: spool\ntarget:\n  type: aggregate\n  targets:\n    - type: sqlite\n"
+    )
+    source_config = os.path.join(RESOURCES_FOLDER, "kafka_source.yaml")
+
+    with pytest.raises(UpcheckException) as excinfo:
+        UpcheckSupervisor(
+            source_config=source_config,
+            target_configs=[
+                os.path.join(RESOURCES_FOLDER, "postgres_target.yaml"),
+                str(target_config),
+            ],
+            workers=2,
+        )
+    assert "spool, sqlite" in excinfo.value.reason
+
+    # fine with a single worker
+    UpcheckSupervisor(
+        source_config=source_config, target_configs=[str(target_config)], workers=1
+    )
+
+
+def test_supervisor_writes_to_stdout(tmp_path):
+
+    source_config = os.path.join(RESOURCES_FOLDER, "kafka_source.yaml")
+    stdout_config = tmp_path / "stdout.yaml"
+    stdout_config.write_text("type: changes\ntargets:\n  - type: ndjson\n")
+    fd_config = tmp_path / "fd.yaml"
+    fd_config.write_text("type: ndjson\nfd: 3\n")
+
+    supervisor = UpcheckSupervisor(
+        source_config=source_config, target_configs=[str(fd_config)], workers=2
+    )
+    assert not supervisor.writes_to_stdout
+    supervisor = UpcheckSupervisor(
+        source_config=source_config,
+        target_configs=[str(fd_config), str(stdout_config)],
+        workers=2,
+    )
+    assert supervisor.writes_to_stdout
+
+
+@pytest.mark.anyio
+async def test_supervisor_worker_fails_on_start():
+
+    supervisor = UpcheckSupervisor(
+        source_config=os.path.join(RESOURCES_FOLDER, "kafka_source_invalid.yaml"),
+        target_configs=[],
+        workers=2,
+    )
+
+    with pytest.raises(UpcheckException) as excinfo:
+        await supervisor.start(wait_for_keypress=False)
+
+    assert "failed after" in excinfo.value.msg
+    assert supervisor.stats["written"] == 0
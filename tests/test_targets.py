@@ -1,11 +1,35 @@
 # -*- coding: utf-8 -*-
+import io
+import json
 import os
+import sqlite3
+import threading
+import time
 
+import anyio
+import httpx
 import pytest
+from avro.io import BinaryEncoder, DatumWriter
+from rich.console import Console
 from upcheck.exceptions import UpcheckException
-from upcheck.targets import CheckTarget
+from upcheck.models import CheckMetric, UrlCheck
+from upcheck.targets import CheckTarget, CollectorCheckTarget
 from upcheck.targets.kafka import KafkaTarget
+from upcheck.targets.ndjson import NdjsonTarget
 from upcheck.targets.postgres import PostgresTarget
+from upcheck.targets.prometheus import PrometheusTarget
+from upcheck.targets.sqlite import SqliteTarget
+from upcheck.targets.terminal import TerminalTarget, sparkline
+from upcheck.utils.kafka import (
+    CHECK_METRIC_LEGACY_SCHEMA,
+    EncodedCheckMetric,
+    create_message_headers,
+    create_message_key,
+    decode_check_summary,
+    encode_check_metric,
+)
+from upcheck.utils.columns import ColumnarCheckMetrics
+from upcheck.utils.standins import StandInError
 
 
 RESOURCES_FOLDER = os.path.join(os.path.dirname(__file__), "resources")
@@ -44,3 +68,598 @@ def test_kafka_target_config_invalid():
 
     with pytest.raises(UpcheckException):
         CheckTarget.create_from_file(config_file)
+
+
+@pytest.mark.anyio
+async def test_kafka_target_passthrough(kafka_standin):
+
+    metric = CheckMetric(
+        url_check=UrlCheck(url="https://frkl.io"),
+        check_time=1594000000000000,
+        response_time=10,
+        response_code=200,
+        regex_matched=None,
+    )
+    value = encode_check_metric(metric)
+    key = create_message_key(metric)
+    headers = create_message_headers(metric)
+
+    legacy_data = dict(metric.report_data)
+    legacy_data["check_time"] = str(metric.check_time)
+    legacy_data.pop("regex")
+    legacy_data.pop("regex_matched")
+    legacy_value = io.BytesIO()
+    DatumWriter(CHECK_METRIC_LEGACY_SCHEMA).write(
+        legacy_data, BinaryEncoder(legacy_value)
+    )
+
+    encoded = EncodedCheckMetric(value, key, headers)
+    legacy = EncodedCheckMetric(legacy_value.getvalue())
+
+    broker = kafka_standin
+    target = KafkaTarget(host="localhost", port=9092, topic="check_metrics")
+    await target.connect()
+
+    await target.write(encoded)
+
+    sent = broker.messages("check_metrics")
+    assert [(m.value, m.key, m.headers) for m in sent] == [(value, key, headers)]
+    assert encoded.response_time == 10
+    assert encoded.is_up
+
+    # messages without schema version header need to be re-encoded
+    await target.write(legacy)
+
+    assert (sent[1].value, sent[1].key, sent[1].headers) == (value, key, headers)
+
+    with pytest.raises(Exception):
+        EncodedCheckMetric(b"invalid", key, headers)
+
+
+@pytest.mark.anyio
+async def test_collector_target_columnar():
+
+    frkl = UrlCheck(url="https://frkl.io")
+    frkl_regex = UrlCheck(url="https://frkl.io", regex="frkl")
+
+    metrics = []
+    for i in range(1, 101):
+        metrics.append(
+            CheckMetric(
+                url_check=frkl,
+                check_time=1594000000000000 + i,
+                response_time=i,
+                response_code=200 if i % 10 else 500,
+                regex_matched=None,
+            )
+        )
+    metrics.append(
+        CheckMetric(
+            url_check=frkl_regex,
+            check_time=1594000000000000,
+            response_time=20,
+            response_code=200,
+            regex_matched=True,
+        )
+    )
+
+    target = CollectorCheckTarget(columnar=True)
+    await target.write(*metrics)
+
+    columns = target.columns
+    assert len(columns) == 101
+    assert columns.counts() == {frkl: 100, frkl_regex: 1}
+    assert columns.error_counts() == {frkl: 10}
+    assert columns.mean_response_times() == {frkl: 50.5, frkl_regex: 20}
+
+    percentiles = columns.response_time_percentiles(50, 99)
+    assert percentiles[frkl] == {50: 50.5, 99: pytest.approx(99.01)}
+    assert percentiles[frkl_regex] == {50: 20, 99: 20}
+
+    results = target.results
+    assert len(results) == 101
+    assert results[-1].url_check is frkl_regex
+    assert results[-1].regex_matched is True
+    assert results[0].report_data == metrics[0].report_data
+
+
+def test_columnar_metrics_invalid_value():
+
+    columns = ColumnarCheckMetrics(_create_metrics((0, 100)))
+
+    invalid = CheckMetric(
+        url_check=UrlCheck(url="https://frkl.dev"),
+        check_time=1594000000000000,
+        response_time=10,
+        response_code=70000,
+        regex_matched=None,
+    )
+    with pytest.raises(OverflowError):
+        columns.append(invalid)
+
+    # the columns still line up
+    assert len(columns) == 1
+    assert [len(c) for c in columns._columns] == [1] * 5
+    assert columns.checks == [UrlCheck(url="https://frkl.io")]
+
+    columns.extend(_create_metrics((10, 200)))
+    assert [m.response_time for m in columns] == [100, 200]
+    assert columns.counts() == {UrlCheck(url="https://frkl.io"): 2}
+
+
+def _create_metrics(*seconds_and_response_times):
+
+    return [
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io"),
+            check_time=1594000020000000 + seconds * 1000000,
+            response_time=response_time,
+            response_code=200,
+            regex_matched=None,
+        )
+        for seconds, response_time in seconds_and_response_times
+    ]
+
+
+@pytest.mark.anyio
+async def test_kafka_target_rollup(kafka_standin):
+
+    target = KafkaTarget(
+        host="localhost",
+        port=9092,
+        topic="check_metrics",
+        rollup_interval=60,
+        write_raw=False,
+    )
+    await target.connect()
+
+    await target.write(*_create_metrics((0, 100), (10, 200), (20, 300)))
+    assert kafka_standin.messages("check_metrics-summaries") == []
+
+    await target.write(*_create_metrics((70, 100)))
+    assert kafka_standin.messages("check_metrics") == []
+    sent = kafka_standin.messages("check_metrics-summaries")
+    assert len(sent) == 1
+
+    assert sent[0].key == b"https://frkl.io"
+    summary = decode_check_summary(sent[0].value, sent[0].headers)
+    assert summary.count == 3
+    assert summary.response_time_mean == 200
+    assert summary.end_time_micros == 1594000080000000
+    assert summary.percentiles[50] == pytest.approx(200, rel=0.02)
+
+    await target.disconnect()
+    assert len(sent) == 2
+
+
+def test_kafka_target_rollup_invalid():
+
+    with pytest.raises(UpcheckException):
+        KafkaTarget(host="localhost", port=9092, topic="check_metrics", write_raw=False)
+
+
+@pytest.mark.anyio
+async def test_postgres_target_rollup(postgres_standin):
+
+    target = PostgresTarget(
+        username="upcheck",
+        password="upcheck",
+        dbname="upcheck",
+        rollup_interval=300,
+    )
+
+    await target.write(*_create_metrics((0, 100), (150, 500), (400, 200)))
+
+    assert len(postgres_standin.rows("check_results")) == 3
+    assert len(postgres_standin.rows("check_summaries")) == 1
+
+    args = postgres_standin.rows("check_summaries")[0]
+    assert args[0] == "https://frkl.io"
+    assert args[3] - args[2] == 300000000
+    assert args[4:6] == (2, 0)
+    assert args[6:9] == (100, 500, 300)
+
+
+@pytest.mark.anyio
+async def test_postgres_target_standin_failures(postgres_standin):
+
+    database = postgres_standin
+    database.latency = 1
+    database.failure_rate = 1
+    target = PostgresTarget(username="upcheck", password="upcheck", dbname="upcheck")
+    with pytest.raises(UpcheckException):
+        await target.connect()
+
+    database.failure_rate = 0
+    await target.connect()
+    assert database.connections == 1
+
+    database.failure_rate = 1
+    with pytest.raises(StandInError):
+        await target.write(*_create_metrics((0, 100)))
+
+    database.failure_rate = 0
+    await target.write(*_create_metrics((20, 300)))
+    assert database.rows("check_results")[0][3] == 300
+    assert database.failures == 2
+
+    await target.disconnect()
+
+
+@pytest.mark.anyio
+async def test_postgres_target_concurrent_writes(postgres_standin):
+
+    # the stand-in fails if queries overlap on the same connection
+    postgres_standin.latency = 1
+    target = PostgresTarget(
+        username="upcheck", password="upcheck", dbname="upcheck", rollup_interval=1
+    )
+    await target.connect()
+
+    async def write(offset):
+        for i in range(20):
+            await target.write(*_create_metrics((offset + i * 2, 100)))
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(target.run)
+        async with anyio.create_task_group() as writers:
+            await writers.spawn(write, 0)
+            await writers.spawn(write, 1)
+            await writers.spawn(write, 1000)
+        await tg.cancel_scope.cancel()
+
+    await target.disconnect()
+    assert len(postgres_standin.rows("check_results")) == 60
+    assert postgres_standin.rows("check_summaries")
+
+
+@pytest.mark.anyio
+async def test_sqlite_target(tmp_path):
+
+    db_file = os.path.join(tmp_path, "upcheck.db")
+    target = CheckTarget.create_from_dict(
+        {"type": "sqlite", "path": db_file, "rollup_interval": 300}
+    )
+    assert isinstance(target, SqliteTarget)
+
+    await target.connect()
+    await target.write(*_create_metrics((0, 100), (150, 500), (400, 200)))
+    await target.disconnect()
+
+    connection = sqlite3.connect(db_file)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    rows = connection.execute(
+        "SELECT url, start_time, response_time_ms, response_code, regex_match FROM check_results ORDER BY id"
+    ).fetchall()
+    assert [r[2] for r in rows] == [100, 500, 200]
+    assert rows[0] == ("https://frkl.io", 1594000020000000, 100, 200, None)
+
+    summaries = connection.execute(
+        "SELECT start_time, end_time, check_count, response_time_mean_ms, histogram_counts FROM check_summaries ORDER BY start_time"
+    ).fetchall()
+    assert len(summaries) == 2
+    assert summaries[0][1] - summaries[0][0] == 300000000
+    assert summaries[0][2:4] == (2, 300)
+    assert sum(json.loads(summaries[0][4])) == 2
+
+    indexes = {
+        r[0]
+        for r in connection.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    }
+    assert "check_results_url_start_time_idx" in indexes
+    connection.close()
+
+
+def _count_rows(db_file, table):
+
+    connection = sqlite3.connect(db_file)
+    try:
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.mark.anyio
+async def test_sqlite_target_batch(tmp_path, monkeypatch):
+
+    db_file = os.path.join(tmp_path, "upcheck.db")
+    target = SqliteTarget(path=db_file, batch_size=3)
+    await target.connect()
+
+    await target.write(*_create_metrics((0, 100), (10, 200)))
+    assert _count_rows(db_file, "check_results") == 0
+    await target.write(*_create_metrics((20, 300)))
+    assert _count_rows(db_file, "check_results") == 3
+
+    # a failed write only keeps the results of earlier writes
+    await target.write(*_create_metrics((30, 400)))
+
+    def fail(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(target, "_insert_many", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        await target.write(*_create_metrics((40, 500), (50, 600)))
+    monkeypatch.undo()
+
+    await target.disconnect()
+    assert _count_rows(db_file, "check_results") == 4
+
+
+@pytest.mark.anyio
+async def test_sqlite_target_concurrent_writes(tmp_path):
+
+    db_file = os.path.join(tmp_path, "upcheck.db")
+    target = SqliteTarget(
+        path=db_file, batch_size=1, flush_interval=0.01, rollup_interval=1
+    )
+    await target.connect()
+
+    # transactions must not overlap, as they share the same connection
+    insert_many = target._insert_many
+    active = []
+
+    def check_insert_many(*args):
+        assert not active
+        active.append(args)
+        try:
+            time.sleep(0.002)
+            insert_many(*args)
+        finally:
+            active.remove(args)
+
+    target._insert_many = check_insert_many
+
+    async def write(offset):
+        for i in range(50):
+            await target.write(*_create_metrics((offset + i * 2, 100)))
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(target.run)
+        async with anyio.create_task_group() as writers:
+            await writers.spawn(write, 0)
+            await writers.spawn(write, 1)
+            await writers.spawn(write, 1000)
+        await tg.cancel_scope.cancel()
+
+    await target.disconnect()
+    assert _count_rows(db_file, "check_results") == 150
+    assert _count_rows(db_file, "check_summaries") > 0
+
+
+@pytest.mark.anyio
+async def test_prometheus_target():
+
+    target = CheckTarget.create_from_dict(
+        {"type": "prometheus", "port": 0, "histogram_bounds": [100, 250]}
+    )
+    assert isinstance(target, PrometheusTarget)
+
+    metrics = _create_metrics((0, 100), (10, 200), (20, 300))
+    metrics.append(
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io"),
+            check_time=1594000050000000,
+            response_time=50,
+            response_code=503,
+            regex_matched=None,
+        )
+    )
+
+    await target.connect()
+    try:
+        await target.write(*metrics)
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{target.port}/metrics")
+            not_found = await client.get(f"http://127.0.0.1:{target.port}/other")
+    finally:
+        await target.disconnect()
+
+    assert response.status_code == 200
+    assert not_found.status_code == 404
+    lines = response.text.splitlines()
+
+    labels = 'url="https://frkl.io"'
+    assert f'upcheck_response_time_seconds_bucket{{{labels},le="0.1"}} 2' in lines
+    assert f'upcheck_response_time_seconds_bucket{{{labels},le="0.25"}} 3' in lines
+    assert f'upcheck_response_time_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f"upcheck_response_time_seconds_sum{{{labels}}} 0.65" in lines
+    assert f'upcheck_responses_total{{{labels},code="200"}} 3' in lines
+    assert f'upcheck_responses_total{{{labels},code="503"}} 1' in lines
+    assert f"upcheck_last_check_timestamp_seconds{{{labels}}} 1594000050" in lines
+    assert f"upcheck_up{{{labels}}} 0" in lines
+
+
+@pytest.mark.anyio
+async def test_changes_target():
+
+    collector = CollectorCheckTarget()
+    target = CheckTarget.create_from_dict(
+        {"type": "changes", "targets": [collector], "heartbeat_interval": 60}
+    )
+
+    await target.write(*_create_metrics((0, 100), (10, 110), (20, 90), (70, 100)))
+    assert [m.check_time_micros for m in collector.results] == [
+        1594000020000000,
+        1594000090000000,
+    ]
+    assert target.supports_summaries
+
+
+class FailingOnceTarget(CollectorCheckTarget):
+    def __init__(self):
+
+        super().__init__()
+        self.failed = False
+
+    async def write(self, *results: CheckMetric) -> None:
+
+        if not self.failed:
+            self.failed = True
+            raise Exception("Can't write results.")
+        await super().write(*results)
+
+
+@pytest.mark.anyio
+async def test_changes_target_failed_write():
+
+    collector = FailingOnceTarget()
+    target = CheckTarget.create_from_dict(
+        {"type": "changes", "targets": [collector], "heartbeat_interval": 60}
+    )
+
+    batch = _create_metrics((0, 100), (70, 100))
+    with pytest.raises(Exception):
+        await target.write(*batch)
+    assert target.filter.suppressed == 0
+
+    # re-delivered after the failed write, the changes still need to be forwarded
+    await target.write(*batch)
+    assert [m.check_time_micros for m in collector.results] == [
+        1594000020000000,
+        1594000090000000,
+    ]
+
+    await target.write(*_create_metrics((80, 100)))
+    assert len(collector.results) == 2
+    assert target.filter.suppressed == 1
+
+
+def test_sparkline():
+
+    assert sparkline([]) == ""
+    assert sparkline([5, 5]) == "▁▁"
+    assert sparkline([0, 50, 100]) == "▁▄█"
+
+
+@pytest.mark.anyio
+async def test_terminal_target_dashboard():
+
+    output = io.StringIO()
+    console = Console(file=output, width=120, force_terminal=True)
+    target = TerminalTarget(console=console, dashboard=True, refresh_rate=1000)
+
+    await target.connect()
+    for i in range(200):
+        await target.write(*_create_metrics((i, 100 + i)))
+    await target.write(
+        CheckMetric(
+            url_check=UrlCheck(url="https://frkl.io"),
+            check_time=1594000500000000,
+            response_time=20,
+            response_code=500,
+            regex_matched=None,
+        )
+    )
+    await target.disconnect()
+
+    assert target.dashboard.version == 201
+    text = output.getvalue()
+    # only the latest state is rendered, not every result
+    assert text.count("https://frkl.io") < 50
+    assert "201" in text
+
+
+@pytest.mark.anyio
+async def test_terminal_target_dashboard_no_terminal():
+
+    output = io.StringIO()
+    console = Console(file=output, width=120)
+    target = TerminalTarget(console=console, dashboard=True)
+
+    await target.connect()
+    await target.write(*_create_metrics((0, 100), (10, 300)))
+    assert output.getvalue() == ""
+    await target.disconnect()
+
+    text = output.getvalue()
+    assert text.count("https://frkl.io") == 1
+    assert "300 ms" in text
+
+
+@pytest.mark.anyio
+async def test_ndjson_target(tmp_path):
+
+    path = os.path.join(tmp_path, "results.ndjson")
+    target = CheckTarget.create_from_dict(
+        {"type": "ndjson", "path": path, "batch_size": 2, "flush_interval": 60}
+    )
+    assert isinstance(target, NdjsonTarget)
+
+    await target.connect()
+    await target.write(*_create_metrics((0, 100), (10, 200), (20, 300)))
+    for _ in range(100):
+        if os.path.exists(path) and os.path.getsize(path):
+            break
+        await anyio.sleep(0.01)
+    with open(path) as f:
+        assert len(f.readlines()) == 3
+    await target.write(*_create_metrics((30, 400)))
+    await target.disconnect()
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["response_time"] for line in lines] == [100, 200, 300, 400]
+    assert lines[0] == {
+        "url": "https://frkl.io",
+        "check_time": 1594000020000000,
+        "response_code": 200,
+        "response_time": 100,
+        "regex": None,
+        "regex_matched": None,
+    }
+
+
+@pytest.mark.anyio
+async def test_ndjson_target_fd_flush_interval():
+
+    read_fd, write_fd = os.pipe()
+    target = NdjsonTarget(fd=write_fd, flush_interval=0.05)
+    await target.connect()
+    await target.write(*_create_metrics((0, 100)))
+
+    data = await anyio.run_in_thread(os.read, read_fd, 4096)
+    assert json.loads(data)["response_time"] == 100
+    await target.disconnect()
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+@pytest.mark.anyio
+async def test_ndjson_target_stuck_output(monkeypatch):
+
+    monkeypatch.setattr("upcheck.targets.ndjson.STOP_TIMEOUT", 0.2)
+    read_fd, write_fd = os.pipe()
+    target = NdjsonTarget(fd=write_fd, batch_size=10)
+    await target.connect()
+
+    # nobody reads from the pipe, so the writer thread blocks once its buffer is full
+    metrics = _create_metrics(*[(i, 100) for i in range(10)])
+    for _ in range(1000):
+        await target.write(*metrics)
+
+    async with anyio.fail_after(5):
+        await target.disconnect()
+
+    # unblock the writer thread, it stops after the batch it was writing
+    os.set_blocking(read_fd, False)
+    while any(t.name == "upcheck-ndjson" for t in threading.enumerate()):
+        try:
+            os.read(read_fd, 65536)
+        except BlockingIOError:
+            await anyio.sleep(0.01)
+    os.close(write_fd)
+    os.close(read_fd)
+
+
+def test_ndjson_target_writes_to_stdout(tmp_path):
+
+    assert NdjsonTarget().writes_to_stdout
+    assert not NdjsonTarget(fd=3).writes_to_stdout
+    assert not NdjsonTarget(path=os.path.join(tmp_path, "r.ndjson")).writes_to_stdout
+
+    target = CheckTarget.create_from_dict(
+        {"type": "changes", "targets": [{"type": "terminal"}, {"type": "ndjson"}]}
+    )
+    assert target.writes_to_stdout